@@ -0,0 +1,231 @@
+import pandas as pd
+from datetime import datetime
+from common import db, trading_calendar, raw_cache
+
+# =========================================================
+# 快取覆蓋區間（取代 date_span 單一 [start, end] 的模型）
+#   表：date_coverage(target_table, idx_key, start_date, end_date)
+#   - 同一個 (target_table, idx_key) 底下存「互不重疊、不相鄰」的已覆蓋區間
+#   - 日期一律 YYYY-MM-DD，區間含頭含尾
+#   - 只有真的抓成功的區段才標記，中途失敗的部分下次會再被算成缺口
+# =========================================================
+
+TABLE = "date_coverage"
+ONE_DAY = pd.Timedelta(days=1)
+
+DateLike = datetime | pd.Timestamp | str
+
+
+def _ts(d: DateLike) -> pd.Timestamp:
+    return pd.Timestamp(d).normalize()
+
+def _dstr(t: pd.Timestamp) -> str:
+    return t.strftime("%Y-%m-%d")
+
+def _key(idx_key) -> str:
+    # idx_key 是 PK 的一部分，不能為 NULL
+    return "" if idx_key is None else str(idx_key)
+
+
+def covered_ranges(
+    target_table: str,
+    idx_key,
+    start: DateLike | None = None,
+    end: DateLike | None = None,
+) -> list[tuple[pd.Timestamp, pd.Timestamp]]:
+    """
+    回傳已覆蓋區間（依起日排序）；有給 start/end 時只回傳與之重疊的部分
+    raw_cache 為 replay 模式時一律回傳 []：所有範圍都當成缺口，讓 fetcher 重新從快取解析
+    """
+    if raw_cache.get_mode() == "replay":
+        return []
+    sql = f"""
+        SELECT start_date, end_date FROM {TABLE}
+        WHERE target_table = ? AND idx_key = ?
+    """
+    params: list = [target_table, _key(idx_key)]
+    if end is not None:
+        sql += " AND start_date <= ?"
+        params.append(_dstr(_ts(end)))
+    if start is not None:
+        sql += " AND end_date >= ?"
+        params.append(_dstr(_ts(start)))
+    sql += " ORDER BY start_date"
+
+    df = db.query_to_df(sql, tuple(params))
+    return [(_ts(s), _ts(e)) for s, e in zip(df["start_date"], df["end_date"])]
+
+
+def subtract_ranges(
+    start: pd.Timestamp,
+    end: pd.Timestamp,
+    ranges: list[tuple[pd.Timestamp, pd.Timestamp]],
+) -> list[tuple[pd.Timestamp, pd.Timestamp]]:
+    """[start, end] 扣掉 ranges（需依起日排序）後剩下的區段"""
+    gaps = []
+    cur = start
+    for s, e in ranges:
+        if e < cur:
+            continue
+        if s > end:
+            break
+        if s > cur:
+            gaps.append((cur, min(s - ONE_DAY, end)))
+        cur = max(cur, e + ONE_DAY)
+        if cur > end:
+            break
+    if cur <= end:
+        gaps.append((cur, end))
+    return gaps
+
+
+def missing_ranges(
+    target_table: str,
+    idx_key,
+    start: DateLike,
+    end: DateLike,
+) -> list[tuple[pd.Timestamp, pd.Timestamp]]:
+    """
+    回傳 [start, end] 中尚未覆蓋的最少區段
+    例：已覆蓋 [1/1~1/10]、[1/20~1/31]，要 [1/5~2/5] → [(1/11, 1/19), (2/1, 2/5)]
+    """
+    req_s, req_e = _ts(start), _ts(end)
+    if req_s > req_e:
+        raise ValueError("start_date 不可大於 end_date")
+    return subtract_ranges(req_s, req_e, covered_ranges(target_table, idx_key, req_s, req_e))
+
+
+def _mark_covered_conn(conn, target_table: str, idx_key: str, s: pd.Timestamp, e: pd.Timestamp):
+    """在既有交易內把 [s, e] 併入覆蓋區間（含相鄰區間合併）"""
+    rows = conn.execute(
+        f"""
+        SELECT start_date, end_date FROM {TABLE}
+        WHERE target_table = ? AND idx_key = ?
+          AND start_date <= ? AND end_date >= ?
+        """,
+        (target_table, idx_key, _dstr(e + ONE_DAY), _dstr(s - ONE_DAY)),
+    ).fetchall()
+
+    new_s = min([s] + [_ts(r[0]) for r in rows])
+    new_e = max([e] + [_ts(r[1]) for r in rows])
+
+    conn.executemany(
+        f"DELETE FROM {TABLE} WHERE target_table = ? AND idx_key = ? AND start_date = ?",
+        [(target_table, idx_key, r[0]) for r in rows],
+    )
+    conn.execute(
+        f"""
+        INSERT INTO {TABLE} (target_table, idx_key, start_date, end_date, updated_at)
+        VALUES (?, ?, ?, ?, strftime('%s','now'))
+        """,
+        (target_table, idx_key, _dstr(new_s), _dstr(new_e)),
+    )
+
+
+def mark_covered(target_table: str, idx_key, start: DateLike, end: DateLike):
+    """把 [start, end] 標記為已覆蓋；與重疊 / 相鄰的既有區間在同一個交易內合併"""
+    s, e = _ts(start), _ts(end)
+    if s > e:
+        return
+    db.write(_mark_covered_conn, target_table, _key(idx_key), s, e)
+
+
+def _mark_covered_many_conn(conn, target_table: str, spans: list[tuple[str, pd.Timestamp, pd.Timestamp]]):
+    for idx_key, s, e in spans:
+        _mark_covered_conn(conn, target_table, idx_key, s, e)
+
+
+def mark_covered_many(target_table: str, spans):
+    """
+    一次標記多個 (idx_key, start, end)，全部在同一個交易內完成
+    例：全市場日報一個 request 拿到所有股票 → 每檔股票各標記當天
+    """
+    items = [(_key(k), _ts(s), _ts(e)) for k, s, e in spans]
+    items = [t for t in items if t[1] <= t[2]]
+    if items:
+        db.write(_mark_covered_many_conn, target_table, items)
+
+
+# =========================================================
+# 依 API 查詢粒度展開缺口
+#   缺口內完全沒有交易日的部分直接標記覆蓋，不打 API
+#   （只限交易日曆已知範圍內；推估出來的日子可能只是日曆沒載到，不能當成假日）
+# =========================================================
+def mark_no_trading(cal, target_table: str, idx_key, s: DateLike, e: DateLike):
+    """
+    [s, e] 內沒有交易日時呼叫：標記到 min(settled_end(e), cal.last_known) 為止
+    沒有已知日曆（last_known 為 None）時一律不標記
+    """
+    if cal.last_known is None:
+        return
+    covered_e = settled_end(e)
+    if covered_e is None:
+        return
+    covered_e = min(covered_e, pd.Timestamp(cal.last_known))
+    if _ts(s) <= covered_e:
+        mark_covered(target_table, idx_key, s, covered_e)
+
+
+def month_jobs(
+    target_table: str,
+    idx_key,
+    start: DateLike,
+    end: DateLike,
+) -> list[tuple[pd.Timestamp, pd.Timestamp, pd.Timestamp]]:
+    """
+    一個 request 查一整個月的 API：回傳 [(月初, 該月在缺口內的起, 迄)]
+    寫入成功後標記 (起, 迄) 即可；只剩週末 / 春節的月份直接標記，不列入
+    """
+    cal = trading_calendar.get_calendar()
+    jobs = []
+    for fs, fe in missing_ranges(target_table, idx_key, start, end):
+        m_start = fs.replace(day=1)
+        while m_start <= fe:
+            clip_s = max(m_start, fs)
+            clip_e = min(m_start + pd.offsets.MonthEnd(0), fe)
+            if cal.count_between(clip_s, clip_e) == 0:
+                mark_no_trading(cal, target_table, idx_key, clip_s, clip_e)
+            else:
+                jobs.append((m_start, clip_s, clip_e))
+            m_start = m_start + pd.offsets.MonthBegin(1)
+    return jobs
+
+
+def day_jobs(
+    target_table: str,
+    idx_key,
+    start: DateLike,
+    end: DateLike,
+) -> list[tuple[pd.Timestamp, pd.Timestamp, pd.Timestamp]]:
+    """
+    一個 request 查一個交易日的 API：回傳 [(交易日, 標記起, 標記迄)]
+    標記範圍連同前面的非交易日（缺口最後一天則延伸到缺口結尾），週末 / 連假不會留下缺口
+    """
+    cal = trading_calendar.get_calendar()
+    jobs = []
+    for fs, fe in missing_ranges(target_table, idx_key, start, end):
+        days = list(cal.trading_days(fs, fe))
+        if not days:
+            mark_no_trading(cal, target_table, idx_key, fs, fe)
+            continue
+        span_s = fs
+        for i, day in enumerate(days):
+            span_e = days[i + 1] - ONE_DAY if i + 1 < len(days) else fe
+            jobs.append((day, span_s, span_e))
+            span_s = span_e + ONE_DAY
+    return jobs
+
+
+def settled_end(end: DateLike, last_data_date: DateLike | None = None) -> pd.Timestamp | None:
+    """
+    抓完 [..., end] 之後，可以放心標記覆蓋到哪一天
+    - end 早於今天：整段都算（沒資料 = 本來就沒有，例如假日、停牌）
+    - end 含今天以後：只算到實際拿到的最後一天，還沒開出的日子留給下次補
+    回傳 None 表示這次不能標記任何覆蓋
+    """
+    e = _ts(end)
+    if e < pd.Timestamp.today().normalize():
+        return e
+    if last_data_date is None or pd.isna(last_data_date):
+        return None
+    return min(e, _ts(last_data_date))
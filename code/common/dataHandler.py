@@ -1,8 +1,8 @@
 import os
 import sqlite3
 import pandas as pd
-from datetime import datetime, timedelta
-import time
+from datetime import datetime
+from common import db, trading_calendar, scheduler
 
 
 # ---------- 設定 ----------
@@ -10,89 +10,151 @@ data_center = "../data_center"
 DB_PATH = os.path.join(data_center, "data_center.db")
 os.makedirs(data_center, exist_ok=True)
 
+# 本 process 已確認過 unique key 的表
+_keyed_tables: set[tuple[str, tuple[str, ...]]] = set()
+
+# ---------- 內部工具 ----------
+def _table_exists(table_name: str) -> bool:
+    return db.query_single_value(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)
+    ) is not None
+
+def _ensure_keyed_table(df: pd.DataFrame, table_name: str, key_cols: list[str]):
+    """
+    確保表存在且在 key_cols 上有 UNIQUE index
+    舊表（以前 append + 全表去重寫入的）第一次遇到重複列時，只做一次去重再建 index
+    """
+    cache_key = (table_name, tuple(key_cols))
+    if cache_key in _keyed_tables:
+        return
+
+    with db.get_connection() as conn:
+        if not _table_exists(table_name):
+            df.head(0).to_sql(table_name, conn, index=False)
+
+        key_sql = ",".join(db._q(k) for k in key_cols)
+        index_name = db._q(f"ux_{table_name}_{'_'.join(key_cols)}")
+        create_index = f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} ON {db._q(table_name)} ({key_sql})"
+        try:
+            conn.execute(create_index)
+        except sqlite3.IntegrityError:
+            conn.execute(f"""
+                DELETE FROM {db._q(table_name)}
+                WHERE rowid NOT IN (
+                    SELECT MIN(rowid) FROM {db._q(table_name)} GROUP BY {key_sql}
+                )
+            """)
+            conn.execute(create_index)
+        conn.commit()
+
+    _keyed_tables.add(cache_key)
+
 # ---------- 核心函數 ----------
-def save_to_db(df: pd.DataFrame, table_name: str, time_col: str = "time"):
+def save_to_db(
+    df: pd.DataFrame,
+    table_name: str,
+    time_col: str = "time",
+    key_cols: list[str] | None = None,
+    overwrite: bool = False,
+):
     """
     將資料存入 SQLite，若表格不存在自動建立
-    自動去重 (以 time_col 為基準)
+    以 key_cols（預設 [time_col]）做 UNIQUE key 去重：
+      - overwrite=False：已存在的 key 保留舊資料（與過去「保留最早寫入」一致）
+      - overwrite=True ：以新資料覆寫
     """
     if df.empty:
         return
 
-    conn = sqlite3.connect(DB_PATH)
-    # 建表
-    df.to_sql(table_name, conn, if_exists='append', index=False)
-    # 去重
-    conn.execute(f"""
-        DELETE FROM {table_name}
-        WHERE rowid NOT IN (
-            SELECT MIN(rowid)
-            FROM {table_name}
-            GROUP BY {time_col}
-        )
-    """)
-    conn.commit()
-    conn.close()
-    print(f"✅ 已存入 {table_name} 表格")
+    key_cols = key_cols or [time_col]
+    _ensure_keyed_table(df, table_name, key_cols)
+    res = db.bulk_upsert(table_name, df, key_cols, update_cols=None if overwrite else [])
+    if res is not None:
+        print(f"✅ 已存入 {table_name} 表格（新增 {res['inserted']} / 更新 {res['updated']}）")
 
 def day_exists(table_name: str, date_str: str, time_col: str = "time") -> bool:
-    """檢查某日資料是否存在"""
-    if not os.path.exists(DB_PATH):
+    """檢查某日資料是否存在（前綴範圍查詢，可走 time_col 上的 index）"""
+    if not os.path.exists(DB_PATH) or not _table_exists(table_name):
         return False
-    conn = sqlite3.connect(DB_PATH)
-    query = f"SELECT 1 FROM {table_name} WHERE {time_col} LIKE '{date_str}%' LIMIT 1;"
-    exists = conn.execute(query).fetchone() is not None
-    conn.close()
-    return exists
+    sql = f"SELECT 1 FROM {db._q(table_name)} WHERE {db._q(time_col)} >= ? AND {db._q(time_col)} < ? LIMIT 1"
+    return db.query_single_value(sql, (date_str, date_str + "\uffff")) is not None
 
-def read_data(table_name: str, start: str = None, end: str = None) -> pd.DataFrame:
+def read_data(table_name: str, start: str = None, end: str = None, time_col: str = "time") -> pd.DataFrame:
     """讀取表格資料，可指定日期範圍"""
-    if not os.path.exists(DB_PATH):
+    if not os.path.exists(DB_PATH) or not _table_exists(table_name):
         return pd.DataFrame()
-    conn = sqlite3.connect(DB_PATH)
-    sql = f"SELECT * FROM {table_name}"
+    sql = f"SELECT * FROM {db._q(table_name)}"
+    col = db._q(time_col)
+    params: tuple = ()
     if start and end:
-        sql += f" WHERE time BETWEEN '{start}' AND '{end}'"
+        sql += f" WHERE {col} BETWEEN ? AND ?"
+        params = (start, end)
     elif start:
-        sql += f" WHERE time >= '{start}'"
+        sql += f" WHERE {col} >= ?"
+        params = (start,)
     elif end:
-        sql += f" WHERE time <= '{end}'"
-    df = pd.read_sql(sql, conn)
-    conn.close()
-    return df
+        sql += f" WHERE {col} <= ?"
+        params = (end,)
+    return db.query_to_df(sql, params)
 
 # ---------- 自動更新 ----------
-def auto_update_day(api_name, endpoint, date: datetime, fetch_api):
+def auto_update_day(api_name, endpoint, date: datetime, fetch_api, key_cols: list[str] | None = None) -> bool:
     """
     fetch_api(api_name, endpoint, date_str) -> DataFrame (需有 time 欄位)
+    key_cols: 寫入時的 unique key，預設只用 time
+    回傳是否真的呼叫了 fetch_api（已存在而跳過時為 False）
     """
     date_str = date.strftime("%Y-%m-%d")
     if day_exists(api_name, date_str):
         print(f"📌 {date_str} 已存在，跳過")
-        return
+        return False
 
     df_new = fetch_api(api_name, endpoint, date.strftime("%Y%m%d"))
     if df_new.empty:
         print(f"⚠️ {date_str} 無資料")
-        return
+        return True
 
-    save_to_db(df_new, api_name)
+    save_to_db(df_new, api_name, key_cols=key_cols)
     print(f"✅ {date_str} 更新完成")
+    return True
+
+def auto_update_range(api_name, endpoint, start: datetime, end: datetime, fetch_api, sleep_sec=2, key_cols: list[str] | None = None, workers: int = 3):
+    """
+    批次更新區間資料：只跑交易日、已存在的日子不打 API
+    抓取平行進行，但速率仍維持「每 sleep_sec 秒最多一次」；寫入依日期順序
+    """
+    days = [
+        d.to_pydatetime()
+        for d in trading_calendar.get_calendar().trading_days(start, end)
+    ]
+    todo = []
+    for d in days:
+        if day_exists(api_name, d.strftime("%Y-%m-%d")):
+            print(f"📌 {d.strftime('%Y-%m-%d')} 已存在，跳過")
+        else:
+            todo.append(d)
+    if not todo:
+        return
 
-def auto_update_range(api_name, endpoint, start: datetime, end: datetime, fetch_api, sleep_sec=2):
-    """批次更新區間資料"""
-    cur = start
-    while cur <= end:
-        auto_update_day(api_name, endpoint, cur, fetch_api)
-        cur += timedelta(days=1)
-        time.sleep(sleep_sec)
+    bucket = scheduler.TokenBucket(rate=1 / sleep_sec if sleep_sec > 0 else 1000, burst=1)
+    with scheduler.FetchScheduler(max_workers=workers) as sch:
+        fetch = lambda d: fetch_api(api_name, endpoint, d.strftime("%Y%m%d"))
+        for d, df_new, err in sch.imap(fetch, todo, bucket=bucket):
+            date_str = d.strftime("%Y-%m-%d")
+            if err is not None:
+                print(f"❌ {date_str} 抓取失敗：{err}")
+                continue
+            if df_new is None or df_new.empty:
+                print(f"⚠️ {date_str} 無資料")
+                continue
+            save_to_db(df_new, api_name, key_cols=key_cols)
+            print(f"✅ {date_str} 更新完成")
 
 # ---------- View 建立 ----------
 def create_view(view_name: str, sql: str):
     """建立 SQLite View"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute(f"DROP VIEW IF EXISTS {view_name}")
-    conn.execute(f"CREATE VIEW {view_name} AS {sql}")
-    conn.commit()
-    conn.close()
-    print(f"📌 已建立 View: {view_name}")
\ No newline at end of file
+    with db.get_connection() as conn:
+        conn.execute(f"DROP VIEW IF EXISTS {view_name}")
+        conn.execute(f"CREATE VIEW {view_name} AS {sql}")
+        conn.commit()
+    print(f"📌 已建立 View: {view_name}")
@@ -0,0 +1,123 @@
+import re
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+# =========================================================
+# 民國日期轉換（全專案共用）
+#   - 向量版：整欄 '114/01/02' → epoch day（1970-01-01 起算的天數）→ ISO 字串 / unix ts
+#     只用整數運算，不建 datetime 物件
+#   - 純量版：roc_to_unix() 等用 re + 整數運算解析單一字串（不走 pandas），再加上有上限的 lru_cache
+#   - unix ts 一律是「台北時間當天 00:00」（UTC+8），不受執行環境的時區影響
+#     （與在台灣機器上用 datetime(...).timestamp() 算出的舊資料相同）
+# =========================================================
+
+ROC_OFFSET = 1911
+TAIPEI_UTC_OFFSET_SEC = 8 * 60 * 60
+SEC_PER_DAY = 24 * 60 * 60
+SCALAR_CACHE_SIZE = 8192
+
+_ROC_RE = r"^(\d{2,3})[/.\-](\d{1,2})[/.\-](\d{1,2})$"
+_ROC_PATTERN = re.compile(_ROC_RE)
+_DAYS_IN_MONTH = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+
+def _days_from_civil(y: np.ndarray, m: np.ndarray, d: np.ndarray) -> np.ndarray:
+    """西元年月日 → epoch day（proleptic Gregorian，整數運算；ndarray 或 int 皆可）"""
+    y = y - (m <= 2)
+    era = y // 400
+    yoe = y - era * 400
+    doy = (153 * ((m + 9) % 12) + 2) // 5 + d - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def _valid(y: np.ndarray, m: np.ndarray, d: np.ndarray) -> np.ndarray:
+    ok = (m >= 1) & (m <= 12) & (d >= 1)
+    leap = (y % 4 == 0) & ((y % 100 != 0) | (y % 400 == 0))
+    dim = _DAYS_IN_MONTH[np.clip(m, 0, 12)] + (leap & (m == 2))
+    return ok & (d <= dim)
+
+
+# =========================
+# 向量版
+# =========================
+def _parse_unique(uniq: pd.Series) -> pd.Series:
+    parts = uniq.astype("string").str.strip().str.extract(_ROC_RE)
+    ok = parts[0].notna().to_numpy().copy()
+    out = np.zeros(len(uniq), dtype="int64")
+    if ok.any():
+        y = parts[0][ok].astype("int64").to_numpy() + ROC_OFFSET
+        m = parts[1][ok].astype("int64").to_numpy()
+        d = parts[2][ok].astype("int64").to_numpy()
+        idx = np.flatnonzero(ok)
+        out[idx] = _days_from_civil(y, m, d)
+        ok[idx[~_valid(y, m, d)]] = False
+    return pd.Series(pd.arrays.IntegerArray(out, ~ok))
+
+
+def roc_to_epoch_day(s) -> pd.Series:
+    """
+    民國日期（'114/01/02'、'114.1.2'、'114-01-02'）整欄 → epoch day（Int64）
+    格式不對 / 不存在的日期（例如 114/02/30）→ <NA>
+    數十年的日資料也只有幾千個不同日期：只解析不重複的字串，再依索引展開
+    """
+    s = pd.Series(s, dtype=object) if not isinstance(s, pd.Series) else s
+    codes, uniq = pd.factorize(s, use_na_sentinel=False)
+    days = _parse_unique(pd.Series(uniq, dtype=object)).array.take(codes)
+    return pd.Series(days, index=s.index)
+
+
+def epoch_day_to_iso(days: pd.Series) -> pd.Series:
+    """epoch day → 'YYYY-MM-DD'（<NA> → NaN）"""
+    na = days.isna().to_numpy()
+    iso = days.fillna(0).to_numpy(dtype="int64").astype("datetime64[D]").astype(str).astype(object)
+    iso[na] = np.nan
+    return pd.Series(iso, index=days.index)
+
+
+def epoch_day_to_ts(days: pd.Series) -> pd.Series:
+    """epoch day → 台北時間當天 00:00 的 unix ts（Int64）"""
+    return days * SEC_PER_DAY - TAIPEI_UTC_OFFSET_SEC
+
+
+def roc_to_iso_array(s) -> pd.Series:
+    return epoch_day_to_iso(roc_to_epoch_day(s))
+
+
+def roc_to_ts_array(s) -> pd.Series:
+    return epoch_day_to_ts(roc_to_epoch_day(s))
+
+
+# =========================
+# 純量版（有上限的記憶）
+# =========================
+@lru_cache(maxsize=SCALAR_CACHE_SIZE)
+def _roc_epoch_day(roc_date: str) -> int | None:
+    m = _ROC_PATTERN.match(roc_date)
+    if m is None:
+        return None
+    y, mo, d = int(m[1]) + ROC_OFFSET, int(m[2]), int(m[3])
+    if not (1 <= mo <= 12 and d >= 1):
+        return None
+    leap = y % 4 == 0 and (y % 100 != 0 or y % 400 == 0)
+    if d > int(_DAYS_IN_MONTH[mo]) + (leap and mo == 2):
+        return None
+    return int(_days_from_civil(y, mo, d))
+
+
+def roc_to_unix(roc_date: str) -> int | None:
+    """'114/01/02' → 台北時間 2025-01-02 00:00 的 unix ts；格式不對回傳 None"""
+    if roc_date is None:
+        return None
+    day = _roc_epoch_day(str(roc_date).strip())
+    return None if day is None else day * SEC_PER_DAY - TAIPEI_UTC_OFFSET_SEC
+
+
+def roc_to_datetime(roc_date: str) -> datetime | None:
+    """'114/01/02' → datetime(2025, 1, 2)（naive，當天 00:00）；格式不對回傳 None"""
+    if roc_date is None:
+        return None
+    day = _roc_epoch_day(str(roc_date).strip())
+    return None if day is None else datetime(1970, 1, 1) + timedelta(days=day)
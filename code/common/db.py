@@ -1,22 +1,99 @@
-import sys, os
-sys.path.append(os.path.dirname(__file__))
-
+import os
 import sqlite3
+import threading
+import atexit
 import pandas as pd
+from common import migrations, db_writer
 from contextlib import contextmanager
 from pathlib import Path
 
 # 資料庫路徑
 DB_PATH = Path("../data_center/data_center.db")
 
+# 連線參數：WAL 讓讀取不會被寫入擋住；其餘為效能調校
+BUSY_TIMEOUT_SEC = 10
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",     # WAL 模式下 NORMAL 已可保證一致性
+    "cache_size": -64000,        # 負值 = KiB，約 64MB page cache
+    "mmap_size": 268435456,      # 256MB memory-mapped I/O
+    "temp_store": "MEMORY",
+    "busy_timeout": BUSY_TIMEOUT_SEC * 1000,
+}
+
+# ---------- 連線池：每個 thread / process 各自保有一條常駐連線 ----------
+_local = threading.local()
+_pool_lock = threading.Lock()
+_pool: list[tuple[threading.Thread, sqlite3.Connection]] = []
+_schema_key = None  # 已跑過 migrations.migrate() 的 (pid, DB_PATH)
+
+def _open_connection() -> sqlite3.Connection:
+    """開一條新連線並套用 PRAGMAS；順便關掉已結束 thread 留下的連線"""
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_SEC, check_same_thread=False)
+    for key, value in PRAGMAS.items():
+        conn.execute(f"PRAGMA {key} = {value}")
+    with _pool_lock:
+        dead = [c for t, c in _pool if not t.is_alive()]
+        _pool[:] = [(t, c) for t, c in _pool if t.is_alive()]
+        _pool.append((threading.current_thread(), conn))
+    for c in dead:
+        try:
+            c.close()
+        except sqlite3.Error:
+            pass
+    return conn
+
+def _thread_connection() -> sqlite3.Connection:
+    """
+    取得目前 thread 的常駐連線；fork 後的子程序（pid 不同）會重新開連線，
+    不沿用父程序的 handle
+    """
+    pid = os.getpid()
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "pid", None) != pid:
+        conn = _open_connection()
+        _local.conn = conn
+        _local.pid = pid
+        _ensure_schema(conn)
+    return conn
+
+def _ensure_schema(conn: sqlite3.Connection):
+    """每個 process（換 DB_PATH 也算）第一次連線時，把 schema 升到最新版本（見 migrations.py）"""
+    global _schema_key
+    key = (os.getpid(), str(DB_PATH))
+    with _pool_lock:
+        if _schema_key == key:
+            return
+        _schema_key = key
+        migrations.migrate(conn)
+
+def close_all():
+    """關閉本程序開過的所有連線（程式結束時自動呼叫）"""
+    with _pool_lock:
+        conns = [c for _, c in _pool]
+        _pool.clear()
+    for conn in conns:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+    _local.__dict__.clear()
+
+atexit.register(close_all)
+
 @contextmanager
 def get_connection():
-    """建立並自動關閉 SQLite 連線，增加 timeout 避免 locked"""
-    conn = sqlite3.connect(DB_PATH, timeout=10)  # 最多等 10 秒
+    """
+    取得本 thread 的常駐 SQLite 連線（不會每次重開）
+    區塊內若發生例外，未提交的交易會被 rollback，連線保留給下一次使用
+    """
+    conn = _thread_connection()
     try:
         yield conn
-    finally:
-        conn.close()
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
 
 def query_to_df(sql: str, params: tuple = ()) -> pd.DataFrame:
     """執行查詢並回傳 DataFrame"""
@@ -42,15 +119,194 @@ def execute_sql(sql: str, params: tuple | list[tuple] = ()) -> bool:
     支援單筆 tuple 或多筆 list[tuple]
     成功回傳 True，失敗回傳 False
     """
+    def run(conn: sqlite3.Connection):
+        if isinstance(params, list):
+            conn.executemany(sql, params)
+        else:
+            conn.execute(sql, params)
+
     try:
+        if _use_writer():
+            _writer.submit(run).result()
+            return True
         with get_connection() as conn:
-            cur = conn.cursor()
-            if isinstance(params, list):
-                cur.executemany(sql, params)
-            else:
-                cur.execute(sql, params)
+            run(conn)
             conn.commit()
         return True
     except sqlite3.Error as e:
         print(f"[SQLite Error] {e}")
-        return False
\ No newline at end of file
+        return False
+
+# ---------- 選用的單一寫入 thread（見 db_writer.py） ----------
+_writer: "db_writer.DbWriter | None" = None
+
+def start_writer(**kwargs) -> "db_writer.DbWriter":
+    """
+    啟用單一寫入 thread：之後 bulk_upsert / execute_sql / write 都交給它排隊合併寫入，
+    多個 thread 同時寫也不會互搶鎖；環境變數 INVEST_DB_WRITER=1 時第一次寫入前自動啟用
+    """
+    global _writer
+    with _pool_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = db_writer.DbWriter(connect=_thread_connection, **kwargs)
+        return _writer
+
+def stop_writer():
+    """寫完排隊中的工作並關閉寫入 thread，之後回到各 thread 直接寫"""
+    global _writer
+    w, _writer = _writer, None
+    if w is not None:
+        w.close()
+
+_env_checked = False
+
+def _autostart_writer():
+    """INVEST_DB_WRITER=1：第一次寫入前啟用寫入 thread（只檢查一次；之後 stop_writer 不會被自動重開）"""
+    global _env_checked
+    if _env_checked:
+        return
+    _env_checked = True
+    if os.environ.get("INVEST_DB_WRITER") == "1":
+        start_writer()
+
+def _use_writer() -> bool:
+    _autostart_writer()
+    return _writer is not None and _writer.is_alive() and not _writer.on_writer_thread()
+
+def write(fn, *args, **kwargs):
+    """
+    執行寫入工作 fn(conn, *args, **kwargs) 並回傳結果
+    有寫入 thread 時交給它（與其他工作合併成同一個交易）；沒有時在本 thread 開交易執行
+    """
+    if _use_writer():
+        return _writer.submit(fn, *args, **kwargs).result()
+    if _writer is not None and _writer.on_writer_thread():
+        # 寫入工作裡又呼叫 write()：已在 writer 的交易內，直接執行
+        return fn(_thread_connection(), *args, **kwargs)
+    with transaction() as conn:
+        return fn(conn, *args, **kwargs)
+
+@contextmanager
+def transaction(immediate: bool = True):
+    """
+    在本 thread 的連線上開一個交易，區塊結束 commit、例外 rollback
+    immediate=True 時一開始就取得寫入鎖（BEGIN IMMEDIATE），避免讀升級寫時才撞到 locked
+    """
+    with get_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+
+# =========================================================
+# 批次 UPSERT：DataFrame → TEMP staging table → 一次 INSERT ... SELECT ... ON CONFLICT
+# =========================================================
+def _q(name: str) -> str:
+    """安全包裝識別字成 "name" """
+    return '"' + str(name).replace('"', '""') + '"'
+
+def _iter_chunks(df: pd.DataFrame, chunk_size: int):
+    """逐段把 DataFrame 轉成 sqlite 可綁定的 tuple（NaN → None），不一次展開整張表"""
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start:start + chunk_size].astype(object)
+        chunk = chunk.where(chunk.notna(), None)
+        yield chunk.itertuples(index=False, name=None)
+
+def _bulk_upsert_conn(
+    conn: sqlite3.Connection,
+    table: str,
+    df: pd.DataFrame,
+    key_cols: list[str],
+    update_cols: list[str] | None = None,
+    extra_updates: dict[str, str] | None = None,
+    update_where: str | None = None,
+    chunk_size: int = 5000,
+) -> dict[str, int]:
+    """bulk_upsert 的本體；呼叫端需自行管理交易"""
+    cols = list(df.columns)
+    if update_cols is None:
+        update_cols = [c for c in cols if c not in key_cols]
+    stage = _q(f"_stage_{table}")
+
+    # 1) 建 staging 表（沿用目標表欄位型別親和性）並分段灌入
+    conn.execute(f"DROP TABLE IF EXISTS temp.{stage}")
+    conn.execute(
+        f"CREATE TEMP TABLE {stage} AS SELECT {','.join(_q(c) for c in cols)} FROM {_q(table)} WHERE 0"
+    )
+    insert_stage = f"INSERT INTO temp.{stage} VALUES ({','.join(['?'] * len(cols))})"
+    for rows in _iter_chunks(df[cols], chunk_size):
+        conn.executemany(insert_stage, rows)
+
+    # 同一 key 重複出現時保留最後一筆（與逐筆 upsert 的結果一致）
+    key_sql = ",".join(_q(k) for k in key_cols)
+    conn.execute(f"""
+        DELETE FROM temp.{stage}
+        WHERE rowid NOT IN (SELECT MAX(rowid) FROM temp.{stage} GROUP BY {key_sql})
+    """)
+
+    # 2) 先算出新 key 數量，再一次合併
+    match_sql = " AND ".join(f"t.{_q(k)} = s.{_q(k)}" for k in key_cols)
+    inserted = conn.execute(f"""
+        SELECT COUNT(*) FROM temp.{stage} s
+        WHERE NOT EXISTS (SELECT 1 FROM {_q(table)} t WHERE {match_sql})
+    """).fetchone()[0]
+
+    sets = [f"{_q(c)} = excluded.{_q(c)}" for c in update_cols]
+    sets += [f"{_q(c)} = {expr}" for c, expr in (extra_updates or {}).items()]
+    if sets:
+        conflict = f"ON CONFLICT({key_sql}) DO UPDATE SET {', '.join(sets)}"
+        if update_where:
+            conflict += f" WHERE {update_where}"
+    else:
+        conflict = "ON CONFLICT DO NOTHING"
+
+    col_sql = ",".join(_q(c) for c in cols)
+    before = conn.total_changes
+    # WHERE true：INSERT ... SELECT 搭配 ON CONFLICT 時避免語法歧義
+    conn.execute(f"""
+        INSERT INTO {_q(table)} ({col_sql})
+        SELECT {col_sql} FROM temp.{stage} WHERE true
+        {conflict}
+    """)
+    changed = conn.total_changes - before
+    conn.execute(f"DROP TABLE IF EXISTS temp.{stage}")
+
+    return {"inserted": inserted, "updated": max(changed - inserted, 0)}
+
+def bulk_upsert(
+    table: str,
+    df: pd.DataFrame,
+    key_cols: list[str],
+    update_cols: list[str] | None = None,
+    extra_updates: dict[str, str] | None = None,
+    update_where: str | None = None,
+    chunk_size: int = 5000,
+) -> dict[str, int] | None:
+    """
+    把 DataFrame 批次 upsert 進 table，整批在同一個交易內完成
+    - key_cols     : 衝突判斷欄位（需對應 PRIMARY KEY / UNIQUE）
+    - update_cols  : 衝突時要覆寫的欄位；None = 非 key 的全部欄位，[] = 不更新（等同 INSERT OR IGNORE）
+    - extra_updates: 衝突時額外 SET 的 SQL 運算式，例如 {"updated_at": "datetime('now', 'localtime')"}
+    - update_where : DO UPDATE 的條件，例如 '"stock_report_daily".is_complete = 0'
+    回傳 {"inserted": 新增筆數, "updated": 更新筆數}；失敗回傳 None
+    """
+    if df is None or df.empty:
+        return {"inserted": 0, "updated": 0}
+
+    try:
+        return write(
+            _bulk_upsert_conn, table, df, key_cols,
+            update_cols=update_cols,
+            extra_updates=extra_updates,
+            update_where=update_where,
+            chunk_size=chunk_size,
+        )
+    except sqlite3.Error as e:
+        print(f"[SQLite Error] bulk_upsert {table}: {e}")
+        return None
+
+# atexit 後註冊先執行：先把排隊中的寫入寫完，再關連線
+atexit.register(stop_writer)
@@ -0,0 +1,134 @@
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable
+
+# =========================================================
+# 單一寫入 thread（選用）
+#   - 由一條專屬 thread 持有寫入連線，所有寫入工作排隊交給它
+#   - 短時間內送進來的工作合併成一個大交易（BEGIN IMMEDIATE ... COMMIT），
+#     每個工作各自包一層 SAVEPOINT：單一工作失敗只回滾自己，不影響同批其他工作
+#   - submit() 回傳 Future，COMMIT 成功後才 set_result
+#   - 啟用方式見 db.start_writer()；未啟用時 db 的寫入函式照舊直接寫
+# =========================================================
+
+BATCH_MAX = 200          # 一個交易最多合併幾個工作
+BATCH_WAIT_SEC = 0.02    # 拿到第一個工作後，最多再等多久收集同批工作
+QUEUE_SIZE = 1000        # 排隊上限；滿了 submit() 會卡住（backpressure）
+BEGIN_RETRIES = 20       # 其他 process 正在寫時，BEGIN IMMEDIATE 重試次數
+
+_STOP = object()
+
+
+class DbWriter:
+    def __init__(
+        self,
+        connect: Callable[[], sqlite3.Connection],
+        batch_max: int = BATCH_MAX,
+        batch_wait_sec: float = BATCH_WAIT_SEC,
+        queue_size: int = QUEUE_SIZE,
+    ):
+        self._connect = connect
+        self.batch_max = batch_max
+        self.batch_wait_sec = batch_wait_sec
+        self._q: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.stats = {"tasks": 0, "errors": 0, "batches": 0, "commit_sec": 0.0}
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    # ---------- 對外介面 ----------
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Future:
+        """排入寫入工作 fn(conn, *args, **kwargs)；回傳 Future（交易 COMMIT 後才有結果）"""
+        if not self.is_alive():
+            raise RuntimeError("DbWriter 已關閉")
+        fut: Future = Future()
+        self._q.put((fut, fn, args, kwargs))
+        return fut
+
+    def is_alive(self) -> bool:
+        return self._thread.is_alive()
+
+    def on_writer_thread(self) -> bool:
+        return threading.current_thread() is self._thread
+
+    def flush(self, timeout: float | None = None):
+        """等到目前排隊中的工作都寫完"""
+        self.submit(lambda conn: None).result(timeout)
+
+    def close(self, timeout: float | None = None):
+        """寫完排隊中的工作後結束 thread"""
+        if self.is_alive():
+            self._q.put(_STOP)
+            self._thread.join(timeout)
+
+    # ---------- writer thread ----------
+    def _run(self):
+        conn = self._connect()
+        stop = False
+        while not stop:
+            first = self._q.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.batch_wait_sec
+            while len(batch) < self.batch_max:
+                try:
+                    item = self._q.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._run_batch(conn, batch)
+
+    def _begin(self, conn: sqlite3.Connection):
+        for attempt in range(BEGIN_RETRIES):
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                return
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) or attempt == BEGIN_RETRIES - 1:
+                    raise
+                time.sleep(min(1.0, 0.05 * (2 ** attempt)))
+
+    def _run_batch(self, conn: sqlite3.Connection, batch: list):
+        batch = [t for t in batch if t[0].set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        done: list[tuple[Future, Any]] = []
+        t0 = time.perf_counter()
+        try:
+            self._begin(conn)
+            for i, (fut, fn, args, kwargs) in enumerate(batch):
+                sp = f"w{i}"
+                conn.execute(f"SAVEPOINT {sp}")
+                try:
+                    result = fn(conn, *args, **kwargs)
+                except Exception as e:
+                    conn.execute(f"ROLLBACK TO {sp}")
+                    conn.execute(f"RELEASE {sp}")
+                    self.stats["errors"] += 1
+                    fut.set_exception(e)
+                    continue
+                conn.execute(f"RELEASE {sp}")
+                done.append((fut, result))
+            conn.commit()
+        except sqlite3.Error as e:
+            # 整批失敗（拿不到寫入鎖 / COMMIT 失敗）：尚未結束的工作全部回報錯誤
+            if conn.in_transaction:
+                conn.rollback()
+            self.stats["errors"] += len(batch)
+            for fut, *_ in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+
+        self.stats["batches"] += 1
+        self.stats["tasks"] += len(batch)
+        self.stats["commit_sec"] += time.perf_counter() - t0
+        for fut, result in done:
+            fut.set_result(result)
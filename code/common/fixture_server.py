@@ -0,0 +1,628 @@
+import json
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qsl, urlsplit
+from common import raw_cache
+
+# =========================================================
+# 本機替身伺服器（壓測 / 離線重跑用）
+#   - 路徑格式 /<原站 host>/<原站 path>?<query>，配合 http_client.set_base_url()
+#     或環境變數 INVEST_HTTP_BASE=http://127.0.0.1:8765 使用，程式碼不用改
+#   - 回應來源：先找 raw_cache 錄下來的真實回應，沒有才依 endpoint 產生假資料
+#     （週末視為休市，格式對齊 twse&tpex.md / FinMind v4 /data / TAIFEX 下載 CSV）
+#   - 可注入延遲、5xx、429、HTML BAN 頁，用來觀察退避 / 減速行為
+#   - stats()：收到的請求數、各種注入次數、每秒請求數
+# =========================================================
+
+DEFAULT_PORT = 8765
+
+BAN_HTML = "<html><head><title>Security</title></head><body>您的連線已被封鎖</body></html>".encode("utf-8")
+NO_DATA_STAT = "很抱歉，沒有符合條件的資料!"
+
+
+# ---------- 假資料 ----------
+def _ymd(s: str) -> date | None:
+    for fmt in ("%Y%m%d", "%Y-%m-%d", "%Y/%m/%d"):
+        try:
+            return datetime.strptime(s, fmt).date()
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+def _roc(d: date) -> str:
+    return f"{d.year - 1911}/{d.month:02d}/{d.day:02d}"
+
+
+def _weekdays(s: date, e: date) -> list[date]:
+    out = []
+    while s <= e:
+        if s.weekday() < 5:
+            out.append(s)
+        s += timedelta(days=1)
+    return out
+
+
+def _month_days(d: date) -> list[date]:
+    first = d.replace(day=1)
+    last = (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return _weekdays(first, min(last, date.today()))
+
+
+def _rng(*key) -> random.Random:
+    # 同樣的查詢每次產生同樣的數字，方便比對
+    return random.Random("|".join(map(str, key)))
+
+
+def _num(r: random.Random, lo: int, hi: int) -> str:
+    return f"{r.randint(lo, hi):,}"
+
+
+FAKE_STOCK_IDS = [f"{1101 + i}" for i in range(60)]
+
+
+def _twse_margin(q: dict) -> dict:
+    d = _ymd(q.get("date"))
+    if d is None or d.weekday() >= 5:
+        return {"stat": NO_DATA_STAT}
+    r = _rng("MI_MARGN", d)
+    rows = [
+        [name] + [_num(r, 1_000, 9_000_000) for _ in range(5)]
+        for name in ("融資(交易單位)", "融券(交易單位)", "融資金額(仟元)")
+    ]
+    tables = [{
+        "title": f"{_roc(d)} 信用交易統計",
+        "fields": ["項目", "買進", "賣出", "現金(券)償還", "前日餘額", "今日餘額"],
+        "data": rows,
+    }]
+    if q.get("selectType") == "ALL":
+        stock_rows = []
+        for sid in FAKE_STOCK_IDS:
+            rs = _rng("MI_MARGN", d, sid)
+            stock_rows.append(
+                [sid, f"股票{sid}"] + [_num(rs, 0, 50_000) for _ in range(13)] + [""]
+            )
+        tables.append({
+            "title": f"{_roc(d)} 融資融券彙總 (全部)",
+            "fields": [
+                "代號", "名稱",
+                "買進", "賣出", "現金償還", "前日餘額", "今日餘額", "次一營業日限額",
+                "買進", "賣出", "現券償還", "前日餘額", "今日餘額", "次一營業日限額",
+                "資券互抵", "註記",
+            ],
+            "data": stock_rows,
+        })
+    return {"stat": "OK", "date": d.strftime("%Y%m%d"), "tables": tables}
+
+
+def _twse_bfi82u(q: dict) -> dict:
+    d = _ymd(q.get("dayDate"))
+    if d is None or d.weekday() >= 5:
+        return {"stat": NO_DATA_STAT}
+    r = _rng("BFI82U", d)
+    rows = []
+    for name in ("自營商(自行買賣)", "自營商(避險)", "投信", "外資及陸資(不含外資自營商)", "外資自營商"):
+        buy, sell = r.randint(10**8, 10**11), r.randint(10**8, 10**11)
+        rows.append([name, f"{buy:,}", f"{sell:,}", f"{buy - sell:,}"])
+    return {
+        "stat": "OK",
+        "date": d.strftime("%Y%m%d"),
+        "fields": ["單位名稱", "買進金額", "賣出金額", "買賣差額"],
+        "data": rows,
+    }
+
+
+def _twse_fmtqik(q: dict) -> dict:
+    d = _ymd(q.get("date"))
+    days = _month_days(d) if d else []
+    if not days:
+        return {"stat": NO_DATA_STAT}
+    rows = []
+    for day in days:
+        r = _rng("FMTQIK", day)
+        rows.append([
+            _roc(day), _num(r, 10**9, 10**10), _num(r, 10**11, 10**12), _num(r, 10**6, 5 * 10**6),
+            f"{r.uniform(15_000, 30_000):,.2f}", f"{r.uniform(-500, 500):.2f}",
+        ])
+    return {
+        "stat": "OK",
+        "date": d.strftime("%Y%m%d"),
+        "fields": ["日期", "成交股數", "成交金額", "成交筆數", "發行量加權股價指數", "漲跌點數"],
+        "data": rows,
+    }
+
+
+def _twse_mi5mins_hist(q: dict) -> dict:
+    d = _ymd(q.get("date"))
+    days = _month_days(d) if d else []
+    if not days:
+        return {"stat": NO_DATA_STAT}
+    rows = []
+    for day in days:
+        r = _rng("MI_5MINS_HIST", day)
+        o = r.uniform(15_000, 30_000)
+        h, l = o * (1 + r.uniform(0, 0.02)), o * (1 - r.uniform(0, 0.02))
+        rows.append([_roc(day)] + [f"{v:,.2f}" for v in (o, h, l, r.uniform(l, h))])
+    return {
+        "stat": "OK",
+        "date": d.strftime("%Y%m%d"),
+        "fields": ["日期", "開盤指數", "最高指數", "最低指數", "收盤指數"],
+        "data": rows,
+    }
+
+
+def _twse_mi_index(q: dict) -> dict:
+    d = _ymd(q.get("date"))
+    if d is None or d.weekday() >= 5:
+        return {"stat": NO_DATA_STAT}
+    rows = []
+    for sid in FAKE_STOCK_IDS:
+        r = _rng("MI_INDEX", d, sid)
+        if r.random() < 0.05:
+            # 沒成交
+            rows.append([sid, f"股票{sid}", "0", "0", "0", "--", "--", "--", "--", "<p> </p>", "0.00"])
+            continue
+        o = r.uniform(10, 1000)
+        h, l = o * (1 + r.uniform(0, 0.05)), o * (1 - r.uniform(0, 0.05))
+        c, spread = r.uniform(l, h), r.uniform(-5, 5)
+        vol = r.randint(10**4, 10**8)
+        sign = "<p style= color:red>+</p>" if spread >= 0 else "<p style= color:green>-</p>"
+        rows.append([
+            sid, f"股票{sid}", f"{vol:,}", f"{r.randint(100, 100_000):,}", f"{int(vol * c):,}",
+            f"{o:.2f}", f"{h:.2f}", f"{l:.2f}", f"{c:.2f}", sign, f"{abs(spread):.2f}",
+        ])
+    return {
+        "stat": "OK",
+        "date": d.strftime("%Y%m%d"),
+        "tables": [
+            {"title": f"{_roc(d)} 價格指數(臺灣證券交易所)", "fields": ["指數", "收盤指數"], "data": []},
+            {
+                "title": f"{_roc(d)} 每日收盤行情(全部(不含權證、牛熊證))",
+                "fields": [
+                    "證券代號", "證券名稱", "成交股數", "成交筆數", "成交金額",
+                    "開盤價", "最高價", "最低價", "收盤價", "漲跌(+/-)", "漲跌價差",
+                ],
+                "data": rows,
+            },
+        ],
+    }
+
+
+def _tpex_body(d: date, fields: list[str], rows: list) -> dict:
+    return {"stat": "ok", "date": d.strftime("%Y%m%d"), "tables": [{"fields": fields, "data": rows}]}
+
+
+def _tpex_trading_index(q: dict) -> dict:
+    d = _ymd(q.get("date"))
+    days = _month_days(d) if d else []
+    rows = []
+    for day in days:
+        r = _rng("tradingIndex", day)
+        rows.append([
+            _roc(day), _num(r, 10**5, 10**6), _num(r, 10**7, 10**8), _num(r, 10**5, 10**6),
+            f"{r.uniform(200, 300):.2f}", f"{r.uniform(-5, 5):.2f}",
+        ])
+    return _tpex_body(d or date.today(), ["日期", "成交股數(仟股)", "金額(仟元)", "筆數", "櫃買指數", "漲/跌"], rows)
+
+
+def _tpex_insti_summary(q: dict) -> dict:
+    d = _ymd(q.get("date"))
+    if d is None or d.weekday() >= 5:
+        return {"stat": "ok", "tables": [{"fields": [], "data": []}]}
+    r = _rng("insti", d)
+    rows = []
+    for name in ("外資及陸資(不含外資自營商)", "外資自營商", "投信", "自營商(自行買賣)", "自營商(避險)", "三大法人合計"):
+        buy, sell = r.randint(10**8, 10**10), r.randint(10**8, 10**10)
+        rows.append([name, f"{buy:,}", f"{sell:,}", f"{buy - sell:,}"])
+    return _tpex_body(d, ["單位名稱", "買進金額(元)", "賣出金額(元)", "買賣超(元)"], rows)
+
+
+def _tpex_margin_balance(q: dict) -> dict:
+    d = _ymd(q.get("date"))
+    if d is None or d.weekday() >= 5:
+        return {"stat": "ok", "tables": [{"fields": [], "data": []}]}
+    fields = [
+        "代號", "名稱", "前資餘額(張)", "資買", "資賣", "現償", "資餘額", "資屬證金", "資使用率(%)", "資限額",
+        "前券餘額(張)", "券賣", "券買", "券償", "券餘額", "券屬證金", "券使用率(%)", "券限額", "資券相抵(張)", "備註",
+    ]
+    rows = []
+    for sid in FAKE_STOCK_IDS:
+        r = _rng("tpex_margin", d, sid)
+        rows.append([str(int(sid) + 5000), f"櫃買{sid}"] + [_num(r, 0, 20_000) for _ in range(17)] + [""])
+    return _tpex_body(d, fields, rows)
+
+
+def _twse_empty_list(q: dict) -> dict:
+    # 注意股 / 處置股：格式正確但沒有資料
+    return {"stat": "OK", "fields": ["編號", "證券代號", "證券名稱"], "data": [], "total": 0}
+
+
+def _finmind_row(dataset: str, day: date, data_id: str) -> list[dict]:
+    r = _rng(dataset, day, data_id)
+    ds = day.strftime("%Y-%m-%d")
+    if dataset in ("TaiwanStockPrice", "TaiwanStockPriceAdj"):
+        o = r.uniform(10, 1000)
+        h, l = o * (1 + r.uniform(0, 0.05)), o * (1 - r.uniform(0, 0.05))
+        c = r.uniform(l, h)
+        vol = r.randint(10**4, 10**8)
+        return [{
+            "date": ds, "stock_id": data_id, "Trading_Volume": vol,
+            "Trading_money": int(vol * c), "open": round(o, 2), "max": round(h, 2),
+            "min": round(l, 2), "close": round(c, 2), "spread": round(c - o, 2),
+            "Trading_turnover": r.randint(100, 100_000),
+        }]
+    if dataset == "TaiwanStockMarketValue":
+        return [{"date": ds, "stock_id": data_id, "market_value": r.randint(10**9, 10**13)}]
+    if dataset == "TaiwanStockTotalInstitutionalInvestors":
+        return [
+            {"date": ds, "name": n, "buy": r.randint(10**8, 10**11), "sell": r.randint(10**8, 10**11)}
+            for n in ("Foreign_Investor", "Investment_Trust", "Dealer_self", "Dealer_Hedging", "total")
+        ]
+    if dataset == "TaiwanStockTotalMarginPurchaseShortSale":
+        rows = []
+        for n in ("MarginPurchase", "ShortSale", "MarginPurchaseMoney"):
+            yes = r.randint(10**5, 10**9)
+            buy, sell, ret = r.randint(10**3, 10**6), r.randint(10**3, 10**6), r.randint(0, 10**4)
+            rows.append({
+                "date": ds, "name": n, "buy": buy, "sell": sell, "Return": ret,
+                "YesBalance": yes, "TodayBalance": yes + buy - sell - ret,
+            })
+        return rows
+    if dataset == "TaiwanStockTradingDate":
+        return [{"date": ds}]
+    return []
+
+
+def _finmind_data(q: dict) -> dict:
+    dataset = q.get("dataset", "")
+    s = _ymd(q.get("start_date")) or date(2000, 1, 1)
+    e = _ymd(q.get("end_date")) or date.today()
+    data_id = q.get("data_id", "")
+    rows = [row for d in _weekdays(s, e) for row in _finmind_row(dataset, d, data_id)]
+    return {"msg": "success", "status": 200, "data": rows}
+
+
+# TAIFEX：下載 CSV（cp950），一次查一段日期
+def _taifex_csv(header: list[str], rows: list[list]) -> bytes:
+    lines = [",".join(header)] + [",".join(map(str, r)) + "," for r in rows]
+    return ("\r\n".join(lines) + "\r\n").encode("cp950")
+
+
+def _taifex_days(q: dict) -> list[date]:
+    s = _ymd(q.get("queryStartDate")) or date.today()
+    e = _ymd(q.get("queryEndDate")) or s
+    return _weekdays(s, min(e, date.today()))
+
+
+def _taifex_expiries(d: date) -> list[str]:
+    m = d.replace(day=1)
+    nxt = (m + timedelta(days=32)).replace(day=1)
+    return [m.strftime("%Y%m"), nxt.strftime("%Y%m")]
+
+
+def _taifex_fut(q: dict) -> bytes:
+    cid = q.get("commodity_id", "TX")
+    header = ["交易日期", "契約", "到期月份(週別)", "開盤價", "最高價", "最低價", "收盤價", "漲跌價", "漲跌%",
+              "成交量", "結算價", "未沖銷契約數", "最後最佳買價", "最後最佳賣價", "歷史最高價", "歷史最低價",
+              "是否因訊息面暫停交易", "交易時段", "價差對單式委託成交量"]
+    rows = []
+    for d in _taifex_days(q):
+        for exp in _taifex_expiries(d):
+            for session in ("一般", "盤後"):
+                r = _rng("taifex_fut", cid, d, exp, session)
+                o = r.randint(15000, 25000)
+                c = o + r.randint(-300, 300)
+                oi = r.randint(1000, 80000) if session == "一般" else "-"
+                settle = c if session == "一般" else "-"
+                rows.append([d.strftime("%Y/%m/%d"), cid, exp, o, o + 300, o - 300, c, c - o, "-",
+                             r.randint(1000, 100000), settle, oi, c - 1, c + 1, "-", "-", "", session, "-"])
+    return _taifex_csv(header, rows)
+
+
+def _taifex_opt(q: dict) -> bytes:
+    cid = q.get("commodity_id", "TXO")
+    header = ["交易日期", "契約", "到期月份(週別)", "履約價", "買賣權", "開盤價", "最高價", "最低價", "收盤價",
+              "成交量", "結算價", "未沖銷契約數", "最後最佳買價", "最後最佳賣價", "歷史最高價", "歷史最低價",
+              "是否因訊息面暫停交易", "交易時段", "漲跌價", "漲跌%"]
+    rows = []
+    for d in _taifex_days(q):
+        for exp in _taifex_expiries(d)[:1]:
+            for strike in range(19000, 21001, 500):
+                for cp in ("買權", "賣權"):
+                    r = _rng("taifex_opt", cid, d, exp, strike, cp)
+                    px = r.randint(1, 800)
+                    rows.append([d.strftime("%Y/%m/%d"), cid, exp, strike, cp, px, px + 10, max(px - 10, 1), px,
+                                 r.randint(0, 50000), px, r.randint(0, 30000), px - 1, px + 1, "-", "-", "", "一般", "-", "-"])
+    return _taifex_csv(header, rows)
+
+
+def _taifex_insti(q: dict, with_cp: bool) -> bytes:
+    cid = q.get("commodityId", "TXF")
+    header = ["日期", "商品名稱"] + (["買賣權別"] if with_cp else []) + [
+        "身份別", "多方交易口數", "多方交易契約金額(千元)", "空方交易口數", "空方交易契約金額(千元)",
+        "多空交易口數淨額", "多空交易契約金額淨額(千元)", "多方未平倉口數", "多方未平倉契約金額(千元)",
+        "空方未平倉口數", "空方未平倉契約金額(千元)", "多空未平倉口數淨額", "多空未平倉契約金額淨額(千元)"]
+    rows = []
+    for d in _taifex_days(q):
+        for cp in (("買權", "賣權") if with_cp else ("",)):
+            for who in ("自營商", "投信", "外資及陸資"):
+                r = _rng("taifex_insti", cid, d, cp, who)
+                lv, sv, lo, so = (r.randint(0, 100000) for _ in range(4))
+                rows.append([d.strftime("%Y/%m/%d"), f"{cid}商品"] + ([cp] if with_cp else []) + [
+                    who, lv, lv * 4, sv, sv * 4, lv - sv, (lv - sv) * 4, lo, lo * 4, so, so * 4, lo - so, (lo - so) * 4])
+    return _taifex_csv(header, rows)
+
+
+# path 結尾 → 假資料產生器（回 dict 送 JSON、回 bytes 送 CSV）
+SYNTHETIC_ROUTES = {
+    "/marginTrading/MI_MARGN": _twse_margin,
+    "/fund/BFI82U": _twse_bfi82u,
+    "/exchangeReport/FMTQIK": _twse_fmtqik,
+    "/afterTrading/FMTQIK": _twse_fmtqik,
+    "/indicesReport/MI_5MINS_HIST": _twse_mi5mins_hist,
+    "/TAIEX/MI_5MINS_HIST": _twse_mi5mins_hist,
+    "/afterTrading/MI_INDEX": _twse_mi_index,
+    "/announcement/notice": _twse_empty_list,
+    "/announcement/punish": _twse_empty_list,
+    "/afterTrading/tradingIndex": _tpex_trading_index,
+    "/insti/summary": _tpex_insti_summary,
+    "/margin/balance": _tpex_margin_balance,
+    "/api/v4/data": _finmind_data,
+    "/futDataDown": _taifex_fut,
+    "/optDataDown": _taifex_opt,
+    "/futContractsDateDown": lambda q: _taifex_insti(q, with_cp=False),
+    "/callsAndPutsDateDown": lambda q: _taifex_insti(q, with_cp=True),
+}
+
+
+def _synthetic(path: str, query: dict) -> dict | bytes | None:
+    for suffix, fn in SYNTHETIC_ROUTES.items():
+        if path.endswith(suffix):
+            return fn(query)
+    return None
+
+
+# ---------- 伺服器 ----------
+class FixtureServer:
+    """
+    with FixtureServer(latency_sec=0.05, ban_rate=0.01) as srv:
+        http_client.set_base_url(srv.base_url)
+        ...  # 照常呼叫 twse / finMind 等模組
+    latency_sec ± jitter_sec：每個回應的延遲
+    error_rate / throttle_rate / ban_rate：回 503 / 429 / HTML BAN 頁的機率
+    use_raw_cache：優先回放 raw_cache 錄下的真實回應
+    """
+
+    def __init__(
+        self,
+        port: int = 0,
+        latency_sec: float = 0.0,
+        jitter_sec: float = 0.0,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        ban_rate: float = 0.0,
+        use_raw_cache: bool = True,
+        seed: int | None = None,
+    ):
+        self.latency_sec = latency_sec
+        self.jitter_sec = jitter_sec
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.ban_rate = ban_rate
+        self.use_raw_cache = use_raw_cache
+        self._rand = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FixtureServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fixture-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # ---------- 統計 ----------
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {
+                "requests": 0, "recorded": 0, "synthetic": 0, "not_found": 0,
+                "errors": 0, "throttled": 0, "banned": 0,
+            }
+            self._t0 = time.perf_counter()
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats[key] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            st = dict(self._stats)
+            elapsed = time.perf_counter() - self._t0
+        st["elapsed_sec"] = round(elapsed, 3)
+        st["requests_per_sec"] = round(st["requests"] / elapsed, 2) if elapsed > 0 else 0.0
+        return st
+
+    # ---------- 回應決定 ----------
+    def _pick_fault(self) -> str | None:
+        with self._lock:
+            x = self._rand.random()
+        for kind, rate in (("errors", self.error_rate), ("throttled", self.throttle_rate), ("banned", self.ban_rate)):
+            if x < rate:
+                return kind
+            x -= rate
+        return None
+
+    def _delay(self):
+        if self.latency_sec <= 0 and self.jitter_sec <= 0:
+            return
+        with self._lock:
+            jitter = self._rand.uniform(-self.jitter_sec, self.jitter_sec)
+        time.sleep(max(0.0, self.latency_sec + jitter))
+
+    def respond(self, method: str, raw_path: str, body: bytes) -> tuple[int, str, bytes]:
+        """回傳 (status, content_type, body)；raw_path = /<host>/<path>?<query>"""
+        self._delay()
+
+        fault = self._pick_fault()
+        if fault == "errors":
+            self._count(fault)
+            return 503, "text/plain", b"Service Unavailable"
+        if fault == "throttled":
+            self._count(fault)
+            return 429, "text/plain", b"Too Many Requests"
+        if fault == "banned":
+            self._count(fault)
+            return 200, "text/html; charset=utf-8", BAN_HTML
+
+        parts = urlsplit(raw_path)
+        host, _, path = parts.path.lstrip("/").partition("/")
+        path = "/" + path
+        form = parse_qsl(body.decode("utf-8", "replace"), keep_blank_values=True) if body else None
+
+        if self.use_raw_cache:
+            key = raw_cache.make_key(method, f"https://{host}{path}?{parts.query}", None, form)
+            hit = raw_cache.get(key)
+            if hit is not None:
+                self._count("recorded")
+                return hit["status"], hit["content_type"] or "application/json", hit["body"]
+
+        query = dict(parse_qsl(parts.query, keep_blank_values=True))
+        query.update(form or [])
+        payload = _synthetic(path, query)
+        if payload is None:
+            self._count("not_found")
+            return 404, "application/json", b'{"stat": "not found"}'
+        self._count("synthetic")
+        if isinstance(payload, bytes):
+            return 200, "application/octet-stream", payload
+        return 200, "application/json; charset=utf-8", json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"   # keep-alive，跟正式站一樣重用連線
+
+            def _serve(self, method: str):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                status, ctype, out = server.respond(method, self.path, body)
+                self.send_response(status)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+            def do_GET(self):
+                self._serve("GET")
+
+            def do_POST(self):
+                self._serve("POST")
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+# ======== 壓測 ========
+def benchmark(
+    fn, *args, unlimited: bool = False, server_kw: dict | None = None, db_path: str | Path | None = None, **kwargs
+) -> dict:
+    """
+    啟動替身伺服器並把 http_client 指過去，執行 fn(*args, **kwargs)（例如一段回補），回傳
+    {"wall_sec", "server": 伺服器統計, "client": http_client.stats()}
+    unlimited=True：暫時拿掉各 host 的速率限制，量的是程式本身的吞吐上限
+    db_path：壓測期間 db.DB_PATH 改指這個檔（預設暫存檔，結束後刪除）；
+      假資料、coverage、negative_cache 都寫在這裡，不會汙染正式資料庫
+    """
+    from common import db, http_client, scheduler, trading_calendar
+
+    prev_db = Path(db.DB_PATH)
+    if db_path is not None and Path(db_path).resolve() == prev_db.resolve():
+        raise ValueError(f"benchmark 不可寫入正式資料庫：{db_path}，請給另一個暫存檔路徑")
+    tmp_dir = None
+    if db_path is None:
+        tmp_dir = tempfile.TemporaryDirectory(prefix="invest_bench_")
+        db_path = Path(tmp_dir.name) / "bench.db"
+    db._autostart_writer()
+    had_writer = db._writer is not None
+    db.stop_writer()
+    db.close_all()
+    db.DB_PATH = Path(db_path)
+
+    prev_base = http_client.get_base_url()
+    prev_calendar = trading_calendar._calendar
+    trading_calendar._calendar = None   # 壓測期間改用替身伺服器給的日曆
+    prev_rates = dict(scheduler.HOST_RATES)
+    prev_limiters = dict(scheduler._limiters)
+    if unlimited:
+        scheduler.HOST_RATES.update({k: (10_000.0, 10_000) for k in scheduler.HOST_RATES})
+        scheduler._limiters.clear()
+    http_client.reset_stats()
+
+    try:
+        with FixtureServer(**(server_kw or {})) as srv:
+            http_client.set_base_url(srv.base_url)
+            t0 = time.perf_counter()
+            fn(*args, **kwargs)
+            wall = time.perf_counter() - t0
+            server_stats = srv.stats()
+    finally:
+        db.stop_writer()
+        db.close_all()
+        db.DB_PATH = prev_db
+        if had_writer:
+            db.start_writer()
+        if tmp_dir is not None:
+            tmp_dir.cleanup()
+        http_client.set_base_url(prev_base)
+        trading_calendar._calendar = prev_calendar
+        if unlimited:
+            scheduler.HOST_RATES.clear()
+            scheduler.HOST_RATES.update(prev_rates)
+            scheduler._limiters.clear()
+            scheduler._limiters.update(prev_limiters)
+
+    return {"wall_sec": round(wall, 3), "server": server_stats, "client": http_client.stats()}
+
+
+# ======== 單獨執行：啟動替身伺服器 ========
+# python -m common.fixture_server [port] [latency_sec] [ban_rate]
+# 另一個終端機設定 INVEST_HTTP_BASE=http://127.0.0.1:<port> 後照常執行抓取程式
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PORT
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    ban = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+    srv = FixtureServer(port=port, latency_sec=latency, jitter_sec=latency / 2, ban_rate=ban).start()
+    print(f"🧪 fixture server: {srv.base_url}（latency {latency}s, ban_rate {ban}）Ctrl+C 結束")
+    try:
+        while True:
+            time.sleep(10)
+            print(srv.stats())
+    except KeyboardInterrupt:
+        srv.stop()
@@ -0,0 +1,243 @@
+import os
+import random
+import threading
+import time
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+from common import scheduler, raw_cache
+
+# =========================================================
+# 共用 HTTP 連線層
+#   - 每個 thread、每個 host 一個常駐 Session（keep-alive，不必每次重做 TLS handshake）
+#   - 連線錯誤 / 5xx / 429 / 被擋頁面：指數退避 + jitter 後重試
+#   - TWSE / TPEx 回 HTML（維護中或被 BAN）統一判定為 ThrottledError
+#   - 依 endpoint（host + path）統計請求數、流量、耗時
+#   - 每次送出前向 scheduler.limiter(host) 拿 token，被擋時通知它減速
+#   - 成功的回應存進 raw_cache；prefer / replay 模式直接從快取組出 Response
+#   - INVEST_HTTP_BASE（或 set_base_url）設定後，所有請求改送到本機替身伺服器
+#     （common.fixture_server）：https://host/path → {base}/host/path，壓測時不碰真的交易所
+# =========================================================
+
+DEFAULT_TIMEOUT = 10
+MAX_RETRIES = 3
+BACKOFF_BASE_SEC = 1.0
+BACKOFF_MAX_SEC = 30.0
+THROTTLE_BACKOFF_SEC = 10.0   # 被擋時的起始等待，比一般錯誤久
+POOL_SIZE = 8
+
+DEFAULT_HEADERS = {"User-Agent": "Mozilla/5.0"}
+RETRY_STATUS = {500, 502, 503, 504}
+THROTTLE_STATUS = {402, 403, 429}   # FinMind 超過額度回 402
+# 這些站台正常回應都是 JSON / CSV，回 HTML 就是維護頁或 BAN 頁
+HTML_THROTTLE_HOSTS = ("twse.com.tw", "tpex.org.tw")
+
+
+# 替身伺服器位址；None = 直接連原站
+_base_url: str | None = os.environ.get("INVEST_HTTP_BASE") or None
+
+
+def set_base_url(url: str | None):
+    """改送到替身伺服器（例如 http://127.0.0.1:8765）；None 恢復連原站"""
+    global _base_url
+    _base_url = url.rstrip("/") if url else None
+
+
+def get_base_url() -> str | None:
+    return _base_url
+
+
+def _rewrite(url: str) -> str:
+    parts = urlsplit(url)
+    query = f"?{parts.query}" if parts.query else ""
+    return f"{_base_url}/{parts.hostname}{parts.path}{query}"
+
+
+class ThrottledError(requests.RequestException):
+    """被限流：HTTP 429 / 403，或交易所回 HTML 維護 / BAN 頁"""
+
+
+# ---------- Session：每個 thread 各自一組 ----------
+_local = threading.local()
+
+
+def _session(host: str) -> requests.Session:
+    sessions = getattr(_local, "sessions", None)
+    if sessions is None:
+        sessions = _local.sessions = {}
+    sess = sessions.get(host)
+    if sess is None:
+        sess = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=0)
+        sess.mount("https://", adapter)
+        sess.mount("http://", adapter)
+        sess.headers.update(DEFAULT_HEADERS)
+        sessions[host] = sess
+    return sess
+
+
+def close_sessions():
+    """關閉本 thread 的所有 Session"""
+    for sess in getattr(_local, "sessions", {}).values():
+        sess.close()
+    _local.sessions = {}
+
+
+# ---------- 統計 ----------
+_stats_lock = threading.Lock()
+_stats: dict[str, dict[str, float]] = {}
+
+
+def _record(endpoint: str, nbytes: int, elapsed: float, error: bool = False, throttled: bool = False):
+    with _stats_lock:
+        st = _stats.setdefault(
+            endpoint,
+            {"requests": 0, "errors": 0, "throttled": 0, "bytes": 0, "elapsed_sec": 0.0},
+        )
+        st["requests"] += 1
+        st["bytes"] += nbytes
+        st["elapsed_sec"] += elapsed
+        st["errors"] += int(error)
+        st["throttled"] += int(throttled)
+
+
+def stats() -> pd.DataFrame:
+    """各 endpoint 的請求數 / 錯誤 / 被擋次數 / 位元組 / 總耗時與平均耗時"""
+    with _stats_lock:
+        df = pd.DataFrame.from_dict(_stats, orient="index")
+    if df.empty:
+        return df
+    df["avg_ms"] = (df["elapsed_sec"] / df["requests"] * 1000).round(1)
+    return df.sort_values("elapsed_sec", ascending=False)
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+# ---------- 判斷 / 退避 ----------
+def is_throttled(resp: requests.Response, host: str | None = None) -> bool:
+    """host：原站 host（改送替身伺服器時 resp.url 已不是原站）"""
+    if resp.status_code in THROTTLE_STATUS:
+        return True
+    host = host or urlsplit(resp.url).hostname or ""
+    if not host.endswith(HTML_THROTTLE_HOSTS):
+        return False
+    ctype = resp.headers.get("Content-Type", "")
+    head = resp.content[:64].lstrip()
+    return "text/html" in ctype or head.startswith(b"<")
+
+
+def _cached_response(url: str, hit: dict) -> requests.Response:
+    """把快取內容組回 requests.Response，呼叫端 .json() / .text / .content 照常使用"""
+    resp = requests.Response()
+    resp.status_code = hit["status"]
+    resp._content = hit["body"]
+    resp.url = url
+    resp.encoding = "utf-8"
+    if hit["content_type"]:
+        resp.headers["Content-Type"] = hit["content_type"]
+    resp.headers["X-Raw-Cache"] = "hit"
+    return resp
+
+
+def backoff_sleep(attempt: int, base: float | None = None):
+    """full jitter：在 [0, min(上限, base * 2^attempt)] 之間隨機等待"""
+    base = BACKOFF_BASE_SEC if base is None else base
+    time.sleep(random.uniform(0, min(BACKOFF_MAX_SEC, base * (2 ** attempt))))
+
+
+# ---------- 主要介面 ----------
+def request(
+    method: str,
+    url: str,
+    *,
+    params=None,
+    data=None,
+    headers: dict | None = None,
+    timeout: float = DEFAULT_TIMEOUT,
+    retries: int = MAX_RETRIES,
+    rate_limit: bool = True,
+) -> requests.Response:
+    """
+    送出請求並回傳 Response（已確認非 4xx/5xx、非被擋頁面）
+    重試用盡後：被擋 → ThrottledError；其餘 → requests 原本的例外
+    raw_cache 為 prefer / replay 時先查快取；replay 沒命中丟 raw_cache.RawCacheMiss
+    """
+    parts = urlsplit(url)
+    host = parts.hostname or ""
+    endpoint = f"{host}{parts.path}"
+
+    # 送到替身伺服器的回應是假資料，不讀也不寫 raw_cache
+    cache_mode = "off" if _base_url else raw_cache.get_mode()
+    send_url = _rewrite(url) if _base_url else url
+    cache_key = None
+    if cache_mode != "off":
+        cache_key = raw_cache.make_key(method, url, params, data)
+    if cache_mode in ("prefer", "replay"):
+        hit = raw_cache.get(cache_key)
+        if hit is not None:
+            _record(f"{endpoint} (cache)", len(hit["body"]), 0.0)
+            return _cached_response(url, hit)
+        if cache_mode == "replay":
+            raise raw_cache.RawCacheMiss(f"raw_cache 無資料: {cache_key}")
+
+    sess = _session(host)
+    bucket = scheduler.limiter(host) if rate_limit else None
+
+    last_exc: Exception | None = None
+    for attempt in range(retries + 1):
+        if bucket is not None:
+            bucket.acquire()
+        t0 = time.perf_counter()
+        try:
+            resp = sess.request(method, send_url, params=params, data=data, headers=headers, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            _record(endpoint, 0, time.perf_counter() - t0, error=True)
+            last_exc = e
+            if attempt < retries:
+                backoff_sleep(attempt)
+            continue
+
+        elapsed = time.perf_counter() - t0
+        nbytes = len(resp.content)
+
+        if is_throttled(resp, host):
+            _record(endpoint, nbytes, elapsed, throttled=True)
+            if bucket is not None:
+                bucket.penalize()
+            last_exc = ThrottledError(f"throttled by {host} (HTTP {resp.status_code})", response=resp)
+            if attempt < retries:
+                backoff_sleep(attempt, THROTTLE_BACKOFF_SEC)
+            continue
+
+        if resp.status_code in RETRY_STATUS:
+            _record(endpoint, nbytes, elapsed, error=True)
+            last_exc = requests.HTTPError(f"HTTP {resp.status_code}", response=resp)
+            if attempt < retries:
+                backoff_sleep(attempt)
+            continue
+
+        _record(endpoint, nbytes, elapsed, error=resp.status_code >= 400)
+        if bucket is not None:
+            bucket.reward()
+        resp.raise_for_status()
+        if cache_key is not None:
+            raw_cache.put(cache_key, resp.status_code, resp.headers.get("Content-Type"), resp.content)
+        return resp
+
+    raise last_exc
+
+
+def get(url: str, params=None, **kwargs) -> requests.Response:
+    return request("GET", url, params=params, **kwargs)
+
+
+def post(url: str, data=None, **kwargs) -> requests.Response:
+    return request("POST", url, data=data, **kwargs)
+
+
+def get_json(url: str, params=None, **kwargs) -> dict:
+    return get(url, params=params, **kwargs).json()
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+
+# =========================================================
+# 報告引擎用的向量化運算（不逐列跑 Python）
+#   - 單檔（依日期排序）或多檔併表（依 stock_id, 日期 排序）都適用：
+#     pos = 每列在自己股票內是第幾根 K 棒，視窗不足 / 跨到上一檔的列一律 NaN
+#   - 結果與逐檔、逐列計算相同
+# =========================================================
+
+
+# =========================
+# 分組位置 / shift / rolling
+# =========================
+def group_pos(df: pd.DataFrame, key: str = "stock_id") -> np.ndarray:
+    """每列在自己股票內的序號（0 起算）；沒有 key 欄時整張表視為同一檔"""
+    if key not in df.columns:
+        return np.arange(len(df))
+    return df.groupby(key, sort=False).cumcount().to_numpy()
+
+
+def shift(s: pd.Series, n: int, pos: np.ndarray) -> pd.Series:
+    return s.shift(n).where(pos >= n)
+
+
+def rolling_mean(s: pd.Series, n: int, pos: np.ndarray) -> pd.Series:
+    return s.rolling(n).mean().where(pos >= n - 1)
+
+
+# =========================
+# 滑動視窗 argmax / argmin
+# =========================
+def _rolling_arg(values, n: int, pos: np.ndarray, largest: bool) -> tuple[np.ndarray, np.ndarray]:
+    """
+    回傳 (視窗極值, 極值所在列的 index)；視窗不足的列 → (NaN, -1)
+    同值取視窗內最早的一筆、視窗內有 NaN 時回傳第一個 NaN（同 np.argmax / np.argmin）
+    做法：倍增表 best[i] = [i, i + w) 內極值的位置，w = 1, 2, 4 ...，
+      長度 n 的視窗 = 兩段長度 w 的視窗（可重疊）取較大者，只需 log2(n) 次整欄運算
+    """
+    vals = np.asarray(values, dtype="float64")
+    size = len(vals)
+    out_val = np.full(size, np.nan)
+    out_idx = np.full(size, -1, dtype="int64")
+    if size < n:
+        return out_val, out_idx
+
+    key = np.where(np.isnan(vals), np.inf, vals if largest else -vals)
+    best = np.arange(size)
+    w = 1
+    while w * 2 <= n:
+        left, right = best[:-w], best[w:]
+        best = np.where(key[right] > key[left], right, left)
+        w *= 2
+    # best 長度 = size - w + 1；視窗 [i, i + n) = [i, i + w) ∪ [i + n - w, i + n)
+    m = size - n + 1
+    left, right = best[:m], best[n - w : n - w + m]
+    idx = np.where(key[right] > key[left], right, left)
+
+    # 第 i 個視窗對應到列 i + n - 1
+    ok = pos[n - 1:] >= n - 1
+    rows = np.arange(n - 1, size)[ok]
+    out_idx[rows] = idx[ok]
+    out_val[rows] = vals[idx[ok]]
+    return out_val, out_idx
+
+
+def rolling_argmax(values, n: int, pos: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    return _rolling_arg(values, n, pos, largest=True)
+
+
+def rolling_argmin(values, n: int, pos: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    return _rolling_arg(values, n, pos, largest=False)
+
+
+def take_at(labels, idx: np.ndarray) -> np.ndarray:
+    """依 rolling_arg* 的 index 取對應的標籤（例如日期）；-1 → NaN"""
+    labels = np.asarray(labels, dtype=object)
+    out = np.full(len(idx), np.nan, dtype=object)
+    hit = idx >= 0
+    out[hit] = labels[idx[hit]]
+    return out
+
+
+# =========================
+# 分類標籤
+# =========================
+def sign_label(x: pd.Series, pos_label: str, neg_label: str) -> np.ndarray:
+    """> 0 → pos_label、< 0 → neg_label，0 / NaN → None"""
+    return np.select([x > 0, x < 0], [pos_label, neg_label], default=None)
+
+
+_CANDLE_KINDS = ["錘子線", "流星線", "長黑K", "中實體K"]
+# 代碼 → 標籤：0 十字線、1 + 2 * k (+1 紅K) 為 _CANDLE_KINDS[k]，最後一個是 None（資料不足）
+_CANDLE_LABELS = np.array(
+    ["⬜ 十字線"]
+    + [f"{c} {k}" for k in _CANDLE_KINDS for c in ("🟩", "🟥")]
+    + [None],
+    dtype=object,
+)
+_CANDLE_LABELS[1 + 2 * _CANDLE_KINDS.index("長黑K") + 1] = "🟥 長紅K"
+
+
+def classify_candle(open_p, close_p, body, upper, lower) -> np.ndarray:
+    """
+    K 線型態（整欄）：十字線 / 錘子線 / 流星線 / 長紅K / 長黑K / 中實體K，紅綠色塊依收盤 > 開盤
+    任一輸入為 NaN → None
+    """
+    open_p, close_p, body, upper, lower = (
+        np.asarray(a, dtype="float64") for a in (open_p, close_p, body, upper, lower)
+    )
+    valid = ~(np.isnan(body) | np.isnan(upper) | np.isnan(lower) | np.isnan(open_p) | np.isnan(close_p))
+    small_body = body < 0.3
+
+    kind = np.select(
+        [(lower > 0.5) & small_body, (upper > 0.5) & small_body, body > 0.6],
+        [0, 1, 2],
+        default=3,
+    )
+    code = 1 + 2 * kind + (close_p > open_p)
+    code = np.where((np.abs(close_p - open_p) < 1e-6) | (body < 0.05), 0, code)
+    code = np.where(valid, code, len(_CANDLE_LABELS) - 1)
+    return _CANDLE_LABELS[code]
@@ -0,0 +1,474 @@
+import sqlite3
+
+# =========================================================
+# Schema 版本遷移
+#   - 版本號記在 PRAGMA user_version
+#   - 每個 migration 在自己的交易內執行，成功才把版本號往上推
+#   - db.get_connection() 每個 process 第一次連線時會自動呼叫 migrate()
+# =========================================================
+
+def _q(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+def _table_exists(conn: sqlite3.Connection, table: str) -> bool:
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone()
+    return row is not None
+
+def _table_sql(conn: sqlite3.Connection, table: str) -> str:
+    row = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone()
+    return row[0] if row and row[0] else ""
+
+def _rebuild_without_rowid(
+    conn: sqlite3.Connection,
+    table: str,
+    key_cols: list[str],
+    drop_cols: tuple[str, ...] = ("id",),
+) -> bool:
+    """
+    把既有 table 重建成以 key_cols 為 PRIMARY KEY 的 WITHOUT ROWID（clustered）表
+    - 其餘欄位的型別 / NOT NULL / DEFAULT 原樣保留，drop_cols（自增 id）移除
+    - key 為 NULL 的列無法放進 clustered PK，直接捨棄；同 key 重複時保留 rowid 最大者
+    表不存在或已是 WITHOUT ROWID 時不做事，回傳 False
+    """
+    if not _table_exists(conn, table):
+        print(f"[migrate] 略過 {table}：表不存在")
+        return False
+    if "WITHOUT ROWID" in _table_sql(conn, table).upper():
+        return False
+
+    info = conn.execute(f"PRAGMA table_info({_q(table)})").fetchall()
+    col_defs, cols = [], []
+    for _, name, col_type, notnull, default, _ in info:
+        if name in drop_cols:
+            continue
+        cols.append(name)
+        parts = [_q(name)]
+        if col_type:
+            parts.append(col_type)
+        if notnull or name in key_cols:
+            parts.append("NOT NULL")
+        if default is not None:
+            parts.append(f"DEFAULT ({default})")
+        col_defs.append(" ".join(parts))
+
+    # 使用者自建的 index（非 autoindex），重建後補回
+    index_sqls = [
+        r[0] for r in conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+            (table,),
+        ).fetchall()
+    ]
+
+    tmp = f"{table}__new"
+    key_sql = ",".join(_q(k) for k in key_cols)
+    col_sql = ",".join(_q(c) for c in cols)
+    not_null = " AND ".join(f"{_q(k)} IS NOT NULL" for k in key_cols)
+
+    conn.execute(f"DROP TABLE IF EXISTS {_q(tmp)}")
+    conn.execute(f"""
+        CREATE TABLE {_q(tmp)} (
+            {", ".join(col_defs)},
+            PRIMARY KEY ({key_sql})
+        ) WITHOUT ROWID
+    """)
+    conn.execute(f"""
+        INSERT OR REPLACE INTO {_q(tmp)} ({col_sql})
+        SELECT {col_sql} FROM {_q(table)}
+        WHERE {not_null}
+        ORDER BY rowid
+    """)
+    conn.execute(f"DROP TABLE {_q(table)}")
+    conn.execute(f"ALTER TABLE {_q(tmp)} RENAME TO {_q(table)}")
+
+    for sql in index_sqls:
+        try:
+            conn.execute(sql)
+        except sqlite3.Error as e:
+            print(f"[migrate] 無法重建 index（{e}）：{sql}")
+
+    print(f"[migrate] {table} → WITHOUT ROWID, PRIMARY KEY({', '.join(key_cols)})")
+    return True
+
+def _ensure_unique_index(conn: sqlite3.Connection, table: str, index: str, cols: list[str]):
+    """建立 UNIQUE index；若表內已有重複列，先保留 rowid 最小者再建"""
+    if not _table_exists(conn, table):
+        return
+    col_sql = ",".join(_q(c) for c in cols)
+    conn.execute(f"""
+        DELETE FROM {_q(table)}
+        WHERE rowid NOT IN (SELECT MIN(rowid) FROM {_q(table)} GROUP BY {col_sql})
+    """)
+    conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {_q(index)} ON {_q(table)} ({col_sql})")
+
+def _ensure_index(conn: sqlite3.Connection, table: str, index: str, cols: list[str]):
+    if not _table_exists(conn, table):
+        return
+    col_sql = ",".join(_q(c) for c in cols)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {_q(index)} ON {_q(table)} ({col_sql})")
+
+
+# =========================================================
+# Migrations（依版本號遞增，只能往後加，不要改舊的）
+# =========================================================
+def _m001_clustered_price_report(conn: sqlite3.Connection):
+    """
+    價格 / 報告表改成 (代號, 日期) clustered：
+    單檔區間查詢 WHERE stock_id=? AND date BETWEEN ? AND ? 變成一段連續的 B-tree 掃描
+    另加 (日期, 代號) 次索引給橫斷面查詢
+    """
+    _rebuild_without_rowid(conn, "fm_taiwan_stock_daily", ["stock_id", "date"])
+    _ensure_index(conn, "fm_taiwan_stock_daily", "idx_fm_taiwan_stock_daily_date", ["date", "stock_id"])
+
+    _rebuild_without_rowid(conn, "stock_report_daily", ["股票代號", "日期"])
+    _ensure_index(conn, "stock_report_daily", "idx_stock_report_daily_date", ["日期", "股票代號"])
+
+    # stock_price_involve_report 的 price 可能為 NULL，不適合當 clustered PK；
+    # 改用以 report 開頭的 UNIQUE index，同時讓 INSERT OR IGNORE / 依 report 查詢都走索引
+    _ensure_unique_index(
+        conn, "stock_price_involve_report", "uq_spir_row",
+        ["report", "stock_id", "date", "price_type", "price"],
+    )
+
+    # bulk_upsert 依 (日期, 項目) 判斷衝突
+    _ensure_unique_index(conn, "twse_marginTrading_miMargn", "uq_twse_margin_miMargn", ["日期", "項目"])
+
+
+def _m002_date_coverage(conn: sqlite3.Connection):
+    """
+    多段覆蓋區間表（common/coverage.py），並把 date_span 既有的單一區間搬進來
+    date_span 的日期有 YYYY-MM-DD 與 YYYYMMDD 兩種格式，統一成 YYYY-MM-DD
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS date_coverage (
+            target_table TEXT NOT NULL,
+            idx_key      TEXT NOT NULL,
+            start_date   TEXT NOT NULL,
+            end_date     TEXT NOT NULL,
+            updated_at   INTEGER DEFAULT (strftime('%s','now')),
+            PRIMARY KEY (target_table, idx_key, start_date)
+        ) WITHOUT ROWID
+    """)
+    if not _table_exists(conn, "date_span"):
+        return
+
+    def iso(col: str) -> str:
+        return f"""
+            CASE WHEN length({col}) = 8
+                 THEN substr({col}, 1, 4) || '-' || substr({col}, 5, 2) || '-' || substr({col}, 7, 2)
+                 ELSE substr({col}, 1, 10) END
+        """
+
+    conn.execute(f"""
+        INSERT OR IGNORE INTO date_coverage (target_table, idx_key, start_date, end_date)
+        SELECT target_table, IFNULL(idx_key, ''), {iso("start_date")}, {iso("end_date")}
+        FROM date_span
+        WHERE start_date IS NOT NULL AND end_date IS NOT NULL
+    """)
+
+
+def _m003_negative_cache(conn: sqlite3.Connection):
+    """「查過但沒資料」的結果表（common/negative_cache.py），expires_at 為 NULL 表示永久"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS negative_cache (
+            source      TEXT NOT NULL,
+            idx_key     TEXT NOT NULL,
+            start_date  TEXT NOT NULL,
+            end_date    TEXT NOT NULL,
+            reason      TEXT NOT NULL,
+            expires_at  INTEGER,
+            created_at  INTEGER DEFAULT (strftime('%s','now')),
+            PRIMARY KEY (source, idx_key, start_date, end_date)
+        ) WITHOUT ROWID
+    """)
+
+
+def _m004_twse_margin_stock_daily(conn: sqlite3.Connection):
+    """
+    個股融資融券（TWSE MI_MARGN selectType=ALL），欄位名稱對齊 FinMind TaiwanStockMarginPurchaseShortSale
+    一次寫入一整天所有股票 → 以 (date, stock_id) clustered；另加 (stock_id, date) 索引給單檔查詢
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS twse_margin_stock_daily (
+            date                            TEXT NOT NULL,
+            stock_id                        TEXT NOT NULL,
+            MarginPurchaseBuy               INTEGER,
+            MarginPurchaseSell              INTEGER,
+            MarginPurchaseCashRepayment     INTEGER,
+            MarginPurchaseYesterdayBalance  INTEGER,
+            MarginPurchaseTodayBalance      INTEGER,
+            MarginPurchaseLimit             INTEGER,
+            ShortSaleBuy                    INTEGER,
+            ShortSaleSell                   INTEGER,
+            ShortSaleCashRepayment          INTEGER,
+            ShortSaleYesterdayBalance       INTEGER,
+            ShortSaleTodayBalance           INTEGER,
+            ShortSaleLimit                  INTEGER,
+            OffsetLoanAndShort              INTEGER,
+            Note                            TEXT,
+            PRIMARY KEY (date, stock_id)
+        ) WITHOUT ROWID
+    """)
+    _ensure_index(conn, "twse_margin_stock_daily", "idx_twse_margin_stock_daily_sid", ["stock_id", "date"])
+
+
+def _m005_tpex_tables(conn: sqlite3.Connection):
+    """TPEx 櫃買指數 / 三大法人 / 個股融資融券（module/tpex.py），日期一律 YYYY-MM-DD"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS tpex_trading_index (
+            date         TEXT NOT NULL PRIMARY KEY,
+            volume_k     INTEGER,   -- 成交股數（仟股）
+            amount_k     INTEGER,   -- 成交金額（仟元）
+            trade_count  INTEGER,
+            close_index  REAL,
+            change       REAL
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS tpex_insti_summary (
+            date  TEXT NOT NULL,
+            name  TEXT NOT NULL,
+            buy   INTEGER,
+            sell  INTEGER,
+            net   INTEGER,
+            PRIMARY KEY (date, name)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS tpex_margin_balance (
+            date                            TEXT NOT NULL,
+            stock_id                        TEXT NOT NULL,
+            MarginPurchaseYesterdayBalance  INTEGER,
+            MarginPurchaseBuy               INTEGER,
+            MarginPurchaseSell              INTEGER,
+            MarginPurchaseCashRepayment     INTEGER,
+            MarginPurchaseTodayBalance      INTEGER,
+            ShortSaleYesterdayBalance       INTEGER,
+            ShortSaleSell                   INTEGER,
+            ShortSaleBuy                    INTEGER,
+            ShortSaleCashRepayment          INTEGER,
+            ShortSaleTodayBalance           INTEGER,
+            PRIMARY KEY (date, stock_id)
+        ) WITHOUT ROWID
+    """)
+    _ensure_index(conn, "tpex_margin_balance", "idx_tpex_margin_balance_sid", ["stock_id", "date"])
+
+
+def _m006_taifex_tables(conn: sqlite3.Connection):
+    """TAIFEX 期貨 / 選擇權每日行情與三大法人未平倉（module/taifex.py），日期一律 YYYY-MM-DD"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS taifex_futures_daily (
+            date           TEXT NOT NULL,
+            contract       TEXT NOT NULL,
+            expiry         TEXT NOT NULL,   -- 202509 / 202509W2 / 202509/202510（價差）
+            session        TEXT NOT NULL,   -- 一般 / 盤後
+            open           REAL,
+            high           REAL,
+            low            REAL,
+            close          REAL,
+            change         REAL,
+            volume         INTEGER,
+            settlement     REAL,
+            open_interest  INTEGER,
+            best_bid       REAL,
+            best_ask       REAL,
+            PRIMARY KEY (date, contract, expiry, session)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS taifex_options_daily (
+            date           TEXT NOT NULL,
+            contract       TEXT NOT NULL,
+            expiry         TEXT NOT NULL,
+            strike         REAL NOT NULL,
+            call_put       TEXT NOT NULL,   -- 買權 / 賣權
+            session        TEXT NOT NULL,
+            open           REAL,
+            high           REAL,
+            low            REAL,
+            close          REAL,
+            volume         INTEGER,
+            settlement     REAL,
+            open_interest  INTEGER,
+            best_bid       REAL,
+            best_ask       REAL,
+            PRIMARY KEY (date, contract, expiry, strike, call_put, session)
+        ) WITHOUT ROWID
+    """)
+    for table, extra_key in (("taifex_fut_institutional", ""), ("taifex_opt_institutional", "call_put TEXT NOT NULL,")):
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                date               TEXT NOT NULL,
+                contract           TEXT NOT NULL,
+                {extra_key}
+                identity           TEXT NOT NULL,   -- 自營商 / 投信 / 外資
+                long_volume        INTEGER,
+                short_volume       INTEGER,
+                net_volume         INTEGER,
+                long_oi            INTEGER,
+                short_oi           INTEGER,
+                net_oi             INTEGER,
+                net_oi_amount_k    INTEGER,
+                PRIMARY KEY (date, contract, {"call_put, " if extra_key else ""}identity)
+            ) WITHOUT ROWID
+        """)
+
+
+# 表還不存在時直接建成 clustered（欄位同 finMind.PRICE_COLS / stock_report_utils.COLUMNS 當時的版本）
+_REPORT_TEXT_COLS = ["K線型態", "資金走向判讀"] + [f"{n}日最大量_日期" for n in (5, 10, 20, 60)]
+_REPORT_REAL_COLS = (
+    ["開盤價", "收盤價", "收盤_開盤", "最高價", "最低價", "日振幅", "漲跌幅_pct", "日振幅_昨收_pct", "成交量", "量增率_pct"]
+    + [f"{n}日{c}" for n in (5, 10, 20, 60) for c in ("均量", "最大量")]
+    + ["實體_pct", "上影_pct", "下影_pct", "跳空缺口"]
+    + [f"{n}日{c}" for c in ("平均", "上升幅度", "扣抵值", "扣抵影響_pct", "乖離") for n in (5, 10, 20, 60)]
+    + ["總成交金額_億", "法人總買超_億", "買超_外資_億", "買超_投信_億", "買超_自營商_億", "買超_融資_億", "資金走向"]
+)
+
+
+def _create_price_report_tables(conn: sqlite3.Connection):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS fm_taiwan_stock_daily (
+            date             TEXT NOT NULL,
+            stock_id         TEXT NOT NULL,
+            Trading_Volume   INTEGER,
+            Trading_money    INTEGER,
+            open             REAL,
+            max              REAL,
+            min              REAL,
+            close            REAL,
+            spread           REAL,
+            Trading_turnover INTEGER,
+            PRIMARY KEY (stock_id, date)
+        ) WITHOUT ROWID
+    """)
+    cols = ",\n".join(
+        [f"{_q(c)} TEXT" for c in _REPORT_TEXT_COLS] + [f"{_q(c)} REAL" for c in _REPORT_REAL_COLS]
+    )
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS stock_report_daily (
+            "日期"     TEXT NOT NULL,
+            "股票代號" TEXT NOT NULL,
+            {cols},
+            is_complete INTEGER DEFAULT 0,
+            updated_at  TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+            PRIMARY KEY ("股票代號", "日期")
+        ) WITHOUT ROWID
+    """)
+
+
+def _m007_cluster_late_tables(conn: sqlite3.Connection):
+    """
+    v1 當時價格 / 報告表還不存在的資料庫（之後才由程式建表，是一般 rowid 表）：
+    補做 v1 的 clustered 重建與索引；表仍不存在就直接建成 clustered
+    已 clustered / 已有索引的不會動
+    """
+    _rebuild_without_rowid(conn, "fm_taiwan_stock_daily", ["stock_id", "date"])
+    _rebuild_without_rowid(conn, "stock_report_daily", ["股票代號", "日期"])
+    _create_price_report_tables(conn)
+    _ensure_index(conn, "fm_taiwan_stock_daily", "idx_fm_taiwan_stock_daily_date", ["date", "stock_id"])
+    _ensure_index(conn, "stock_report_daily", "idx_stock_report_daily_date", ["日期", "股票代號"])
+    _ensure_unique_index(
+        conn, "stock_price_involve_report", "uq_spir_row",
+        ["report", "stock_id", "date", "price_type", "price"],
+    )
+    _ensure_unique_index(conn, "twse_marginTrading_miMargn", "uq_twse_margin_miMargn", ["日期", "項目"])
+
+
+def _m008_taifex_insti_commodity(conn: sqlite3.Connection):
+    """
+    法人未平倉表加上查詢用的商品代號（TXF / MXF / TXO…）：CSV 只有中文商品名稱，無法反查
+    既有列沒有代號 → 清掉這兩張表的覆蓋紀錄，下次查詢時重抓補上
+    """
+    for table in ("taifex_fut_institutional", "taifex_opt_institutional"):
+        cols = [r[1] for r in conn.execute(f"PRAGMA table_info({_q(table)})")]
+        if "commodity_id" not in cols:
+            conn.execute(f"ALTER TABLE {_q(table)} ADD COLUMN commodity_id TEXT")
+        _ensure_index(conn, table, f"idx_{table}_commodity", ["commodity_id", "date"])
+        conn.execute("DELETE FROM date_coverage WHERE target_table = ?", (table,))
+
+
+def _m009_twse_mi_5mins_hist(conn: sqlite3.Connection):
+    """
+    加權指數每日 OHLC（twse.get_twse_indicesReport_mi_5mins_hist 維護，taifex.get_tx_basis 也會讀）
+    舊資料庫是手動建的表；新資料庫從這裡建，欄位同 twse 的 docstring
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS twse_indicesReport_mi_5mins_hist (
+            date        TEXT,
+            date_ad     TEXT NOT NULL,
+            date_ts     INTEGER,
+            open_index  REAL,
+            high_index  REAL,
+            low_index   REAL,
+            close_index REAL,
+            created_at  INTEGER DEFAULT (strftime('%s','now')),
+            UNIQUE (date_ad)
+        )
+    """)
+
+
+MIGRATIONS = [
+    (1, "clustered price / report tables", _m001_clustered_price_report),
+    (2, "date_coverage interval table", _m002_date_coverage),
+    (3, "negative_cache table", _m003_negative_cache),
+    (4, "twse_margin_stock_daily table", _m004_twse_margin_stock_daily),
+    (5, "tpex index / institutional / margin tables", _m005_tpex_tables),
+    (6, "taifex futures / options tables", _m006_taifex_tables),
+    # v1 當時表還不存在的資料庫（之後才建表）再跑一次：已 clustered / 已有索引的不會動
+    (7, "cluster price / report tables created after v1", _m007_cluster_late_tables),
+    (8, "taifex institutional commodity_id", _m008_taifex_insti_commodity),
+    (9, "twse MI_5MINS_HIST index table", _m009_twse_mi_5mins_hist),
+]
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    依序套用尚未執行的 migration，回傳最後的版本號
+    某一版失敗時 rollback 並停在前一版（不影響既有查詢）
+    """
+    version = current_version(conn)
+    applied = False
+
+    for target, name, fn in MIGRATIONS:
+        if target <= version:
+            continue
+        # 重建表時不要讓 RENAME 去改寫 view 內的參照
+        conn.execute("PRAGMA legacy_alter_table = ON")
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # 拿到寫入鎖後重讀版本：同時啟動的其他 process 可能已經套用過
+            latest = current_version(conn)
+            if latest >= target:
+                conn.rollback()
+                version = latest
+                continue
+            print(f"[migrate] v{latest} → v{target}: {name}")
+            fn(conn)
+            conn.execute(f"PRAGMA user_version = {int(target)}")
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"[migrate] v{target} 失敗，已 rollback：{e}")
+            break
+        finally:
+            conn.execute("PRAGMA legacy_alter_table = OFF")
+        version = target
+        applied = True
+
+    if applied:
+        conn.execute("ANALYZE")
+        conn.commit()
+    return version
+
+
+# python -m common.migrations
+if __name__ == "__main__":
+    from common import db
+    with db.get_connection() as conn:
+        print(f"schema version: {migrate(conn)}")
@@ -0,0 +1,120 @@
+import time
+import pandas as pd
+from datetime import datetime
+from common import db, coverage, raw_cache
+
+# =========================================================
+# 負向快取：記住「查過但沒拿到資料」的日期區間，規劃抓取時先排除
+#   表：negative_cache(source, idx_key, start_date, end_date, reason, expires_at)
+#   - 日期一律 YYYY-MM-DD，區間含頭含尾
+#   - 依 reason 決定多久後失效；expires_at 為 NULL 表示永久
+#   - 區間碰到今天（資料可能只是還沒開出來）一律只記短時間
+# =========================================================
+
+TABLE = "negative_cache"
+
+HOLIDAY = "holiday"   # 交易所明確回覆該日無交易資料（颱風假、臨時休市）
+NO_DATA = "no_data"   # 查詢成功但沒有資料（停牌、下市、尚未上市）
+EMPTY = "empty"       # 空白回應
+HTML = "html"         # 回傳 HTML：維護中或被 BAN
+FORMAT = "format"     # JSON 結構不完整
+
+# 各原因的有效秒數；None = 永久
+REASON_TTL_SEC: dict[str, int | None] = {
+    HOLIDAY: None,
+    NO_DATA: None,
+    EMPTY: 6 * 60 * 60,
+    HTML: 30 * 60,
+    FORMAT: 60 * 60,
+}
+RECENT_TTL_SEC = 60 * 60   # 區間含今天以後：最多記 1 小時
+
+DateLike = datetime | pd.Timestamp | str
+
+
+def _dstr(d: DateLike) -> str:
+    return pd.Timestamp(d).normalize().strftime("%Y-%m-%d")
+
+def _key(idx_key) -> str:
+    return "" if idx_key is None else str(idx_key)
+
+
+def _expires_at(reason: str, end: DateLike) -> int | None:
+    ttl = REASON_TTL_SEC.get(reason, RECENT_TTL_SEC)
+    if pd.Timestamp(end).normalize() >= pd.Timestamp.today().normalize():
+        ttl = RECENT_TTL_SEC if ttl is None else min(ttl, RECENT_TTL_SEC)
+    return None if ttl is None else int(time.time()) + ttl
+
+
+def record(source: str, idx_key, start: DateLike, end: DateLike, reason: str):
+    """記錄 [start, end] 查無資料；同一區間重複記錄時以最新的原因 / 期限為準"""
+    db.execute_sql(
+        f"""
+        INSERT INTO {TABLE} (source, idx_key, start_date, end_date, reason, expires_at, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, strftime('%s','now'))
+        ON CONFLICT(source, idx_key, start_date, end_date) DO UPDATE SET
+          reason     = excluded.reason,
+          expires_at = excluded.expires_at,
+          created_at = excluded.created_at
+        """,
+        (source, _key(idx_key), _dstr(start), _dstr(end), reason, _expires_at(reason, end)),
+    )
+
+
+def live_ranges(
+    source: str,
+    idx_key,
+    start: DateLike | None = None,
+    end: DateLike | None = None,
+) -> list[tuple[pd.Timestamp, pd.Timestamp]]:
+    """
+    尚未失效、且與 [start, end] 重疊的負向區間（依起日排序）
+    replay 模式一律回傳 []：不跳過任何日期，全部交給快取重播
+    """
+    if raw_cache.get_mode() == "replay":
+        return []
+    sql = f"""
+        SELECT start_date, end_date FROM {TABLE}
+        WHERE source = ? AND idx_key = ?
+          AND (expires_at IS NULL OR expires_at > ?)
+    """
+    params: list = [source, _key(idx_key), int(time.time())]
+    if end is not None:
+        sql += " AND start_date <= ?"
+        params.append(_dstr(end))
+    if start is not None:
+        sql += " AND end_date >= ?"
+        params.append(_dstr(start))
+    sql += " ORDER BY start_date"
+
+    df = db.query_to_df(sql, tuple(params))
+    return [(pd.Timestamp(s), pd.Timestamp(e)) for s, e in zip(df["start_date"], df["end_date"])]
+
+
+def is_negative(source: str, idx_key, start: DateLike, end: DateLike | None = None) -> bool:
+    """[start, end]（預設單日）是否整段落在有效的負向區間內"""
+    s = pd.Timestamp(start).normalize()
+    e = pd.Timestamp(end if end is not None else start).normalize()
+    return not coverage.subtract_ranges(s, e, live_ranges(source, idx_key, s, e))
+
+
+def filter_days(source: str, idx_key, days) -> list:
+    """從 days 中排除落在有效負向區間的日子（days 可為 datetime / Timestamp / YYYYMMDD 字串）"""
+    if len(days) == 0:
+        return []
+    ts = pd.to_datetime(pd.Series(list(days)).astype(str))
+    ranges = live_ranges(source, idx_key, ts.min(), ts.max())
+    if not ranges:
+        return list(days)
+    hit = pd.Series(False, index=ts.index)
+    for s, e in ranges:
+        hit |= (ts >= s) & (ts <= e)
+    return [d for d, h in zip(days, hit) if not h]
+
+
+def purge_expired() -> bool:
+    """刪掉已失效的紀錄"""
+    return db.execute_sql(
+        f"DELETE FROM {TABLE} WHERE expires_at IS NOT NULL AND expires_at <= ?",
+        (int(time.time()),),
+    )
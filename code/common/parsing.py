@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+from common import dates
+
+# =========================================================
+# API 表格資料（fields / data）的整欄解析
+#   - 一次把整欄字串轉成數字 / 日期，不逐格 try/except
+#   - 千分位逗號去掉；"" / "-" / "--" 視為空值（NULL），不是錯誤
+#   - 轉換失敗的列回傳在 bad 遮罩裡，由呼叫端決定略過或回報，不再逐列 print
+#
+#   df, bad = parsing.parse_table(body["data"], {
+#       "date_ad": (0, "roc_date"),
+#       "close":   ("收盤價", "float"),
+#   }, fields=body["fields"], required=["date_ad"])
+# =========================================================
+
+NULL_TOKENS = ["", "-", "--", "---"]
+
+# 欄位型別：
+#   raw      原字串（只去頭尾空白）
+#   text     同 raw（保留空字串，與舊資料一致）
+#   int      整數（小數無條件捨去，同舊 _to_int），空值 → NULL
+#   float    浮點數，空值 → NULL
+#   roc_date 民國日期 '114/01/02'、'114.01.02'、'114-01-02' → '2025-01-02'
+#   roc_ts   民國日期 → 台北時間當天 00:00 的 unix ts（同 dates.roc_to_unix）
+KINDS = ("raw", "text", "int", "float", "roc_date", "roc_ts")
+
+
+def _strip(s: pd.Series) -> pd.Series:
+    """轉成字串並去頭尾空白；原本是 None / NaN 的維持 NaN"""
+    return s.where(s.isna(), s.astype(str)).str.strip()
+
+
+def _by_unique(s: pd.Series, fn) -> tuple[pd.Series, np.ndarray]:
+    """
+    API 資料重複值很多（日期、"--"、同一個價位），只對不重複的值做轉換再展開回原長度
+    fn(uniques) → (值, bad)；原本缺值的格子交給 fn 的 NaN 規則處理
+    """
+    codes, uniques = pd.factorize(s, use_na_sentinel=False)
+    val, bad = fn(pd.Series(uniques, dtype=object))
+    return pd.Series(val.to_numpy()[codes], index=s.index, dtype=val.dtype), bad[codes]
+
+
+def _nulls(s: pd.Series) -> pd.Series:
+    """空值遮罩：原本缺值或內容是 NULL_TOKENS"""
+    return s.isna() | s.isin(NULL_TOKENS)
+
+
+def to_number(s: pd.Series, integer: bool = False) -> tuple[pd.Series, np.ndarray]:
+    """
+    整欄轉數字，回傳 (值, bad)
+    bad：有內容但不是數字的格子（空值不算錯）
+    """
+    txt = _strip(s).str.replace(",", "", regex=False)
+    null = _nulls(txt)
+    val = pd.to_numeric(txt.mask(null), errors="coerce").astype("float64")
+    bad = (val.isna() & ~null).to_numpy(dtype=bool)
+    if integer:
+        val = np.trunc(val).astype("Int64")
+    return val, bad
+
+
+def roc_to_iso(s: pd.Series) -> tuple[pd.Series, np.ndarray]:
+    """民國日期 → 'YYYY-MM-DD'，回傳 (值, bad)"""
+    days = dates.roc_to_epoch_day(_strip(s))
+    bad = (days.isna() & ~_nulls(_strip(s))).to_numpy(dtype=bool)
+    return dates.epoch_day_to_iso(days), bad
+
+
+def roc_to_ts(s: pd.Series) -> tuple[pd.Series, np.ndarray]:
+    """民國日期 → 台北時間當天 00:00 的 unix ts，回傳 (值, bad)"""
+    days = dates.roc_to_epoch_day(_strip(s))
+    bad = (days.isna() & ~_nulls(_strip(s))).to_numpy(dtype=bool)
+    return dates.epoch_day_to_ts(days), bad
+
+
+# =========================
+# 整張表
+# =========================
+def parse_table(
+    data: list,
+    columns: dict[str, tuple[int | str, str]],
+    fields: list[str] | None = None,
+    required: list[str] | tuple = (),
+) -> tuple[pd.DataFrame, np.ndarray]:
+    """
+    data    : API 的 data（list of list，每列長度可以不同）
+    columns : {輸出欄名: (來源位置 或 fields 內的欄名, 型別)}，型別見 KINDS
+    fields  : 來源用欄名指定時必填
+    required: 這些欄位是空值也算錯（JSON null、列太短缺這一格都算空值）
+    回傳 (df, bad)：df 與 data 同列數、欄位依 columns 順序；bad[i] 表示第 i 列有欄位解析失敗
+    非 required 欄位缺值 → NULL，不算失敗
+    """
+    raw = pd.DataFrame(data)
+    n = len(raw)
+    out = pd.DataFrame(index=raw.index)
+    bad = np.zeros(n, dtype=bool)
+    if n == 0:
+        return pd.DataFrame(columns=list(columns)), bad
+
+    for name, (src, kind) in columns.items():
+        if kind not in KINDS:
+            raise ValueError(f"未知的欄位型別：{kind}")
+        pos = fields.index(src) if isinstance(src, str) else src
+        if pos >= raw.shape[1]:
+            col = pd.Series([None] * n, index=raw.index, dtype=object)
+        else:
+            col = raw[pos]
+
+        if kind in ("raw", "text"):
+            out[name] = _strip(col).astype(object)
+            err = np.zeros(n, dtype=bool)
+        elif kind in ("int", "float"):
+            out[name], err = _by_unique(col, lambda u: to_number(u, integer=(kind == "int")))
+        elif kind == "roc_date":
+            out[name], err = _by_unique(col, roc_to_iso)
+        else:
+            out[name], err = _by_unique(col, roc_to_ts)
+        bad |= err
+
+        if name in required:
+            bad |= out[name].isna().to_numpy(dtype=bool)
+
+    return out, bad
+
+
+def report_errors(tag: str, data: list, bad: np.ndarray, limit: int = 3):
+    """解析失敗的列只印一行摘要（前 limit 筆當例子）"""
+    n_bad = int(bad.sum())
+    if n_bad == 0:
+        return
+    samples = [data[i] for i in np.flatnonzero(bad)[:limit]]
+    print(f"⚠ {tag}：{n_bad}/{len(data)} 列解析失敗，例：{samples}")
+
+
+def to_records(df: pd.DataFrame) -> list[tuple]:
+    """DataFrame → sqlite 可綁定的 tuple list（NaN / NA → None）"""
+    obj = df.astype(object)
+    return list(obj.where(df.notna(), None).itertuples(index=False, name=None))
@@ -0,0 +1,159 @@
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable
+
+# =========================================================
+# 抓取 → 解析 → 寫入 三段式管線
+#   - fetch：多個 worker 打 API（網路等待）
+#   - parse：轉成可寫入的 DataFrame / rows（CPU）
+#   - write：只有一個 writer（呼叫端所在的 thread）寫 SQLite（磁碟）
+#   - 各段之間用有上限的 Queue 串接：writer 跟不上時 fetch 會自動停下來等（backpressure）
+#   - 每段各自統計處理筆數、錯誤數、實際工作秒數
+# =========================================================
+
+_DONE = object()
+
+
+class StageStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.errors = 0
+        self.busy_sec = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, elapsed: float, error: bool = False):
+        with self._lock:
+            self.items += 1
+            self.busy_sec += elapsed
+            self.errors += int(error)
+
+    def as_dict(self) -> dict:
+        rate = self.items / self.busy_sec if self.busy_sec > 0 else 0.0
+        return {
+            "items": self.items,
+            "errors": self.errors,
+            "busy_sec": round(self.busy_sec, 3),
+            "items_per_busy_sec": round(rate, 2),
+        }
+
+
+def _default_on_error(stage: str, job: Any, exc: Exception):
+    print(f"[pipeline] {stage} 失敗 {job}: {exc}")
+
+
+def run_pipeline(
+    jobs: Iterable,
+    fetch: Callable[[Any], Any],
+    parse: Callable[[Any, Any], Any],
+    write: Callable[[Any, Any], Any],
+    fetch_workers: int = 3,
+    parse_workers: int = 1,
+    queue_size: int = 8,
+    on_error: Callable[[str, Any, Exception], None] = _default_on_error,
+    name: str = "pipeline",
+) -> dict[str, dict]:
+    """
+    對每個 job：raw = fetch(job) → parsed = parse(job, raw) → write(job, parsed)
+    - parse 回傳 None 表示這筆不用寫入
+    - 任何一段丟例外只影響該筆，交給 on_error(stage, job, exc)
+    - write 在呼叫端 thread 執行（單一 writer），寫入順序為完成順序
+    回傳各段統計 {"fetch": {...}, "parse": {...}, "write": {...}, "wall_sec": ...}
+    """
+    job_q: queue.Queue = queue.Queue()
+    parse_q: queue.Queue = queue.Queue(maxsize=queue_size)
+    write_q: queue.Queue = queue.Queue(maxsize=queue_size)
+    stats = {s: StageStats(s) for s in ("fetch", "parse", "write")}
+
+    n_jobs = 0
+    for job in jobs:
+        job_q.put(job)
+        n_jobs += 1
+    for _ in range(fetch_workers):
+        job_q.put(_DONE)
+
+    # 最後一個結束的 worker 負責往下一段送結束訊號
+    remaining = {"fetch": fetch_workers, "parse": parse_workers}
+    remaining_lock = threading.Lock()
+
+    def finish(stage: str, next_q: queue.Queue, n_signals: int):
+        with remaining_lock:
+            remaining[stage] -= 1
+            last = remaining[stage] == 0
+        if last:
+            for _ in range(n_signals):
+                next_q.put(_DONE)
+
+    def fetch_worker():
+        try:
+            while (job := job_q.get()) is not _DONE:
+                t0 = time.perf_counter()
+                try:
+                    raw = fetch(job)
+                except Exception as e:
+                    stats["fetch"].add(time.perf_counter() - t0, error=True)
+                    on_error("fetch", job, e)
+                    continue
+                stats["fetch"].add(time.perf_counter() - t0)
+                parse_q.put((job, raw))
+        finally:
+            finish("fetch", parse_q, parse_workers)
+
+    def parse_worker():
+        try:
+            while (item := parse_q.get()) is not _DONE:
+                job, raw = item
+                t0 = time.perf_counter()
+                try:
+                    parsed = parse(job, raw)
+                except Exception as e:
+                    stats["parse"].add(time.perf_counter() - t0, error=True)
+                    on_error("parse", job, e)
+                    continue
+                stats["parse"].add(time.perf_counter() - t0)
+                if parsed is not None:
+                    write_q.put((job, parsed))
+        finally:
+            finish("parse", write_q, 1)
+
+    wall_t0 = time.perf_counter()
+    threads = [
+        threading.Thread(target=fetch_worker, name=f"{name}-fetch-{i}", daemon=True)
+        for i in range(fetch_workers)
+    ] + [
+        threading.Thread(target=parse_worker, name=f"{name}-parse-{i}", daemon=True)
+        for i in range(parse_workers)
+    ]
+    for t in threads:
+        t.start()
+
+    # 單一 writer：就在呼叫端的 thread 寫
+    while (item := write_q.get()) is not _DONE:
+        job, parsed = item
+        t0 = time.perf_counter()
+        try:
+            write(job, parsed)
+        except Exception as e:
+            stats["write"].add(time.perf_counter() - t0, error=True)
+            on_error("write", job, e)
+            continue
+        stats["write"].add(time.perf_counter() - t0)
+
+    for t in threads:
+        t.join()
+
+    result = {s: st.as_dict() for s, st in stats.items()}
+    result["jobs"] = n_jobs
+    result["wall_sec"] = round(time.perf_counter() - wall_t0, 3)
+    return result
+
+
+def print_stats(name: str, result: dict[str, dict]):
+    print(
+        f"📊 {name}: {result['jobs']} jobs, {result['wall_sec']}s | "
+        + " | ".join(
+            f"{s} {result[s]['items']} (err {result[s]['errors']}) busy {result[s]['busy_sec']}s"
+            for s in ("fetch", "parse", "write")
+        )
+    )
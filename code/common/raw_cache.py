@@ -0,0 +1,142 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import parse_qsl, urlsplit
+
+# =========================================================
+# 原始 HTTP 回應快取（壓縮存檔，可離線重播）
+#   - 獨立的 SQLite 檔（不跟 data_center.db 搶寫入鎖）
+#   - key = (method, endpoint = host + path, 正規化後的參數)；body 以 zlib 壓縮
+#   - 模式（環境變數 INVEST_RAW_CACHE，或 with raw_cache.mode(...)）：
+#       off    ：不讀不寫（預設；要存原始回應需明確設定 INVEST_RAW_CACHE=write）
+#       write  ：照常連網，每個成功回應都存一份
+#       prefer ：有快取就用快取，沒有才連網（並存下）
+#       replay ：只讀快取、完全不連網；沒快取丟 RawCacheMiss
+#     解析邏輯修正後，用 replay 重跑 parser 就不必再打一次 API
+#     （replay 時 coverage / negative_cache 視為全空，已入庫的區間也會重新解析）
+# =========================================================
+
+CACHE_PATH = Path("../data_center/raw_cache.db")
+MODES = ("off", "write", "prefer", "replay")
+COMPRESS_LEVEL = 6
+
+# 這些參數每次都不同或是敏感資訊，不放進 key
+IGNORED_PARAMS = {"_", "token"}
+
+_mode = os.environ.get("INVEST_RAW_CACHE", "off").lower()
+_local = threading.local()
+
+
+class RawCacheMiss(LookupError):
+    """replay 模式下找不到對應的快取"""
+
+
+def get_mode() -> str:
+    return _mode
+
+
+def set_mode(mode: str):
+    global _mode
+    if mode not in MODES:
+        raise ValueError(f"raw_cache mode 必須是 {MODES}")
+    _mode = mode
+
+
+@contextmanager
+def mode(m: str):
+    """暫時切換模式，例如 with raw_cache.mode("replay"): 重跑解析"""
+    prev = get_mode()
+    set_mode(m)
+    try:
+        yield
+    finally:
+        set_mode(prev)
+
+
+def _connection() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "pid", None) != os.getpid():
+        CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(CACHE_PATH, timeout=10, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS raw_response (
+                method       TEXT NOT NULL,
+                endpoint     TEXT NOT NULL,
+                params       TEXT NOT NULL,
+                status       INTEGER NOT NULL,
+                content_type TEXT,
+                body         BLOB NOT NULL,
+                raw_bytes    INTEGER NOT NULL,
+                fetched_at   INTEGER NOT NULL,
+                PRIMARY KEY (method, endpoint, params)
+            ) WITHOUT ROWID
+        """)
+        conn.commit()
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+
+def make_key(method: str, url: str, params=None, data=None) -> tuple[str, str, str]:
+    """URL 本身的 query + params + data 合併後排序，同樣的查詢不論參數寫法都對到同一筆"""
+    parts = urlsplit(url)
+    items = parse_qsl(parts.query, keep_blank_values=True)
+    for extra in (params, data):
+        if isinstance(extra, dict):
+            items += [(k, v) for k, v in extra.items() if v is not None]
+        elif extra:
+            items += list(extra)
+    items = sorted((str(k), str(v)) for k, v in items if k not in IGNORED_PARAMS)
+    return method.upper(), f"{parts.hostname}{parts.path}", json.dumps(items, ensure_ascii=False)
+
+
+def get(key: tuple[str, str, str]) -> dict | None:
+    """回傳 {"status", "content_type", "body", "fetched_at"}；沒有則 None（只讀不建檔）"""
+    if not CACHE_PATH.exists():
+        return None
+    row = _connection().execute(
+        """
+        SELECT status, content_type, body, fetched_at FROM raw_response
+        WHERE method = ? AND endpoint = ? AND params = ?
+        """,
+        key,
+    ).fetchone()
+    if row is None:
+        return None
+    status, content_type, body, fetched_at = row
+    return {
+        "status": status,
+        "content_type": content_type,
+        "body": zlib.decompress(body),
+        "fetched_at": fetched_at,
+    }
+
+
+def put(key: tuple[str, str, str], status: int, content_type: str | None, body: bytes):
+    conn = _connection()
+    conn.execute(
+        """
+        INSERT OR REPLACE INTO raw_response
+            (method, endpoint, params, status, content_type, body, raw_bytes, fetched_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (*key, status, content_type, zlib.compress(body, COMPRESS_LEVEL), len(body), int(time.time())),
+    )
+    conn.commit()
+
+
+def entries(endpoint: str | None = None) -> list[tuple[str, str, str, int]]:
+    """列出快取內容 (method, endpoint, params, fetched_at)，方便挑出要重播的查詢"""
+    sql = "SELECT method, endpoint, params, fetched_at FROM raw_response"
+    params: tuple = ()
+    if endpoint:
+        sql += " WHERE endpoint = ?"
+        params = (endpoint,)
+    return _connection().execute(sql + " ORDER BY endpoint, fetched_at", params).fetchall()
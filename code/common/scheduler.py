@@ -0,0 +1,220 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator
+
+# =========================================================
+# 抓取排程器
+#   - TokenBucket：每個 host 一個速率限制，被擋（429 / BAN 頁）時自動減速，
+#     之後每次成功慢慢加回原本速率（AIMD）
+#   - FetchScheduler：把抓取工作丟到 thread pool 平行跑，
+#     結果依「送出順序」交回給呼叫端（寫 DB 的一方照順序處理即可）
+#   - agather_ordered：asyncio 版本，同步的 http_client 呼叫丟到 thread 執行，
+#     Semaphore 控制在途數量，速率仍由同一組 TokenBucket 管
+# =========================================================
+
+# 各來源可承受的速率（每秒請求數, 突發量）；host 以結尾比對
+HOST_RATES: dict[str, tuple[float, int]] = {
+    "twse.com.tw": (0.6, 3),          # TWSE 約 5 秒 3 次以上就會被 BAN
+    "tpex.org.tw": (1.0, 3),
+    "taifex.com.tw": (1.0, 3),
+    "finmindtrade.com": (0.5, 5),     # FinMind 有 token：每小時約 1600 次
+}
+DEFAULT_RATE = (5.0, 5)
+
+FINMIND_HOST = "api.finmindtrade.com"
+
+
+class TokenBucket:
+    """
+    rate 個 token / 秒，最多累積 burst 個；acquire() 拿不到就等
+    penalize()：速率減半並清空 token；reward()：每次成功加回 base_rate 的 5%
+    """
+
+    def __init__(self, rate: float, burst: int = 1, min_rate: float | None = None):
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.min_rate = min_rate if min_rate is not None else rate / 16
+        self.tokens = float(self.capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def penalize(self):
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0.0
+
+    def reward(self):
+        if self.rate >= self.base_rate:
+            return
+        with self._lock:
+            self.rate = min(self.base_rate, self.rate + self.base_rate * 0.05)
+
+
+_limiters: dict[str, TokenBucket] = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter(host: str) -> TokenBucket:
+    """取得 host 共用的 TokenBucket（同一個 process 內共用）"""
+    with _limiters_lock:
+        bucket = _limiters.get(host)
+        if bucket is None:
+            rate, burst = next(
+                (v for k, v in HOST_RATES.items() if host.endswith(k)), DEFAULT_RATE
+            )
+            bucket = _limiters[host] = TokenBucket(rate, burst)
+        return bucket
+
+
+def looks_throttled(exc: BaseException) -> bool:
+    """非 http_client 的呼叫（例如 FinMind DataLoader）用例外訊息判斷是否被限流"""
+    msg = str(exc).lower()
+    return "429" in msg or "upper limit" in msg or "too many requests" in msg
+
+
+class FetchScheduler:
+    """
+    用法：
+        with FetchScheduler(max_workers=4) as sch:
+            for item, result, err in sch.imap(fetch_fn, items, host=FINMIND_HOST):
+                ...  # 依 items 順序拿到結果，在這裡寫 DB
+    host / bucket：工作本身不經過 http_client 時（例如 DataLoader），由排程器先拿 token
+    經過 http_client 的工作不要再給 host，http_client 自己會拿
+    """
+
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fetch")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+    def submit(
+        self,
+        fn: Callable,
+        *args,
+        host: str | None = None,
+        bucket: TokenBucket | None = None,
+        **kwargs,
+    ) -> Future:
+        bucket = bucket or (limiter(host) if host else None)
+
+        def run():
+            if bucket is not None:
+                bucket.acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                if bucket is not None and looks_throttled(e):
+                    bucket.penalize()
+                raise
+            if bucket is not None:
+                bucket.reward()
+            return result
+
+        return self._executor.submit(run)
+
+    def imap(
+        self,
+        fn: Callable[[Any], Any],
+        items: Iterable,
+        host: str | None = None,
+        bucket: TokenBucket | None = None,
+    ) -> Iterator[tuple[Any, Any, Exception | None]]:
+        """
+        對每個 item 執行 fn(item)，依送出順序 yield (item, 結果, 例外)
+        同時在途的工作最多 max_workers * 2 個，不會一次把全部工作塞進 queue
+        """
+        window = self.max_workers * 2
+        pending: deque[tuple[Any, Future]] = deque()
+        it = iter(items)
+
+        def fill():
+            while len(pending) < window:
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+                pending.append((item, self.submit(fn, item, host=host, bucket=bucket)))
+
+        fill()
+        while pending:
+            item, fut = pending.popleft()
+            try:
+                yield item, fut.result(), None
+            except Exception as e:
+                yield item, None, e
+            fill()
+
+
+# =========================================================
+# asyncio 版本
+# =========================================================
+async def agather_ordered(
+    fn: Callable[[Any], Any],
+    items: Iterable,
+    concurrency: int = 4,
+    host: str | None = None,
+) -> list[tuple[Any, Any, Exception | None]]:
+    """
+    對每個 item 以 asyncio.to_thread 執行 fn(item)，最多 concurrency 個同時在途
+    回傳與 items 同順序的 [(item, 結果, 例外)]
+    host：fn 不經過 http_client 時由這裡拿 token（同 FetchScheduler.submit）
+    """
+    sem = asyncio.Semaphore(concurrency)
+    bucket = limiter(host) if host else None
+
+    def call(item):
+        if bucket is not None:
+            bucket.acquire()
+        return fn(item)
+
+    async def one(item):
+        async with sem:
+            try:
+                return item, await asyncio.to_thread(call, item), None
+            except Exception as e:
+                if bucket is not None and looks_throttled(e):
+                    bucket.penalize()
+                return item, None, e
+
+    return list(await asyncio.gather(*(one(i) for i in items)))
+
+
+def run_async(coro):
+    """
+    同步程式呼叫 async 抓取用：沒有 event loop 時直接 asyncio.run；
+    已在 loop 裡（例如 Jupyter）時改在另一個 thread 跑，避免 "loop already running"
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        return ex.submit(asyncio.run, coro).result()
@@ -1,5 +1,5 @@
 from datetime import datetime
-import dataHandler as db
+from common import dataHandler as db
 import requests
 import pandas as pd
 
@@ -49,7 +49,8 @@ def get_margin_trading(date: datetime | None = None) -> pd.DataFrame:
         api_name,
         endpoint,
         date=date,
-        fetch_api=fetch_api
+        fetch_api=fetch_api,
+        key_cols=["time", "項目"],  # 一天有多個項目（融資/融券...）
     )
 
     # 抓完就直接讀 SQLite    
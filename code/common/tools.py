@@ -1,26 +1,12 @@
-import sys, os
-sys.path.append(os.path.dirname(__file__))
-
+import os
 import pandas as pd
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
-import os
-import db
+from common import db, dates
 
 def roc_to_unix(roc_date: str) -> int:
-    year = None 
-    month = None 
-    day = None    
-    seperators = ["/", ".", "-"]
-    for seperator in seperators:
-        if seperator in roc_date:  
-            year, month, day = map(int, roc_date.split(seperator))
-    if year is None:
-        return None
-        
-    gregorian_year = year + 1911 # 民國 → 西元（加 1911 年）
-    dt = datetime(gregorian_year, month, day)
-    return int(dt.timestamp())
+    """民國日期 → 台北時間當天 00:00 的 unix ts（實作在 common.dates，有快取、不受本機時區影響）"""
+    return dates.roc_to_unix(roc_date)
 
 def _date_to_str(date: datetime = None, formate: str = None) -> str:
     """將 datetime 轉為 yyyymmdd 字串，若未指定則取今日"""
@@ -0,0 +1,195 @@
+import os
+import time
+import threading
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from common import http_client
+
+# =========================================================
+# 台股交易日曆
+#   - 每個 process 只從本地 CSV 載入一次（get_calendar()）
+#   - 是否要上網檢查更新，看「上次檢查時間」（CSV 的 mtime），不是每次呼叫都打 API
+#   - 超過已知最後一天的日期，用週一～週五推估（之後更新日曆會自動修正）
+#   - 完全沒有日曆（沒本地檔又下載失敗）：從 HISTORY_START 起全部以平日推估，last_known 為 None
+# =========================================================
+
+CSV_PATH = "../data/FinMind/TW/StockInfo/twStockTradingDate.csv"
+API_URL = "https://api.finmindtrade.com/api/v4/data"
+REFRESH_TTL_SEC = 12 * 60 * 60   # 距上次檢查超過 12 小時才上網確認
+PROJECT_DAYS = 400               # 已知日曆之後，以平日推估的天數
+HISTORY_START = "1990-01-01"     # 沒有日曆時，平日推估的起點
+
+DateLike = datetime | pd.Timestamp | str
+
+
+def _day(d: DateLike) -> np.datetime64:
+    return np.datetime64(pd.Timestamp(d).normalize().date(), "D")
+
+
+class TradingCalendar:
+    """
+    以排序好的 datetime64[D] 陣列為核心：
+    - is_trading_day：dict 查表 O(1)
+    - 前後交易日 / 序號 / 區間天數：searchsorted O(log n)
+    序號（ordinal）= 該日是第幾個交易日（0 起算），相鄰交易日序號差 1
+    """
+
+    def __init__(self, dates):
+        known = np.unique(
+            pd.to_datetime(pd.Series(dates)).dt.normalize().to_numpy(dtype="datetime64[D]")
+        )
+        self.last_known = known[-1] if len(known) else None
+
+        # 已知日曆之後的日子用平日推估；沒有已知日曆時整段歷史都用平日推估
+        if self.last_known is not None:
+            projected = pd.bdate_range(
+                pd.Timestamp(self.last_known) + pd.Timedelta(days=1), periods=int(PROJECT_DAYS * 5 / 7)
+            )
+        else:
+            projected = pd.bdate_range(
+                HISTORY_START, pd.Timestamp(_day(datetime.today())) + pd.Timedelta(days=PROJECT_DAYS)
+            )
+        projected = projected.to_numpy(dtype="datetime64[D]")
+
+        self._days = np.concatenate([known, projected])
+        self._index = {d: i for i, d in enumerate(self._days.astype("int64"))}
+
+    def __len__(self) -> int:
+        return len(self._days)
+
+    def is_trading_day(self, d: DateLike) -> bool:
+        return int(_day(d).astype("int64")) in self._index
+
+    def ordinal(self, d: DateLike) -> int:
+        """d 的交易日序號；d 不是交易日時回傳前一個交易日的序號（d 早於日曆起點時為 -1）"""
+        return int(np.searchsorted(self._days, _day(d), side="right")) - 1
+
+    def day_at(self, ordinal: int) -> pd.Timestamp:
+        return pd.Timestamp(self._days[ordinal])
+
+    def next_trading_day(self, d: DateLike, n: int = 1) -> pd.Timestamp:
+        """d 之後的第 n 個交易日（不含 d 本身）"""
+        i = int(np.searchsorted(self._days, _day(d), side="right")) + n - 1
+        return pd.Timestamp(self._days[i])
+
+    def prev_trading_day(self, d: DateLike, n: int = 1) -> pd.Timestamp:
+        """d 之前的第 n 個交易日（不含 d 本身）"""
+        i = int(np.searchsorted(self._days, _day(d), side="left")) - n
+        if i < 0:
+            raise IndexError("早於交易日曆起點")
+        return pd.Timestamp(self._days[i])
+
+    def count_between(self, start: DateLike, end: DateLike) -> int:
+        """[start, end] 內的交易日數（含頭含尾）"""
+        lo = np.searchsorted(self._days, _day(start), side="left")
+        hi = np.searchsorted(self._days, _day(end), side="right")
+        return max(int(hi - lo), 0)
+
+    def trading_days(self, start: DateLike, end: DateLike) -> pd.DatetimeIndex:
+        """[start, end] 內的所有交易日"""
+        lo = np.searchsorted(self._days, _day(start), side="left")
+        hi = np.searchsorted(self._days, _day(end), side="right")
+        return pd.DatetimeIndex(self._days[lo:hi])
+
+    def trim(self, start: DateLike, end: DateLike) -> tuple[pd.Timestamp, pd.Timestamp] | None:
+        """[start, end] 內的第一個與最後一個交易日；整段都不是交易日時回傳 None"""
+        lo = int(np.searchsorted(self._days, _day(start), side="left"))
+        hi = int(np.searchsorted(self._days, _day(end), side="right"))
+        if lo >= hi:
+            return None
+        return pd.Timestamp(self._days[lo]), pd.Timestamp(self._days[hi - 1])
+
+    def group_runs(self, days) -> list[tuple[pd.Timestamp, pd.Timestamp]]:
+        """
+        把交易日依序號相鄰分成連續批次（中間只隔著週末 / 假日的算同一批）
+        例：週五、下週一、下週三 → [(週五, 下週一), (下週三, 下週三)]
+        """
+        if len(days) == 0:
+            return []
+        arr = np.unique(pd.to_datetime(pd.Series(days)).to_numpy(dtype="datetime64[D]"))
+        ords = np.searchsorted(self._days, arr, side="right") - 1
+        breaks = np.flatnonzero(np.diff(ords) != 1) + 1
+        return [
+            (pd.Timestamp(g[0]), pd.Timestamp(g[-1]))
+            for g in np.split(arr, breaks)
+        ]
+
+    def to_frame(self) -> pd.DataFrame:
+        """已知交易日（不含推估），欄位與 FinMind TaiwanStockTradingDate 相同"""
+        n = self.ordinal(self.last_known) + 1 if self.last_known is not None else 0
+        return pd.DataFrame({"date": pd.DatetimeIndex(self._days[:n]).strftime("%Y-%m-%d")})
+
+
+# =========================================================
+# 載入 / 更新
+# =========================================================
+_calendar: TradingCalendar | None = None
+_lock = threading.Lock()
+
+
+def _read_local() -> pd.DataFrame | None:
+    if not os.path.exists(CSV_PATH):
+        return None
+    try:
+        return pd.read_csv(CSV_PATH)
+    except Exception as e:
+        print(f"⚠ 交易日曆讀取失敗：{e}")
+        return None
+
+
+def _need_check(df_local: pd.DataFrame | None) -> bool:
+    """沒有本地檔，或距上次檢查已超過 TTL 且本地最後一天早於今天"""
+    if df_local is None or df_local.empty:
+        return True
+    if time.time() - os.path.getmtime(CSV_PATH) < REFRESH_TTL_SEC:
+        return False
+    last_local = pd.to_datetime(df_local["date"].max()).normalize()
+    return last_local < pd.Timestamp.today().normalize()
+
+
+def _download() -> pd.DataFrame | None:
+    try:
+        payload = http_client.get_json(API_URL, params={"dataset": "TaiwanStockTradingDate"}, timeout=15)
+        data = pd.DataFrame(payload["data"])
+        return data if not data.empty else None
+    except Exception as e:
+        print(f"⚠ 交易日曆更新失敗，沿用本地快取：{e}")
+        return None
+
+
+def _load(force_check: bool = False) -> TradingCalendar:
+    if http_client.get_base_url() is not None:
+        # 指向替身伺服器（壓測）：用它給的日曆，但不寫回本地檔，避免假日曆覆蓋正式資料
+        data = _download()
+        return TradingCalendar(data["date"] if data is not None else [])
+
+    df_local = _read_local()
+
+    if force_check or _need_check(df_local):
+        data = _download()
+        if data is not None:
+            last_online = pd.to_datetime(data["date"].max()).date()
+            last_local = pd.to_datetime(df_local["date"].max()).date() if df_local is not None else None
+            if last_local is None or last_local < last_online:
+                os.makedirs(os.path.dirname(CSV_PATH), exist_ok=True)
+                data.to_csv(CSV_PATH, index=False, encoding="utf-8-sig")
+                print(f"✅ 已更新交易日曆至 {last_online}")
+                df_local = data
+            elif os.path.exists(CSV_PATH):
+                # 內容沒變，只更新 mtime 當作「上次檢查時間」
+                os.utime(CSV_PATH)
+
+    if df_local is None:
+        # 完全沒有日曆：全部以平日推估
+        return TradingCalendar([])
+    return TradingCalendar(df_local["date"])
+
+
+def get_calendar(refresh: bool = False) -> TradingCalendar:
+    """取得本 process 共用的交易日曆；refresh=True 時強制上網檢查並重新載入"""
+    global _calendar
+    with _lock:
+        if _calendar is None or refresh:
+            _calendar = _load(force_check=refresh)
+        return _calendar
@@ -1,5 +1,4 @@
 import sys, os
-sys.path.append(os.path.dirname(__file__))
 sys.stdout.reconfigure(encoding='utf-8')
 
 import pandas as pd
@@ -8,7 +7,7 @@ from pathlib import Path
 import re
 from common.constants import Panel
 from common.constants import Iloc
-import db
+from common import db, dates
 
 def nowTime():
     """取得當前時間 (yyyy/mm/dd hh:mm:ss)"""
@@ -299,19 +298,8 @@ def findout_observerRTdata(output_path: str) -> bool:
     return False
     
 def roc_to_unix(roc_date: str) -> int:
-    year = None 
-    month = None 
-    day = None    
-    seperators = ["/", ".", "-"]
-    for seperator in seperators:
-        if seperator in roc_date:  
-            year, month, day = map(int, roc_date.split(seperator))
-    if year is None:
-        return None
-        
-    gregorian_year = year + 1911 # 民國 → 西元（加 1911 年）
-    dt = datetime(gregorian_year, month, day)
-    return int(dt.timestamp())
+    """民國日期 → 台北時間當天 00:00 的 unix ts（實作在 common.dates，有快取、不受本機時區影響）"""
+    return dates.roc_to_unix(roc_date)
 
 def get_api_info(apiName: str) -> pd.DataFrame:
     sql = f"SELECT *, src_link || api_path AS url FROM data_source"
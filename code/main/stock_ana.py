@@ -90,55 +90,33 @@ def stock_price_involve_days(
         if df_out is None or df_out.empty:
             return
 
-        insert_sql = """
-        INSERT OR IGNORE INTO stock_price_involve_report
-        (
-          report,
-          stock_id,
-          price,
-          lastDt_close_distance,
-          "lcd%",
-          involve_days,
-          involve_date,
-          date,
-          date_distance,
-          price_type,
-          volume,
-          vol_weight,
-          vol_wei_pr,
-          vol_adj,
-          vol_wei_adj,
-          vol_wei_pr_adj,
-          remark
+        cols = [
+            "report",
+            "stock_id",
+            "price",
+            "lastDt_close_distance",
+            "lcd%",
+            "involve_days",
+            "involve_date",
+            "date",
+            "date_distance",
+            "price_type",
+            "volume",
+            "vol_weight",
+            "vol_wei_pr",
+            "vol_adj",
+            "vol_wei_adj",
+            "vol_wei_pr_adj",
+            "remark",
+        ]
+
+        # 已存在的列不覆寫（等同 INSERT OR IGNORE）
+        db.bulk_upsert(
+            "stock_price_involve_report",
+            df_out[cols],
+            key_cols=["report", "stock_id", "date", "price_type", "price"],
+            update_cols=[],
         )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """
-
-        params = list(
-            df_out[
-                [
-                    "report",
-                    "stock_id",
-                    "price",
-                    "lastDt_close_distance",
-                    "lcd%",
-                    "involve_days",
-                    "involve_date",
-                    "date",
-                    "date_distance",
-                    "price_type",
-                    "volume",
-                    "vol_weight",
-                    "vol_wei_pr",
-                    "vol_adj",
-                    "vol_wei_adj",
-                    "vol_wei_pr_adj",
-                    "remark",
-                ]
-            ].itertuples(index=False, name=None)
-        )
-
-        db.execute_sql(insert_sql, params)
 
     # ---- 1) 先用 API 把價量資料補到 req_e ----
     need_trading_days = max(period_days, max_ma)
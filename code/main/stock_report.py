@@ -43,203 +43,44 @@ today = datetime.now()
 # ======================================
 def taiex_daily_report(months: int = 4, eDt: datetime = today):
     sDt = eDt - relativedelta(months=months)
-    return export("TAIEX", sDt, eDt)
+    return export("TAIEX", sDt, eDt, incremental=True)
 
-def export(stock_id, sDt, eDt):
-    # 這個還是給三大法人用，保留 +1 天（你原本寫法保留）
-    end_next = (eDt + relativedelta(days=1)).strftime("%Y-%m-%d")
-
-    # === 1) 抓日資料：finMind.get_tw_stock_daily_price（走本地快取） ===
-    df = finMind.get_tw_stock_daily_price(stock_id=stock_id, start_date=sDt, end_date=eDt)
-    if df is None or df.empty:
-        print(f"[警告] {stock_id} {sDt} ~ {eDt} 無日資料，export 回傳空 DataFrame")
-        return pd.DataFrame()
-
-    df["date"] = pd.to_datetime(df["date"])
-    df = df[df["date"] <= pd.to_datetime(eDt.date())].reset_index(drop=True)
-
-    # === 2) 合併法人 ===
-    df3 = finMind.get_tw_institutional_total(start_date=sDt, end_date=eDt)
-    if df3 is None or df3.empty:
-        df3 = pd.DataFrame(columns=["buy", "sell", "date", "name"])
-
-    df3 = df3.copy()
-    df3["net"] = pd.to_numeric(df3.get("buy"), errors="coerce") - pd.to_numeric(df3.get("sell"), errors="coerce")
-    df3["date"] = pd.to_datetime(df3["date"])
-    df3 = df3.pivot(index="date", columns="name", values="net").reset_index()
-    df = df.merge(df3, on="date", how="left")
-
-    # === 3) 合併融資：改用 finMind.get_tw_margin_total ===
-    # 目標：最後 df 要有「今日餘額」（仟元）給你後面融資計算
-    df["今日餘額"] = np.nan
-    df_m = finMind.get_tw_margin_total(start_date=sDt, end_date=eDt)
-
-    if df_m is not None and not df_m.empty:
-        df_m = df_m.copy()
-        col_date = "date" if "date" in df_m.columns else ("日期" if "日期" in df_m.columns else None)
-        col_name = "name" if "name" in df_m.columns else ("項目" if "項目" in df_m.columns else None)
-        col_today = "TodayBalance" if "TodayBalance" in df_m.columns else ("今日餘額" if "今日餘額" in df_m.columns else None)
-
-        if col_date and col_name and col_today:
-            df_m[col_date] = pd.to_datetime(df_m[col_date])
-            df_m[col_name] = df_m[col_name].astype(str)
-
-            # 你舊邏輯是「融資金額(仟元)」=> FinMind total 用 MarginPurchaseMoney 的 TodayBalance（常見是元）
-            cand = df_m[df_m[col_name] == "MarginPurchaseMoney"].copy()
-            if not cand.empty:
-                cand[col_today] = pd.to_numeric(cand[col_today], errors="coerce")
-
-                # 單位 heuristic：太大（>1e9）視為「元」=> /1000 轉「仟元」
-                med = cand[col_today].median(skipna=True)
-                if pd.notna(med) and med > 1e9:
-                    cand["今日餘額"] = cand[col_today] / 1000.0
-                else:
-                    cand["今日餘額"] = cand[col_today]
-
-                cand = cand[[col_date, "今日餘額"]].rename(columns={col_date: "date"})
-                df = df.merge(cand, on="date", how="left", suffixes=("", "_m"))
-
-                # 若 merge 出現重名保險
-                if "今日餘額_m" in df.columns:
-                    df["今日餘額"] = df["今日餘額"].combine_first(df["今日餘額_m"])
-                    df.drop(columns=["今日餘額_m"], inplace=True, errors="ignore")
-
-    # === 4) 基本欄位 rename ===
-    df.rename(
-        columns={
-            "date": "日期",
-            "open": "開盤價",
-            "close": "收盤價",
-            "max": "最高價",
-            "min": "最低價",
-            "Trading_Volume": "成交量",
-            "Trading_money": "總成交金額_億",
-        },
-        inplace=True,
-    )
-
-    # === 5) 價量衍生 ===
-    df["收盤_開盤"] = df["收盤價"] - df["開盤價"]
-    df["日振幅"] = df["最高價"] - df["最低價"]
-    df["漲跌幅_pct"] = (df["收盤價"] - df["收盤價"].shift(1)) / df["收盤價"].shift(1)
-    df["量增率_pct"] = (df["成交量"] - df["成交量"].shift(1)) / df["成交量"].shift(1)
-
-    df["昨收_tmp"] = df["收盤價"].shift(1)
-    base_range = df["日振幅"] / df["昨收_tmp"]
-    sign = np.sign(df["收盤價"] - df["昨收_tmp"])
-    df["日振幅_昨收_pct"] = base_range * sign
-    df.drop(columns=["昨收_tmp"], inplace=True)
-
-    # === 6) 均量 / 均價 / 扣抵 / 乖離 ===
-    df["成交量"] = pd.to_numeric(df["成交量"], errors="coerce")
-    for n in [5, 10, 20, 60]:
-        df[f"{n}日均量"] = df["成交量"].rolling(n).mean()
-        df[f"{n}日平均"] = df["收盤價"].rolling(n).mean()
-        df[f"{n}日上升幅度"] = df[f"{n}日平均"] - df[f"{n}日平均"].shift(1)
-        df[f"{n}日扣抵值"] = df["收盤價"].shift(n - 1)
-        df[f"{n}日扣抵影響_pct"] = (df["收盤價"] - df[f"{n}日扣抵值"]) / df["收盤價"]
-        df[f"{n}日乖離"] = (df["收盤價"] - df[f"{n}日平均"]) / df[f"{n}日平均"]
-
-    # === 7) 金額換算 / 法人（這段修掉你的 scalar/fillna 問題） ===
-    df["總成交金額_億"] = pd.to_numeric(df["總成交金額_億"], errors="coerce") / 1e8
-
-    # 外資 / 投信：欄名通常穩定，但仍做防呆
-    foreign = pd.to_numeric(SRU._scol(df, "Foreign_Investor", default=np.nan), errors="coerce")
-    itrust  = pd.to_numeric(SRU._scol(df, "Investment_Trust", default=np.nan), errors="coerce")
-
-    # 自營商：FinMind 可能只有 Dealer，也可能拆 Dealer_self/Dealer_Hedging/Foreign_Dealer_Self
-    dealer = SRU._sum_cols_like(df, keywords=["Dealer"], default=0.0)
-
-    # 法人總買超：若有 total 用 total，沒有就用 外資+投信+自營商
-    total_net = pd.to_numeric(SRU._scol(df, "total", default=np.nan), errors="coerce")
-    if total_net.isna().all():
-        total_net = pd.to_numeric(foreign, errors="coerce").fillna(0.0) + pd.to_numeric(itrust, errors="coerce").fillna(0.0) + pd.to_numeric(dealer, errors="coerce").fillna(0.0)
-
-    df["法人總買超_億"] = total_net / 1e8
-    df["買超_外資_億"] = foreign / 1e8
-    df["買超_投信_億"] = itrust / 1e8
-    df["買超_自營商_億"] = pd.to_numeric(dealer, errors="coerce").fillna(0.0) / 1e8
-
-    # 融資（今日餘額是「仟元」）
-    df["融資餘額_億"] = pd.to_numeric(SRU._scol(df, "今日餘額", default=np.nan), errors="coerce") * 1000 / 1e8
-    df["買超_融資_億"] = df["融資餘額_億"] - df["融資餘額_億"].shift(1)
-
-    # 資金走向
-    df["資金走向"] = df["收盤_開盤"] - (df["法人總買超_億"] + df["買超_融資_億"])
-
-    def _fund_flow_label(x):
-        if pd.isna(x):
-            return None
-        if x > 0:
-            return "偏重大型股"
-        if x < 0:
-            return "偏重小型股"
-        return None
-
-    df["資金走向判讀"] = df["資金走向"].apply(_fund_flow_label)
-
-    # === 8) 實體 / 上影 / 下影 ===
-    rng = (df["最高價"] - df["最低價"]).replace(0, np.nan)
-    df["實體_pct"] = (df["收盤價"] - df["開盤價"]).abs() / rng
-    df["上影_pct"] = (df["最高價"] - np.maximum(df["開盤價"], df["收盤價"])) / rng
-    df["下影_pct"] = (np.minimum(df["開盤價"], df["收盤價"]) - df["最低價"]) / rng
-
-    df["K線型態"] = df.apply(SRU.classify_k_type, axis=1)
-
-    # === 10) 跳空缺口 ===
-    df["昨高"] = df["最高價"].shift(1)
-    df["昨低"] = df["最低價"].shift(1)
-
-    conds = [df["最低價"] > df["昨高"], df["最高價"] < df["昨低"]]
-    choices = ["上跳空", "下跳空"]
-    df["跳空狀態"] = np.select(conds, choices, default="無跳空")
-
-    is_red = df["收盤價"] > df["開盤價"]
-    df["今上緣"] = np.where(is_red, df["收盤價"], df["開盤價"])
-    df["今下緣"] = np.where(is_red, df["開盤價"], df["收盤價"])
-
-    df["昨上緣"] = df["今上緣"].shift(1)
-    df["昨下緣"] = df["今下緣"].shift(1)
-
-    df["跳空缺口"] = np.select(
-        [df["跳空狀態"] == "上跳空", df["跳空狀態"] == "下跳空"],
-        [df["今下緣"] - df["昨上緣"], df["今上緣"] - df["昨下緣"]],
-        default=None,
-    )
-
-    # === 11) 已刪除：均線排列 / 趨勢 7 欄位 ===
-
-    # === 12) 量能最大量（5/10/20/60） ===
-    vols = df["成交量"].to_numpy()
-    dates = pd.to_datetime(df["日期"]).dt.strftime("%Y-%m-%d").to_numpy()
-
-    for n in [5, 10, 20, 60]:
-        vmax_list, vdate_list = [], []
-        for i in range(len(df)):
-            if i + 1 < n:
-                vmax_list.append(np.nan)
-                vdate_list.append(np.nan)
-                continue
-            window_vol = vols[i + 1 - n : i + 1]
-            window_date = dates[i + 1 - n : i + 1]
-            idx = int(np.argmax(window_vol))
-            vmax_list.append(window_vol[idx])
-            vdate_list.append(window_date[idx])
-
-        df[f"{n}日最大量"] = vmax_list
-        df[f"{n}日最大量_日期"] = vdate_list
-
-    # === 13) upsert 到 DB + 後續輸出 ===
-    SRU.upsert(df, stock_id)
-    SRU.update_is_complete()
-
-    sql = f"""
+def export(stock_id, sDt, eDt, incremental: bool = False):
+    """
+    產生 stock_id 在 [sDt, eDt] 的日報，寫入 stock_report_daily 後從 DB 讀回輸出
+    incremental=True：DB 已有這檔的報告時，只算最後一筆之後（或尾端尚未完整）的日期，
+      rolling 需要的前 60 根價量直接從 DB 讀；DB 沒有 / sDt 早於 DB 第一筆時自動改為整段計算
+    """
+    start = SRU._incremental_start(stock_id, sDt, eDt) if incremental else None
+
+    if start is not None:
+        # === 增量：只算新日期 ===
+        df = SRU.compute_incremental(finMind, stock_id, start, eDt)
+        since = start
+        print(f"[增量] {stock_id} 從 {start.date()} 起重算 {len(df)} 筆")
+    else:
+        # === 1) 價格 + 法人 + 融資（走本地快取） ===
+        base = SRU._build_base_df(finMind, stock_id, sDt, eDt)
+        if base is None or base.empty:
+            print(f"[警告] {stock_id} {sDt} ~ {eDt} 無日資料，export 回傳空 DataFrame")
+            return pd.DataFrame()
+
+        # === 2) 衍生欄位（與 repair_stock_report_fields 同一套邏輯） ===
+        df = SRU._compute_derived(base)
+        since = sDt
+
+    # === 3) upsert 到 DB（只檢查這次寫入範圍的 is_complete） ===
+    if not df.empty:
+        SRU.upsert(df, stock_id)
+        SRU.update_is_complete(stock_id=stock_id, since=since)
+
+    sql = """
         SELECT * FROM stock_report_daily
-        WHERE 股票代號 = '{stock_id}'
-          AND 日期 BETWEEN '{sDt.strftime("%Y-%m-%d")}' AND '{eDt.strftime("%Y-%m-%d")}'
+        WHERE 股票代號 = ?
+          AND 日期 BETWEEN ? AND ?
         ORDER BY 日期
     """
-    output = db.query_to_df(sql)
+    output = db.query_to_df(sql, (stock_id, sDt.strftime("%Y-%m-%d"), eDt.strftime("%Y-%m-%d")))
     output.drop(columns=["id", "is_complete", "updated_at"], inplace=True, errors="ignore")
 
     # =========================================================
@@ -268,6 +109,34 @@ def export(stock_id, sDt, eDt):
     output.to_csv("stock_report.csv", index=False, encoding="utf-8-sig")
     return output
 
+def export_many(stock_ids: list[str], sDt, eDt):
+    """
+    多檔一次產生 [sDt, eDt] 的日報：
+    - 價格一次查回所有股票，法人 / 融資（市場層級）只抓一次併入
+    - 衍生欄位整張表一起算（shift / rolling 以股票分組，不會跨股票）
+    - 一次 upsert 寫入，回傳寫入的報告列（依 股票代號, 日期 排序）
+    """
+    stock_ids = list(dict.fromkeys(stock_ids))
+    if not stock_ids:
+        return pd.DataFrame()
+
+    # === 1) 價格（全部股票）+ 法人 + 融資 ===
+    base = SRU._build_base_df(finMind, stock_ids, sDt, eDt)
+    if base is None or base.empty:
+        print(f"[警告] {len(stock_ids)} 檔 {sDt} ~ {eDt} 無日資料，export_many 回傳空 DataFrame")
+        return pd.DataFrame()
+
+    # === 2) 衍生欄位 ===
+    df = SRU._compute_derived(base)
+
+    # === 3) 一次 upsert ===
+    SRU.upsert(df)
+    SRU.update_is_complete(stock_id=stock_ids, since=sDt)
+
+    df["股票代號"] = df["stock_id"].astype(str)
+    out_cols = [c for c in SRU.COLUMNS if c in df.columns and c != "is_complete"]
+    return df[out_cols].sort_values(["股票代號", "日期"], kind="stable").reset_index(drop=True)
+
 # =========================================================
 # 4) 主函式：修補指定期間、指定欄位，可選 force_renew
 # =========================================================
@@ -280,25 +149,32 @@ def repair_stock_report_fields(
     fields,
     force_renew=False,
     table="stock_report_daily",
-    lookback_days=180,
+    lookback_days=None,
 ):
     """
     fields: list[str] 要修補的欄位
     force_renew:
       - False: 只補缺值
       - True : 期間內全部重算覆蓋
+    lookback_days: None → 依欄位相依圖算出最少要往前抓幾根 K 棒（例如只修 買超_融資_億 只需前 1 根，也不抓價量以外用不到的資料）
     """
+    for c in fields:
+        if c not in SRU.FIELD_REGISTRY or c not in SRU.COLUMNS:
+            raise ValueError(f"[repair] FIELD_REGISTRY 沒有定義欄位：{c}")
 
     # 1) 決定 lookback 起點（rolling 欄需要）
-    sDt_lb = (sDt - relativedelta(days=lookback_days))
+    if lookback_days is None:
+        sDt_lb = SRU.lookback_start(sDt, SRU.required_lookback(fields))
+    else:
+        sDt_lb = (sDt - relativedelta(days=lookback_days))
     # 注意：這裡用 sDt_lb ~ eDt 抓資料來算，最後只回寫 sDt~eDt
-    base = SRU._build_base_df(finMind, stock_id, sDt_lb, eDt)
+    base = SRU._build_base_df(finMind, stock_id, sDt_lb, eDt, market=SRU.needs_market(fields))
     if base is None or base.empty:
         print(f"[repair] base empty: {stock_id} {sDt_lb}~{eDt}")
         return 0
 
-    # 2) 算出完整衍生欄（跟 export 同一套邏輯）
-    calc = SRU._compute_derived(base)
+    # 2) 只算要修補的欄位 + 其相依欄位（跟 export 同一套邏輯）
+    calc = SRU._compute_derived(base, fields)
 
     # 3) 只保留要回寫期間
     calc["日期"] = pd.to_datetime(calc["日期"])
@@ -338,9 +214,6 @@ def repair_stock_report_fields(
         need_any = False
 
         for c in fields:
-            if c not in SRU.FIELD_REGISTRY:
-                raise ValueError(f"[repair] FIELD_REGISTRY 沒有定義欄位：{c}")
-
             newv = r.get(f"{c}_new", None)
             oldv = r.get(f"{c}_old", None)
 
@@ -378,7 +251,7 @@ def repair_stock_report_fields(
 
 # python -m main.stock_report
 if __name__ == "__main__":
-    df = export("TAIEX", datetime(2000,1,1), datetime.now())
+    df = export("TAIEX", datetime(2000,1,1), datetime.now(), incremental=True)
     # df = taiex_daily_report(60)
     print(df.tail(5))
     print("DONE")
@@ -1,7 +1,6 @@
 import numpy as np
 import pandas as pd
-from dateutil.relativedelta import relativedelta
-from common import db
+from common import db, kernels, trading_calendar
 
 # =========================================================
 # 0) 小工具：判斷缺值、Series 取欄位、防呆加總
@@ -49,32 +48,22 @@ def _sum_cols_like(df_, keywords, default=0.0):
 # 1) 重新抓「可重建報告所需」的原始資料（價格/法人/融資）
 #    - 這樣你就算 DB 某些原始欄也缺，仍可重建衍生欄
 # =========================================================
-def _build_base_df(finMind, stock_id, sDt, eDt):
+def _market_base(finMind, sDt, eDt):
     """
-    回傳以「date(datetime)」為主鍵、包含價格 + 法人(淨額) + 融資(今日餘額) 的 base df
+    市場層級欄位（所有股票共用）：以 date 為鍵，三大法人淨額（每個 name 一欄）+ 融資今日餘額（仟元）
     """
-    df = finMind.get_tw_stock_daily_price(stock_id=stock_id, start_date=sDt, end_date=eDt)
-    if df is None or df.empty:
-        return pd.DataFrame()
-
-    df = df.copy()
-    df["date"] = pd.to_datetime(df["date"])
-    df = df[df["date"] <= pd.to_datetime(eDt.date())].reset_index(drop=True)
+    market = pd.DataFrame({"date": pd.Series(dtype="datetime64[ns]")})
 
     # 法人
     df3 = finMind.get_tw_institutional_total(start_date=sDt, end_date=eDt)
-    if df3 is None or df3.empty:
-        df3 = pd.DataFrame(columns=["buy", "sell", "date", "name"])
-    else:
+    if df3 is not None and not df3.empty:
         df3 = df3.copy()
         df3["net"] = pd.to_numeric(df3.get("buy"), errors="coerce") - pd.to_numeric(df3.get("sell"), errors="coerce")
         df3["date"] = pd.to_datetime(df3["date"])
         df3 = df3.pivot(index="date", columns="name", values="net").reset_index()
-
-    df = df.merge(df3, on="date", how="left")
+        market = market.merge(df3, on="date", how="outer")
 
     # 融資：今日餘額（仟元）
-    df["今日餘額"] = np.nan
     df_m = finMind.get_tw_margin_total(start_date=sDt, end_date=eDt)
 
     if df_m is not None and not df_m.empty:
@@ -99,230 +88,355 @@ def _build_base_df(finMind, stock_id, sDt, eDt):
                     cand["今日餘額"] = cand[col_today]
 
                 cand = cand[[col_date, "今日餘額"]].rename(columns={col_date: "date"})
-                df = df.merge(cand, on="date", how="left", suffixes=("", "_m"))
-                if "今日餘額_m" in df.columns:
-                    df["今日餘額"] = df["今日餘額"].combine_first(df["今日餘額_m"])
-                    df.drop(columns=["今日餘額_m"], inplace=True, errors="ignore")
+                market = market.merge(cand, on="date", how="outer")
 
-    return df
+    if "今日餘額" not in market.columns:
+        market["今日餘額"] = np.nan
+    return market
+
+
+def _build_base_df(finMind, stock_id, sDt, eDt, market=True):
+    """
+    回傳以「date(datetime)」為主鍵、包含價格 + 法人(淨額) + 融資(今日餘額) 的 base df
+    stock_id 可以是 list：價格一次查回所有股票（依 stock_id, date 排序），市場欄位只抓一次再併入
+    market=False：只要價量（要算的欄位都用不到法人 / 融資時）
+    """
+    df = finMind.get_tw_stock_daily_price(stock_id=stock_id, start_date=sDt, end_date=eDt)
+    if df is None or df.empty:
+        return pd.DataFrame()
+
+    df = df.copy()
+    df["date"] = pd.to_datetime(df["date"])
+    df = df[df["date"] <= pd.to_datetime(eDt.date())].reset_index(drop=True)
+
+    if not market:
+        return df
+    return df.merge(_market_base(finMind, sDt, eDt), on="date", how="left")
 
 
 # =========================================================
-# 2) 計算器（registry）：每個欄位一個 function（回寫到 df）
-#    - 你可以持續擴充：新增 key + 對應計算函式即可
+# 1.5) 增量計算：只算 DB 尾端之後的日期
+#    - 所有衍生欄都只往回看，最長 60 根（60 日均 / 扣抵 / 最大量 / 上升幅度）
+#      → 新的一天只需要前面 TAIL_BARS 根的價量，不用重算整段歷史
+#    - 尾端狀態直接從 stock_report_daily 讀回（價量欄位），不重抓
 # =========================================================
-def _classify_k_type_row(r):
-    body = r.get("實體_pct", np.nan)
-    upper = r.get("上影_pct", np.nan)
-    lower = r.get("下影_pct", np.nan)
-    open_p = r.get("開盤價", np.nan)
-    close_p = r.get("收盤價", np.nan)
+TAIL_BARS = 60
+
+# 報告欄名 → _build_base_df 的欄名
+_TAIL_TO_BASE = {
+    "日期": "date",
+    "開盤價": "open",
+    "收盤價": "close",
+    "最高價": "max",
+    "最低價": "min",
+    "成交量": "Trading_Volume",
+}
 
-    if pd.isna(body) or pd.isna(upper) or pd.isna(lower):
+
+def _incremental_start(stock_id, sDt, eDt):
+    """
+    回傳增量模式要重算的第一天；None 表示只能整段重算（DB 還沒有 / 要求的起點早於 DB 第一筆）
+    - DB 最後 TAIL_BARS 筆內有 is_complete = 0（當時法人 / 融資還沒出來）→ 從最早那筆重算
+    - 都完整 → 從最後一筆的隔天開始
+    """
+    e = pd.Timestamp(eDt).strftime("%Y-%m-%d")
+    row = db.query_to_df(
+        f'SELECT MIN("日期") AS first_d FROM "{TABLE}" WHERE "股票代號" = ? AND "日期" <= ?',
+        (stock_id, e),
+    )
+    if row.empty or row.iloc[0]["first_d"] is None:
         return None
-    if pd.isna(open_p) or pd.isna(close_p):
+    span = trading_calendar.get_calendar().trim(sDt, eDt)
+    if span is None or pd.Timestamp(row.iloc[0]["first_d"]) > span[0]:
         return None
 
-    if abs(close_p - open_p) < 1e-6 or body < 0.05:
-        return "⬜ 十字線"
-
-    is_red = close_p > open_p
-    color = "🟥" if is_red else "🟩"
-
-    if lower > 0.5 and body < 0.3:
-        return f"{color} 錘子線"
-    if upper > 0.5 and body < 0.3:
-        return f"{color} 流星線"
-    if body > 0.6:
-        return f"{color} 長紅K" if is_red else f"{color} 長黑K"
-    return f"{color} 中實體K"
+    tail = db.query_to_df(
+        f"""
+        SELECT "日期", is_complete FROM "{TABLE}"
+        WHERE "股票代號" = ? AND "日期" <= ?
+        ORDER BY "日期" DESC LIMIT ?
+        """,
+        (stock_id, e, TAIL_BARS),
+    )
+    incomplete = tail.loc[tail["is_complete"] != 1, "日期"]
+    if not incomplete.empty:
+        return pd.Timestamp(incomplete.min())
+    return pd.Timestamp(tail["日期"].max()) + pd.Timedelta(days=1)
+
+
+def _load_tail(stock_id, before, bars=TAIL_BARS):
+    """DB 內 before 之前最後 bars 根的價量（欄名同 _build_base_df），日期由舊到新"""
+    cols = ", ".join(f'"{c}"' for c in _TAIL_TO_BASE)
+    tail = db.query_to_df(
+        f"""
+        SELECT {cols} FROM "{TABLE}"
+        WHERE "股票代號" = ? AND "日期" < ?
+        ORDER BY "日期" DESC LIMIT ?
+        """,
+        (stock_id, pd.Timestamp(before).strftime("%Y-%m-%d"), bars),
+    )
+    tail = tail.rename(columns=_TAIL_TO_BASE).iloc[::-1].reset_index(drop=True)
+    tail["date"] = pd.to_datetime(tail["date"])
+    return tail
 
 
-def _compute_derived(df):
+def compute_incremental(finMind, stock_id, start, eDt):
     """
-    只要 df 內有基本價量欄，就能生出大部分衍生欄
+    只算 [start, eDt] 的報告列：
+    - 前一根 K 棒連同法人 / 融資一起重抓，漲跌幅、融資增減這類 shift(1) 欄位才接得上
+    - 更早的 TAIL_BARS 根只需要價量，直接用 DB 內的報告列
     """
-    # rename 成你報告欄名
-    df = df.copy()
-    df.rename(
-        columns={
-            "date": "日期",
-            "open": "開盤價",
-            "close": "收盤價",
-            "max": "最高價",
-            "min": "最低價",
-            "Trading_Volume": "成交量",
-            "Trading_money": "總成交金額_億",
-        },
-        inplace=True,
-    )
+    start = pd.Timestamp(start).normalize()
+    if start > pd.Timestamp(eDt).normalize():
+        return pd.DataFrame()
 
-    # 價量衍生
-    df["收盤_開盤"] = df["收盤價"] - df["開盤價"]
-    df["日振幅"] = df["最高價"] - df["最低價"]
-    df["漲跌幅_pct"] = (df["收盤價"] - df["收盤價"].shift(1)) / df["收盤價"].shift(1)
-    df["量增率_pct"] = (df["成交量"] - df["成交量"].shift(1)) / df["成交量"].shift(1)
-
-    df["昨收_tmp"] = df["收盤價"].shift(1)
-    base_range = df["日振幅"] / df["昨收_tmp"]
-    sign = np.sign(df["收盤價"] - df["昨收_tmp"])
-    df["日振幅_昨收_pct"] = base_range * sign
-    df.drop(columns=["昨收_tmp"], inplace=True)
-
-    # 均量 / 均價 / 扣抵 / 乖離
-    df["成交量"] = pd.to_numeric(df["成交量"], errors="coerce")
-    for n in [5, 10, 20, 60]:
-        df[f"{n}日均量"] = df["成交量"].rolling(n).mean()
-        df[f"{n}日平均"] = df["收盤價"].rolling(n).mean()
-        df[f"{n}日上升幅度"] = df[f"{n}日平均"] - df[f"{n}日平均"].shift(1)
-        df[f"{n}日扣抵值"] = df["收盤價"].shift(n - 1)
-        df[f"{n}日扣抵影響_pct"] = (df["收盤價"] - df[f"{n}日扣抵值"]) / df["收盤價"]
-        df[f"{n}日乖離"] = (df["收盤價"] - df[f"{n}日平均"]) / df[f"{n}日平均"]
-
-    # 金額換算
-    df["總成交金額_億"] = pd.to_numeric(df["總成交金額_億"], errors="coerce") / 1e8
-
-    # 法人（防呆）
-    foreign = pd.to_numeric(_scol(df, "Foreign_Investor", default=np.nan), errors="coerce")
-    itrust  = pd.to_numeric(_scol(df, "Investment_Trust", default=np.nan), errors="coerce")
-    dealer  = _sum_cols_like(df, keywords=["Dealer"], default=0.0)
-
-    total_net = pd.to_numeric(_scol(df, "total", default=np.nan), errors="coerce")
+    tail = _load_tail(stock_id, start)
+    fetch_s = tail["date"].iloc[-1] if not tail.empty else start
+    base = _build_base_df(finMind, stock_id, fetch_s.to_pydatetime(), eDt)
+    if base is None or base.empty:
+        return pd.DataFrame()
+
+    tail = tail[tail["date"] < base["date"].min()].assign(stock_id=stock_id)
+    calc = _compute_derived(pd.concat([tail, base], ignore_index=True))
+    return calc[pd.to_datetime(calc["日期"]) >= start].reset_index(drop=True)
+
+
+# =========================================================
+# 2) 欄位相依圖（registry）：每個欄位宣告 inputs / lookback / calc
+#    - inputs  ：基本欄（BASE_COLUMNS 的報告欄名、MARKET_INPUTS）或其他欄位
+#    - lookback：這個欄位自己往前要看幾根 K 棒（shift(1) → 1、5 日均 → 4）
+#    - calc    ：calc(d, pos) → 整欄結果；pos 見 kernels.group_pos
+#    _compute_derived 只算要求的欄位 + 其相依欄位；required_lookback 沿相依鏈累加回看根數
+#    你之後要補新欄位，只要加一筆 _field(...) 即可
+# =========================================================
+
+# _build_base_df 的欄名 → 報告欄名
+BASE_COLUMNS = {
+    "date": "日期",
+    "open": "開盤價",
+    "close": "收盤價",
+    "max": "最高價",
+    "min": "最低價",
+    "Trading_Volume": "成交量",
+    "Trading_money": "成交金額",
+}
+
+# 市場層級輸入（_market_base 併入）：法人淨額 = 各法人 pivot 欄（Foreign_Investor / Investment_Trust / Dealer* / total）
+MARKET_INPUTS = ("法人淨額", "今日餘額")
+
+
+def _field(inputs, calc, lookback=0):
+    return {"inputs": tuple(inputs), "lookback": lookback, "calc": calc}
+
+
+def _pct_change(s, pos):
+    prev = kernels.shift(s, 1, pos)
+    return (s - prev) / prev
+
+
+def _institutional(d):
+    """法人淨額（防呆）：回傳 (外資, 投信, 自營商, 合計)，單位元"""
+    foreign = pd.to_numeric(_scol(d, "Foreign_Investor", default=np.nan), errors="coerce")
+    itrust  = pd.to_numeric(_scol(d, "Investment_Trust", default=np.nan), errors="coerce")
+    dealer  = pd.to_numeric(_sum_cols_like(d, keywords=["Dealer"], default=0.0), errors="coerce").fillna(0.0)
+
+    total_net = pd.to_numeric(_scol(d, "total", default=np.nan), errors="coerce")
     if total_net.isna().all():
-        total_net = foreign.fillna(0.0) + itrust.fillna(0.0) + pd.to_numeric(dealer, errors="coerce").fillna(0.0)
-
-    df["法人總買超_億"] = total_net / 1e8
-    df["買超_外資_億"] = foreign / 1e8
-    df["買超_投信_億"] = itrust / 1e8
-    df["買超_自營商_億"] = pd.to_numeric(dealer, errors="coerce").fillna(0.0) / 1e8
-
-    # 融資（今日餘額：仟元）
-    df["融資餘額_億"] = pd.to_numeric(_scol(df, "今日餘額", default=np.nan), errors="coerce") * 1000 / 1e8
-    df["買超_融資_億"] = df["融資餘額_億"] - df["融資餘額_億"].shift(1)
-
-    # 資金走向
-    df["資金走向"] = df["收盤_開盤"] - (df["法人總買超_億"] + df["買超_融資_億"])
-    df["資金走向判讀"] = df["資金走向"].apply(lambda x: None if pd.isna(x) else ("偏重大型股" if x > 0 else ("偏重小型股" if x < 0 else None)))
-
-    # 實體 / 上影 / 下影
-    rng = (df["最高價"] - df["最低價"]).replace(0, np.nan)
-    df["實體_pct"] = (df["收盤價"] - df["開盤價"]).abs() / rng
-    df["上影_pct"] = (df["最高價"] - np.maximum(df["開盤價"], df["收盤價"])) / rng
-    df["下影_pct"] = (np.minimum(df["開盤價"], df["收盤價"]) - df["最低價"]) / rng
-
-    # K 線型態
-    df["K線型態"] = df.apply(_classify_k_type_row, axis=1)
-
-    # 跳空缺口
-    df["昨高"] = df["最高價"].shift(1)
-    df["昨低"] = df["最低價"].shift(1)
-    df["跳空狀態"] = np.select(
-        [df["最低價"] > df["昨高"], df["最高價"] < df["昨低"]],
+        total_net = foreign.fillna(0.0) + itrust.fillna(0.0) + dealer
+    return foreign, itrust, dealer, total_net
+
+
+def _k_range(d):
+    return (d["最高價"] - d["最低價"]).replace(0, np.nan)
+
+
+def _gap_state(d, pos):
+    prev_high = kernels.shift(d["最高價"], 1, pos)
+    prev_low = kernels.shift(d["最低價"], 1, pos)
+    return np.select(
+        [d["最低價"] > prev_high, d["最高價"] < prev_low],
         ["上跳空", "下跳空"],
         default="無跳空",
     )
-    is_red = df["收盤價"] > df["開盤價"]
-    df["今上緣"] = np.where(is_red, df["收盤價"], df["開盤價"])
-    df["今下緣"] = np.where(is_red, df["開盤價"], df["收盤價"])
-    df["昨上緣"] = df["今上緣"].shift(1)
-    df["昨下緣"] = df["今下緣"].shift(1)
-
-    df["跳空缺口"] = np.select(
-        [df["跳空狀態"] == "上跳空", df["跳空狀態"] == "下跳空"],
-        [df["今下緣"] - df["昨上緣"], df["今上緣"] - df["昨下緣"]],
-        default=None,
-    )
 
-    # 量能最大量（5/10/20/60）
-    vols = df["成交量"].to_numpy()
-    dates = pd.to_datetime(df["日期"]).dt.strftime("%Y-%m-%d").to_numpy()
-    for n in [5, 10, 20, 60]:
-        vmax_list, vdate_list = [], []
-        for i in range(len(df)):
-            if i + 1 < n:
-                vmax_list.append(np.nan)
-                vdate_list.append(np.nan)
-                continue
-            window_vol = vols[i + 1 - n : i + 1]
-            window_date = dates[i + 1 - n : i + 1]
-            idx = int(np.argmax(window_vol))
-            vmax_list.append(window_vol[idx])
-            vdate_list.append(window_date[idx])
-        df[f"{n}日最大量"] = vmax_list
-        df[f"{n}日最大量_日期"] = vdate_list
 
-    return df
+def _gap_size(d, pos):
+    return np.select(
+        [d["跳空狀態"] == "上跳空", d["跳空狀態"] == "下跳空"],
+        [d["今下緣"] - d["昨上緣"], d["今上緣"] - d["昨下緣"]],
+        default=None,
+    )
 
 
-# 這裡是「欄位 -> 如何從已算好的 df 取值」的 registry
-# 你之後要補新欄位，只要加一個 key 即可
 FIELD_REGISTRY = {
     # 價量
-    "收盤_開盤": lambda d: d["收盤_開盤"],
-    "日振幅": lambda d: d["日振幅"],
-    "漲跌幅_pct": lambda d: d["漲跌幅_pct"],
-    "量增率_pct": lambda d: d["量增率_pct"],
-    "日振幅_昨收_pct": lambda d: d["日振幅_昨收_pct"],
-
-    # 均量/均價/扣抵/乖離/上升幅度
-    "5日均量": lambda d: d["5日均量"],
-    "10日均量": lambda d: d["10日均量"],
-    "20日均量": lambda d: d["20日均量"],
-    "60日均量": lambda d: d["60日均量"],
-
-    "5日平均": lambda d: d["5日平均"],
-    "10日平均": lambda d: d["10日平均"],
-    "20日平均": lambda d: d["20日平均"],
-    "60日平均": lambda d: d["60日平均"],
-
-    "5日上升幅度": lambda d: d["5日上升幅度"],
-    "10日上升幅度": lambda d: d["10日上升幅度"],
-    "20日上升幅度": lambda d: d["20日上升幅度"],
-    "60日上升幅度": lambda d: d["60日上升幅度"],
-
-    "5日扣抵值": lambda d: d["5日扣抵值"],
-    "10日扣抵值": lambda d: d["10日扣抵值"],
-    "20日扣抵值": lambda d: d["20日扣抵值"],
-    "60日扣抵值": lambda d: d["60日扣抵值"],
-
-    "5日扣抵影響_pct": lambda d: d["5日扣抵影響_pct"],
-    "10日扣抵影響_pct": lambda d: d["10日扣抵影響_pct"],
-    "20日扣抵影響_pct": lambda d: d["20日扣抵影響_pct"],
-    "60日扣抵影響_pct": lambda d: d["60日扣抵影響_pct"],
-
-    "5日乖離": lambda d: d["5日乖離"],
-    "10日乖離": lambda d: d["10日乖離"],
-    "20日乖離": lambda d: d["20日乖離"],
-    "60日乖離": lambda d: d["60日乖離"],
+    "收盤_開盤": _field(["收盤價", "開盤價"], lambda d, pos: d["收盤價"] - d["開盤價"]),
+    "日振幅": _field(["最高價", "最低價"], lambda d, pos: d["最高價"] - d["最低價"]),
+    "漲跌幅_pct": _field(["收盤價"], lambda d, pos: _pct_change(d["收盤價"], pos), lookback=1),
+    "量增率_pct": _field(["成交量"], lambda d, pos: _pct_change(d["成交量"], pos), lookback=1),
+    "日振幅_昨收_pct": _field(
+        ["日振幅", "收盤價"],
+        lambda d, pos: (d["日振幅"] / kernels.shift(d["收盤價"], 1, pos))
+        * np.sign(d["收盤價"] - kernels.shift(d["收盤價"], 1, pos)),
+        lookback=1,
+    ),
 
     # 金額/法人/融資/資金走向
-    "總成交金額_億": lambda d: d["總成交金額_億"],
-    "法人總買超_億": lambda d: d["法人總買超_億"],
-    "買超_外資_億": lambda d: d["買超_外資_億"],
-    "買超_投信_億": lambda d: d["買超_投信_億"],
-    "買超_自營商_億": lambda d: d["買超_自營商_億"],
-    "買超_融資_億": lambda d: d["買超_融資_億"],
-    "資金走向": lambda d: d["資金走向"],
-    "資金走向判讀": lambda d: d["資金走向判讀"],
+    "總成交金額_億": _field(["成交金額"], lambda d, pos: pd.to_numeric(d["成交金額"], errors="coerce") / 1e8),
+    "法人總買超_億": _field(["法人淨額"], lambda d, pos: _institutional(d)[3] / 1e8),
+    "買超_外資_億": _field(["法人淨額"], lambda d, pos: _institutional(d)[0] / 1e8),
+    "買超_投信_億": _field(["法人淨額"], lambda d, pos: _institutional(d)[1] / 1e8),
+    "買超_自營商_億": _field(["法人淨額"], lambda d, pos: _institutional(d)[2] / 1e8),
+    # 今日餘額：仟元
+    "融資餘額_億": _field(
+        ["今日餘額"],
+        lambda d, pos: pd.to_numeric(_scol(d, "今日餘額", default=np.nan), errors="coerce") * 1000 / 1e8,
+    ),
+    "買超_融資_億": _field(
+        ["融資餘額_億"], lambda d, pos: d["融資餘額_億"] - kernels.shift(d["融資餘額_億"], 1, pos), lookback=1
+    ),
+    "資金走向": _field(
+        ["收盤_開盤", "法人總買超_億", "買超_融資_億"],
+        lambda d, pos: d["收盤_開盤"] - (d["法人總買超_億"] + d["買超_融資_億"]),
+    ),
+    "資金走向判讀": _field(["資金走向"], lambda d, pos: kernels.sign_label(d["資金走向"], "偏重大型股", "偏重小型股")),
 
     # K 線/跳空/影線
-    "實體_pct": lambda d: d["實體_pct"],
-    "上影_pct": lambda d: d["上影_pct"],
-    "下影_pct": lambda d: d["下影_pct"],
-    "K線型態": lambda d: d["K線型態"],
-    "跳空缺口": lambda d: d["跳空缺口"],
-
-    # 量能最大
-    "5日最大量": lambda d: d["5日最大量"],
-    "5日最大量_日期": lambda d: d["5日最大量_日期"],
-    "10日最大量": lambda d: d["10日最大量"],
-    "10日最大量_日期": lambda d: d["10日最大量_日期"],
-    "20日最大量": lambda d: d["20日最大量"],
-    "20日最大量_日期": lambda d: d["20日最大量_日期"],
-    "60日最大量": lambda d: d["60日最大量"],
-    "60日最大量_日期": lambda d: d["60日最大量_日期"],
+    "實體_pct": _field(
+        ["開盤價", "收盤價", "最高價", "最低價"],
+        lambda d, pos: (d["收盤價"] - d["開盤價"]).abs() / _k_range(d),
+    ),
+    "上影_pct": _field(
+        ["開盤價", "收盤價", "最高價", "最低價"],
+        lambda d, pos: (d["最高價"] - np.maximum(d["開盤價"], d["收盤價"])) / _k_range(d),
+    ),
+    "下影_pct": _field(
+        ["開盤價", "收盤價", "最高價", "最低價"],
+        lambda d, pos: (np.minimum(d["開盤價"], d["收盤價"]) - d["最低價"]) / _k_range(d),
+    ),
+    "K線型態": _field(
+        ["開盤價", "收盤價", "實體_pct", "上影_pct", "下影_pct"],
+        lambda d, pos: kernels.classify_candle(d["開盤價"], d["收盤價"], d["實體_pct"], d["上影_pct"], d["下影_pct"]),
+    ),
+    "跳空狀態": _field(["最高價", "最低價"], _gap_state, lookback=1),
+    "今上緣": _field(["開盤價", "收盤價"], lambda d, pos: np.where(d["收盤價"] > d["開盤價"], d["收盤價"], d["開盤價"])),
+    "今下緣": _field(["開盤價", "收盤價"], lambda d, pos: np.where(d["收盤價"] > d["開盤價"], d["開盤價"], d["收盤價"])),
+    "昨上緣": _field(["今上緣"], lambda d, pos: kernels.shift(d["今上緣"], 1, pos), lookback=1),
+    "昨下緣": _field(["今下緣"], lambda d, pos: kernels.shift(d["今下緣"], 1, pos), lookback=1),
+    "跳空缺口": _field(["跳空狀態", "今上緣", "今下緣", "昨上緣", "昨下緣"], _gap_size),
+
+    "日期字串": _field(["日期"], lambda d, pos: pd.to_datetime(d["日期"]).dt.strftime("%Y-%m-%d").to_numpy()),
 }
 
+# 均量/均價/扣抵/乖離/上升幅度/量能最大（5/10/20/60）
+for _n in [5, 10, 20, 60]:
+    FIELD_REGISTRY.update({
+        f"{_n}日均量": _field(["成交量"], lambda d, pos, n=_n: kernels.rolling_mean(d["成交量"], n, pos), lookback=_n - 1),
+        f"{_n}日平均": _field(["收盤價"], lambda d, pos, n=_n: kernels.rolling_mean(d["收盤價"], n, pos), lookback=_n - 1),
+        f"{_n}日上升幅度": _field(
+            [f"{_n}日平均"],
+            lambda d, pos, n=_n: d[f"{n}日平均"] - kernels.shift(d[f"{n}日平均"], 1, pos),
+            lookback=1,
+        ),
+        f"{_n}日扣抵值": _field(["收盤價"], lambda d, pos, n=_n: kernels.shift(d["收盤價"], n - 1, pos), lookback=_n - 1),
+        f"{_n}日扣抵影響_pct": _field(
+            ["收盤價", f"{_n}日扣抵值"],
+            lambda d, pos, n=_n: (d["收盤價"] - d[f"{n}日扣抵值"]) / d["收盤價"],
+        ),
+        f"{_n}日乖離": _field(
+            ["收盤價", f"{_n}日平均"],
+            lambda d, pos, n=_n: (d["收盤價"] - d[f"{n}日平均"]) / d[f"{n}日平均"],
+        ),
+        f"{_n}日最大量": _field(
+            ["成交量"], lambda d, pos, n=_n: kernels.rolling_argmax(d["成交量"], n, pos)[0], lookback=_n - 1
+        ),
+        f"{_n}日最大量_日期": _field(
+            ["成交量", "日期字串"],
+            lambda d, pos, n=_n: kernels.take_at(d["日期字串"], kernels.rolling_argmax(d["成交量"], n, pos)[1]),
+            lookback=_n - 1,
+        ),
+    })
+del _n
+
+
+def resolve_fields(fields) -> list[str]:
+    """要求的欄位 + 遞移相依欄位，依計算順序（相依在前）；未定義的欄位 raise ValueError"""
+    order, seen = [], set()
+
+    def visit(name, path):
+        if name in seen or name in BASE_COLUMNS.values() or name in MARKET_INPUTS:
+            return
+        if name not in FIELD_REGISTRY:
+            raise ValueError(f"FIELD_REGISTRY 沒有定義欄位：{name}")
+        if name in path:
+            raise ValueError(f"欄位相依有循環：{' → '.join(path + [name])}")
+        for dep in FIELD_REGISTRY[name]["inputs"]:
+            visit(dep, path + [name])
+        seen.add(name)
+        order.append(name)
+
+    for f in fields:
+        visit(f, [])
+    return order
+
+
+def required_lookback(fields) -> int:
+    """算出 fields 在第一列就正確，需要往前多抓的 K 棒數（沿相依鏈累加，取最長的一條）"""
+    memo = {}
+
+    def bars(name):
+        if name not in FIELD_REGISTRY:
+            return 0
+        if name not in memo:
+            spec = FIELD_REGISTRY[name]
+            memo[name] = spec["lookback"] + max((bars(dep) for dep in spec["inputs"]), default=0)
+        return memo[name]
+
+    resolve_fields(fields)
+    return max((bars(f) for f in fields), default=0)
+
+
+def needs_market(fields) -> bool:
+    """fields（含相依）是否用到法人 / 融資"""
+    return any(
+        dep in MARKET_INPUTS
+        for name in resolve_fields(fields)
+        for dep in FIELD_REGISTRY[name]["inputs"]
+    )
+
+
+# 停牌等缺資料的日子會讓實際 K 棒少於交易日數，往前多抓幾天備用
+LOOKBACK_PAD = 10
+
+
+def lookback_start(sDt, bars):
+    """sDt 之前第 bars（+ LOOKBACK_PAD）個交易日；早於交易日曆起點時回傳日曆第一天"""
+    cal = trading_calendar.get_calendar()
+    try:
+        return cal.prev_trading_day(sDt, bars + LOOKBACK_PAD).to_pydatetime()
+    except IndexError:
+        return cal.day_at(0).to_pydatetime()
+
+
+def _compute_derived(df, fields=None):
+    """
+    由 base df 算出 fields（預設全部欄位）及其相依欄位，其他欄位不算
+    df 可以含多檔股票（有 stock_id 欄）：shift / rolling 都不會跨股票
+    """
+    df = df.copy()
+    if "stock_id" in df.columns:
+        df = df.sort_values(["stock_id", "date"], kind="stable").reset_index(drop=True)
+    pos = kernels.group_pos(df)
+
+    # rename 成你報告欄名
+    df.rename(columns=BASE_COLUMNS, inplace=True)
+    if "成交量" in df.columns:
+        df["成交量"] = pd.to_numeric(df["成交量"], errors="coerce")
+
+    for name in resolve_fields(list(FIELD_REGISTRY) if fields is None else fields):
+        df[name] = FIELD_REGISTRY[name]["calc"](df, pos)
+    return df
+
 
 # =========================================================
 # 3) DB 回寫：只更新指定欄位（不動其他欄）
@@ -419,7 +533,11 @@ def classify_k_type(r):
         return f"{color} 長紅K" if is_red else f"{color} 長黑K"
     return f"{color} 中實體K"
 
-def update_is_complete():
+def update_is_complete(stock_id=None, since=None):
+    """
+    依「是否有任何欄位為 NULL」重設 is_complete
+    stock_id / since：只檢查該股票（可為 list）、該日期（含）之後的列；都不給則整張表
+    """
     table = "stock_report_daily"
 
     # 預設不檢查這些欄位
@@ -449,17 +567,29 @@ def update_is_complete():
     # 建立 NULL 判斷條件
     null_conditions = " OR ".join([f"{q(c)} IS NULL" for c in check_cols])
 
+    # 範圍
+    where, params = [], []
+    if stock_id is not None:
+        ids = [stock_id] if isinstance(stock_id, str) else list(stock_id)
+        where.append(f"{q('股票代號')} IN ({', '.join('?' * len(ids))})")
+        params += ids
+    if since is not None:
+        where.append(f"{q('日期')} >= ?")
+        params.append(pd.Timestamp(since).strftime("%Y-%m-%d"))
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+
     # 最終 SQL
     sql = f"""
     UPDATE {q(table)}
     SET {q("is_complete")} = CASE
         WHEN {null_conditions} THEN 0
         ELSE 1
-    END;
+    END
+    {where_sql};
     """
 
     print("執行 SQL 中 ...")
-    ok = db.execute_sql(sql)
+    ok = db.execute_sql(sql, tuple(params))
     print("更新完成 ✔" if ok else "更新失敗 ❌")
     
 
@@ -486,13 +616,14 @@ COLUMNS = [
 # ======================================
 # UPSERT
 # ======================================
-def upsert(df: pd.DataFrame, stock_id: str):
+def upsert(df: pd.DataFrame, stock_id: str | None = None):
+    """stock_id=None 時依 df 的 stock_id 欄（多檔一次寫入）"""
     if df.empty:
         print("⚠ df empty, skip")
         return
 
     df = df.copy()
-    df["股票代號"] = stock_id
+    df["股票代號"] = stock_id if stock_id is not None else df["stock_id"].astype(str)
     df["日期"] = pd.to_datetime(df["日期"]).dt.strftime("%Y-%m-%d")
 
     # --- is_complete：先預設 0, 後面覆寫 ---
@@ -514,24 +645,15 @@ def upsert(df: pd.DataFrame, stock_id: str):
     # 如果有任何數值欄位是 NaN，就視為未完成
     df["is_complete"] = (~df[numeric_cols].isna().any(axis=1)).astype(int)
 
-    # SQL 組起來
-    col_sql = ",".join([f'"{c}"' for c in COLUMNS])
-    ph = ",".join(["?"] * len(COLUMNS))
-    update_sql = ",".join([f'"{c}" = excluded."{c}"' for c in COLUMNS if c not in ("日期", "股票代號")])
-
-    sql = f"""
-    INSERT INTO "{TABLE}" ({col_sql})
-    VALUES ({ph})
-    ON CONFLICT("股票代號","日期") DO UPDATE SET
-        {update_sql}
-    WHERE "{TABLE}".is_complete = 0
-       OR excluded.is_complete = 1;
-    """
-
-    rows = list(df.itertuples(index=False, name=None))
-
-    ok = db.execute_sql(sql, rows)
-    if ok:
-        print(f"✔ DB 寫入成功: {len(df)} rows, stock={stock_id}")
+    # 只有「DB 內尚未完整」或「新資料已完整」才覆寫
+    res = db.bulk_upsert(
+        TABLE,
+        df,
+        key_cols=["股票代號", "日期"],
+        update_where=f'"{TABLE}".is_complete = 0 OR excluded.is_complete = 1',
+    )
+    if res is not None:
+        stock_desc = stock_id if stock_id is not None else f"{df['股票代號'].nunique()} 檔"
+        print(f"✔ DB 寫入成功: {len(df)} rows (新增 {res['inserted']} / 更新 {res['updated']}), stock={stock_desc}")
     else:
         print("❌ DB 寫入失敗（請看上方 SQLite Error）")
\ No newline at end of file
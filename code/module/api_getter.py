@@ -1,7 +1,6 @@
-import requests
 import pandas as pd
-from datetime import datetime, timedelta
-from common import tools
+from datetime import datetime
+from common import tools, trading_calendar, http_client, scheduler
 
 twseUrl = "https://www.twse.com.tw/rwd/zh"
 common_params = "response=json"
@@ -33,7 +32,7 @@ def fetch_notice(type: str, sDt: datetime, eDt: datetime):
             }
             
             # 發送 GET 請求
-            response = requests.get(apiUrl, params=apiParams)
+            response = http_client.get(apiUrl, params=apiParams)
             
         case "tpex":
             apiName = '上櫃公布注意有價證券資訊'    
@@ -53,7 +52,7 @@ def fetch_notice(type: str, sDt: datetime, eDt: datetime):
             }
 
             # 發送 POST 請求
-            response = requests.post(apiUrl, data=apiParams)
+            response = http_client.post(apiUrl, data=apiParams)
         
         case _:
             return None
@@ -101,7 +100,7 @@ def fetch_punish(type: str, sDt: datetime, eDt: datetime):
                 "response" : "json"
             }
             # 發送 GET 請求
-            response = requests.get(apiUrl, params=apiParams)
+            response = http_client.get(apiUrl, params=apiParams)
             
         case "tpex":
             apiName = '上櫃處置有價證券資訊'
@@ -124,7 +123,7 @@ def fetch_punish(type: str, sDt: datetime, eDt: datetime):
             }
 
             # 發送 POST 請求
-            response = requests.post(apiUrl, data=apiParams)
+            response = http_client.post(apiUrl, data=apiParams)
             
         case _:
             return None
@@ -148,8 +147,7 @@ def fetch_margin_trading(date: datetime | None = None):
     apiParams = f"date={date_str}&selectType=MS&{common_params}"
     apiUrl = f"{twseUrl}/{apiEndpoint}?{apiParams}"
 
-    res = requests.get(apiUrl)
-    data = res.json()
+    data = http_client.get_json(apiUrl)
 
     # tables[0] 才有資料
     tables = data.get("tables", [])
@@ -164,21 +162,30 @@ def fetch_margin_trading(date: datetime | None = None):
 def fetch_margin_trading_range(sDt: datetime, eDt: datetime):
     if sDt > eDt:
         return None
-    
-    data = []    
-    current = sDt
-    while current <= eDt:
-        currentData = fetch_margin_trading(current)
-        if currentData is None:
-            current += timedelta(days=1)
-            continue
-        
-        rows = currentData["data"]
-        for aRow in rows:
-            aRow.insert(0, current.strftime("%Y%m%d"))
-        data = data + rows
-        current += timedelta(days=1)
-        
+
+    # 只打交易日（週末 / 國定假日不送 request）
+    # 平行抓取，結果依日期順序合併
+    # 某天抓取失敗：先把其他天抓完並逐一印出，最後再丟出第一個錯誤（與逐日抓取時一樣不回傳殘缺結果）
+    data = []
+    first_err = None
+    days = trading_calendar.get_calendar().trading_days(sDt, eDt)
+    with scheduler.FetchScheduler(max_workers=3) as sch:
+        for day, currentData, err in sch.imap(fetch_margin_trading, days):
+            if err is not None:
+                print(f"❌ {day.strftime('%Y-%m-%d')} 抓取失敗：{err}")
+                first_err = first_err or err
+                continue
+            if currentData is None:
+                continue
+
+            rows = currentData["data"]
+            for aRow in rows:
+                aRow.insert(0, day.strftime("%Y%m%d"))
+            data = data + rows
+
+    if first_err is not None:
+        raise first_err
+
     result = {
         "fields": ['日期', '項目', '買進', '賣出', '現金_券_償還', '前日餘額', '今日餘額'],
         "data": data
@@ -3,6 +3,8 @@ from datetime import datetime
 from dateutil.relativedelta import relativedelta
 from common import db
 from common import tools
+from common import parsing
+from common import dates
 import api_getter
 
 # ======== 注意股公告 ========
@@ -58,8 +60,8 @@ def get_time_range_data(apiName: str, sDt: datetime, eDt: datetime):
     else:        
         sql = f"SELECT min({time_col}), MAX({time_col}) FROM {table}"
         df_check = db.query_to_df(sql)
-        minDt = datetime.fromtimestamp(tools.roc_to_unix(df_check[f"min({time_col})"].iloc[0]))
-        maxDt = datetime.fromtimestamp(tools.roc_to_unix(df_check[f"MAX({time_col})"].iloc[0]))
+        minDt = dates.roc_to_datetime(df_check[f"min({time_col})"].iloc[0])
+        maxDt = dates.roc_to_datetime(df_check[f"MAX({time_col})"].iloc[0])
     print([minDt, maxDt])
     # sys.exit()
 
@@ -152,181 +154,107 @@ def writein_db(apiName, data) -> bool:
     except:
         return False
     
-    values = []
-    insert_cols = []
+    # 欄位：{DB 欄名: (data 內的位置, 型別)}，型別見 common.parsing.KINDS
+    # required：這些欄位解析失敗 / 空值時整列不寫入（本益比等可為空）
+    # skip_col：內容為空（或 skip_values）的列是「當日無資料」，直接略過、不算錯誤
+    skip_col = None
+    skip_values = [""]
     match apiName:
         case "上市公布注意有價證券資訊":
-            insert_cols = [
-                "證券代號", 
-                "證券名稱",
-                "累計次數",
-                "注意交易資訊", 
-                "日期",
-                "日期_ts",
-                "收盤價",
-                "本益比"
-            ]
-            for r in data:
-                try:
-                    # 嘗試轉換本益比
-                    try:
-                        pe_value = float(r[7])
-                    except (ValueError, TypeError):
-                        pe_value = None
-                        
-                    values.append((
-                        r[1].strip(),
-                        r[2].strip(),
-                        int(r[3]),
-                        r[4].strip(),
-                        r[5].strip(),
-                        tools.roc_to_unix(r[5].strip()),
-                        float(r[6]),
-                        pe_value
-                    ))
-                except:
-                    print("Data write in error：", r)
-                    continue
+            columns = {
+                "證券代號": (1, "text"),
+                "證券名稱": (2, "text"),
+                "累計次數": (3, "int"),
+                "注意交易資訊": (4, "text"),
+                "日期": (5, "raw"),
+                "日期_ts": (5, "roc_ts"),
+                "收盤價": (6, "float"),
+                "本益比": (7, "float"),
+            }
+            required = ["累計次數", "日期_ts", "收盤價"]
 
         case "上市公布處置有價證券":
-            insert_cols = [
-                "公布日期",
-                "公布日期_ts",
-                "證券代號",
-                "證券名稱",
-                "累計",
-                "處置條件",
-                "處置起迄時間",
-                "處置措施",
-                "處置內容",
-                "備註"
-            ]
-            for r in data:
-                try:
-                    # 跳過當日未處置的資料
-                    notice_content = r[7].strip()
-                    if notice_content == "":
-                        continue
-                        
-                    # 準備所有資料
-                    values.append((
-                        r[1].strip(), # 公布日期
-                        tools.roc_to_unix(r[1].strip()), # 公布日期_ts
-                        r[2].strip(), # 證券代號
-                        r[3].strip(), # 證券名稱
-                        int(r[4]), # 累計"
-                        r[5].strip(), # 處置條件
-                        r[6].strip(), # 處置起迄時間
-                        r[7].strip(), # 處置措施
-                        r[8].strip(), # 處置內容
-                        r[9].strip(), # 備註
-                    ))
-                except:
-                    print("Data write in error：", r)
-                    continue
-            
+            columns = {
+                "公布日期": (1, "raw"),
+                "公布日期_ts": (1, "roc_ts"),
+                "證券代號": (2, "text"),
+                "證券名稱": (3, "text"),
+                "累計": (4, "int"),
+                "處置條件": (5, "text"),
+                "處置起迄時間": (6, "text"),
+                "處置措施": (7, "text"),
+                "處置內容": (8, "text"),
+                "備註": (9, "text"),
+            }
+            required = ["公布日期_ts", "累計"]
+            skip_col = "處置措施"
+
         case "上櫃公布注意有價證券資訊":
-            insert_cols = [
-                "證券代號",
-                "證券名稱",
-                "累計",
-                "注意交易資訊",
-                "公告日期",
-                "公告日期_ts",
-                "收盤價",
-                "本益比",
-                "link"
-            ]
-            for r in data:
-                try:
-                    # 跳過當日未處置的資料
-                    notice_content = r[7].strip()
-                    if notice_content == "":
-                        continue
-                    
-                    # 嘗試轉換本益比
-                    try:
-                        pe_value = float(r[8])
-                    except (ValueError, TypeError):
-                        pe_value = None
-                    
-                    # 準備所有資料
-                    values.append((
-                        r[1].strip(), # 證券代號
-                        r[2].strip(), # 證券名稱
-                        int(r[3]), # 累計
-                        r[4].strip(), # 注意交易資訊"
-                        r[5].strip(), # 公告日期
-                        tools.roc_to_unix(r[5].strip()), # 公告日期_ts
-                        float(r[6]), # 收盤價
-                        pe_value, # 本益比
-                        r[8].strip(), # link
-                    ))
-                except:
-                    print("Data write in error：", r)
-                    continue
-            
+            columns = {
+                "證券代號": (1, "text"),
+                "證券名稱": (2, "text"),
+                "累計": (3, "int"),
+                "注意交易資訊": (4, "text"),
+                "公告日期": (5, "raw"),
+                "公告日期_ts": (5, "roc_ts"),
+                "收盤價": (6, "float"),
+                "本益比": (8, "float"),
+                "link": (8, "text"),
+            }
+            required = ["累計", "公告日期_ts", "收盤價"]
+            skip_col = (7, "text")
+
         case "上櫃處置有價證券資訊":
-            insert_cols = [
-                "公布日期", 
-                "公布日期_ts",
-                "證券代號", 
-                "證券名稱", 
-                "累計", 
-                "處置起訖時間", 
-                "處置原因", 
-                "處置內容", 
-                "收盤價", 
-                "本益比", 
-                "memo"
-            ]
-            for r in data:
-                try:
-                    # 跳過當日未處置的資料
-                    punish_content = r[7].strip()
-                    if punish_content == "" or punish_content == "本日無處置資料":
-                        continue
-                    
-                    # 嘗試轉換本益比
-                    try:
-                        pe_value = float(r[9])
-                    except (ValueError, TypeError):
-                        pe_value = None
-                                                
-                    # 準備所有資料
-                    values.append((
-                        r[1].strip(), # 公布日期
-                        tools.roc_to_unix(r[1].strip()), # 公布日期_ts
-                        r[2].strip(), # 證券代號
-                        r[3].strip(), # 證券名稱
-                        int(r[4]), # 累計
-                        r[5].strip(), # 處置起訖時間
-                        r[6].strip(), # 處置原因
-                        r[7].strip(), # 處置內容
-                        float(r[8]), # 收盤價
-                        pe_value, # 本益比
-                        r[10].strip() # memo
-                    ))
-                except:
-                    print("Data write in error：", r)
-                    continue
-        
+            columns = {
+                "公布日期": (1, "raw"),
+                "公布日期_ts": (1, "roc_ts"),
+                "證券代號": (2, "text"),
+                "證券名稱": (3, "text"),
+                "累計": (4, "int"),
+                "處置起訖時間": (5, "text"),
+                "處置原因": (6, "text"),
+                "處置內容": (7, "text"),
+                "收盤價": (8, "float"),
+                "本益比": (9, "float"),
+                "memo": (10, "text"),
+            }
+            required = ["公布日期_ts", "累計", "收盤價"]
+            skip_col = "處置內容"
+            skip_values = ["", "本日無處置資料"]
+
         case _:
             return False
-    
-    if len(insert_cols) == 0:
-        return False
-    
-    if len(values) == 0:
+
+    if not data:
         return True
-    
+
+    # 整欄一次解析（數千～數萬列的歷史公告也只要幾毫秒）
+    if isinstance(skip_col, tuple):
+        # 略過判斷用的欄位不寫入 DB
+        columns = {"_skip": skip_col, **columns}
+        skip_col = "_skip"
+    df, bad = parsing.parse_table(data, columns, required=required)
+
+    if skip_col is not None:
+        # 當日無資料的列不算解析失敗
+        bad &= ~df[skip_col].isin(skip_values).to_numpy()
+        keep = ~bad & ~df[skip_col].isin(skip_values).to_numpy()
+    else:
+        keep = ~bad
+    parsing.report_errors(f"{apiName} 寫入", data, bad)
+
+    df = df[keep].drop(columns=["_skip"], errors="ignore")
+    if df.empty:
+        return True
+
+    insert_cols = list(df.columns)
     sql = f"""
     INSERT OR REPLACE INTO {table} 
         ({",".join(insert_cols)})
     VALUES 
         ({", ".join(["?"] * len(insert_cols))})
     """
-    return db.execute_sql(sql, values)
+    return db.execute_sql(sql, parsing.to_records(df))
 
 
 # ======== 範例測試 ========
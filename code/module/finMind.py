@@ -3,9 +3,9 @@ import os
 from datetime import datetime
 import pandas as pd
 from FinMind.data import DataLoader 
-from common import utils,db
-import requests
+from common import utils, db, coverage, trading_calendar, negative_cache, http_client, scheduler, pipeline
 from typing import Union, Iterable
+from module import twse
 
 sys.stdout.reconfigure(encoding='utf-8')
 
@@ -24,6 +24,20 @@ os.makedirs(storageDir_twStockInfo, exist_ok=True)
 def getDataLoader() -> DataLoader:
     return api
 
+def _fm_fetch(dataset: str, **params) -> pd.DataFrame:
+    """
+    直接打 FinMind v4 /data（走 http_client：共用 Session、速率限制、重試、raw_cache）
+    params 例如 data_id / start_date / end_date；回傳 data 欄位轉成的 DataFrame
+    """
+    payload = http_client.get_json(
+        apiUrl,
+        params={"dataset": dataset, **params},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    if payload.get("status") != 200:
+        raise RuntimeError(f"FinMind {dataset} 失敗：{payload.get('msg')}")
+    return pd.DataFrame(payload.get("data", []))
+
 # 撈取台股清單
 def twStockInfo(includeCateHistory:bool=False) -> pd.DataFrame:
     df = None
@@ -90,9 +104,56 @@ def twStockInfoNoEmerging(includeCateHistory:bool=False) -> pd.DataFrame:
         df_twse_filtered.to_csv(output_file, index=False, encoding='utf-8-sig')
     return df_twse_filtered
 
+# 上櫃 / 興櫃代號：只讀已存在的 stock_info.csv（不為此打 API）；沒有清單時回傳空集合
+def _otc_ids() -> set[str]:
+    output_file = f"{storageDir_twStockInfo}/stock_info.csv"
+    if not os.path.exists(output_file):
+        return set()
+    df = pd.read_csv(output_file, usecols=["stock_id", "type"], dtype=str)
+    return set(df.loc[df["type"].isin(["tpex", "emerging"]), "stock_id"].str.strip())
+
 storageDir_twMarketValue =  f"{storageDir}/TW/MarketValue"
 os.makedirs(storageDir_twMarketValue, exist_ok=True)
 
+FETCH_WORKERS = 4  # FinMind 平行抓取的 worker 數（實際速率由 http_client 向 scheduler 的 token bucket 控制）
+
+def _yearly_jobs(stockList: list, sDt: datetime, eDt: datetime, fileFmt: str) -> list[tuple]:
+    """逐檔逐年切成工作 (stock_id, 年度, 起日, 迄日, 檔名)；已存在的檔案直接略過"""
+    jobs = []
+    for stock_id in stockList:
+        for cur_year in range(sDt.year, eDt.year + 1):
+            # 確保不超過指定的 sDt / eDt
+            year_start = max(datetime(cur_year, 1, 1), sDt)
+            year_end = min(datetime(cur_year, 12, 31), eDt)
+            outputFile = fileFmt.format(year=cur_year, stock_id=stock_id)
+            if os.path.exists(outputFile):
+                utils.ptMsg("☑️ 檔案已存在：", outputFile)
+                continue
+            jobs.append((stock_id, cur_year, year_start, year_end, outputFile))
+    return jobs
+
+def _run_yearly_jobs(jobs: list[tuple], dataset: str) -> None:
+    """平行抓取 FinMind dataset（逐檔逐年），結果依工作順序寫檔；單一工作失敗不中斷"""
+    def run(job):
+        stock_id, cur_year, year_start, year_end, _ = job
+        utils.ptMsg(f"➡️ 撈取 {stock_id} 年度：{cur_year}（{year_start.date()} ~ {year_end.date()}）")
+        return _fm_fetch(
+            dataset,
+            data_id=stock_id,
+            start_date=year_start.strftime("%Y-%m-%d"),
+            end_date=year_end.strftime("%Y-%m-%d"),
+        )
+
+    with scheduler.FetchScheduler(max_workers=FETCH_WORKERS) as sch:
+        for job, df, err in sch.imap(run, jobs):
+            stock_id, cur_year, _, _, outputFile = job
+            if err is not None:
+                utils.ptMsg(f"❌ {stock_id} 年度 {cur_year} 抓取失敗，錯誤訊息：{err}")
+                continue
+            os.makedirs(os.path.dirname(outputFile), exist_ok=True)
+            df.to_csv(outputFile, index=False, encoding='utf-8-sig')
+            utils.ptMsg("✅ 檔案存取成功：", outputFile)
+
 # 撈取各股票市值資料（逐年存檔）
 def runTwMarketValue(stockList: list, sDt: datetime, eDt: datetime) -> bool:
     result = True
@@ -100,39 +161,8 @@ def runTwMarketValue(stockList: list, sDt: datetime, eDt: datetime) -> bool:
         utils.ptMsg("📢 即將撈取[市值歷史]資料（逐年存檔），股票清單長度：", len(stockList))
 
         outputDir = storageDir_twMarketValue
-
-        for stock_id in stockList:
-            cur_year = sDt.year
-            end_year = eDt.year
-
-            while cur_year <= end_year:
-                year_start = datetime(cur_year, 1, 1)
-                year_end = datetime(cur_year, 12, 31)
-                if year_end > eDt:
-                    year_end = eDt
-                if year_start < sDt:
-                    year_start = sDt
-
-                outputFile = f"{outputDir}/{cur_year}/TWMV-{stock_id}.csv"
-
-                if os.path.exists(outputFile):
-                    utils.ptMsg("☑️ 檔案已存在：", outputFile)
-                else:
-                    os.makedirs(os.path.dirname(outputFile), exist_ok=True)
-                    try:
-                        utils.ptMsg(f"➡️ 撈取 {stock_id} 年度：{cur_year}（{year_start.date()} ~ {year_end.date()}）")
-                        dfMV = api.taiwan_stock_market_value(
-                            stock_id=stock_id,
-                            start_date=year_start.strftime("%Y-%m-%d"),
-                            end_date=year_end.strftime("%Y-%m-%d")
-                        )
-                        dfMV.to_csv(outputFile, index=False, encoding='utf-8-sig')
-                        utils.ptMsg("✅ 檔案存取成功：", outputFile)
-                    except Exception as e:
-                        utils.ptMsg(f"❌ {stock_id} 年度 {cur_year} 抓取失敗，錯誤訊息：{e}")
-                        # 不 raise，繼續跑其他年度
-
-                cur_year += 1
+        jobs = _yearly_jobs(stockList, sDt, eDt, f"{outputDir}/{{year}}/TWMV-{{stock_id}}.csv")
+        _run_yearly_jobs(jobs, "TaiwanStockMarketValue")
 
         utils.ptMsg("📢 [市值歷史]資料撈取結束。")
 
@@ -153,38 +183,8 @@ def runTwStockDailyPriceAdj(stockList: list, sDt: datetime, eDt: datetime, outpu
         if outputDir is None:
             outputDir = storageDir_twDailyPriceAdj
 
-        for stock_id in stockList:
-            cur_year = sDt.year
-            end_year = eDt.year
-
-            while cur_year <= end_year:
-                year_start = datetime(cur_year, 1, 1)
-                year_end = datetime(cur_year, 12, 31)
-                # 確保不超過指定的 eDt
-                if year_end > eDt:
-                    year_end = eDt
-                if year_start < sDt:
-                    year_start = sDt
-
-                outputFile = f'{outputDir}/{cur_year}/TWDPadj-{stock_id}.csv'
-
-                if os.path.exists(outputFile):
-                    utils.ptMsg("☑️ 檔案已存在：", outputFile)
-                else:
-                    os.makedirs(os.path.dirname(outputFile), exist_ok=True)
-                    try:
-                        utils.ptMsg(f"➡️ 撈取 {stock_id} 年度：{cur_year}（{year_start.date()} ~ {year_end.date()}）")
-                        dfSDA = api.taiwan_stock_daily_adj(
-                            stock_id=stock_id,
-                            start_date=year_start.strftime("%Y-%m-%d"),
-                            end_date=year_end.strftime("%Y-%m-%d")
-                        )
-                        dfSDA.to_csv(outputFile, index=False, encoding='utf-8-sig')
-                        utils.ptMsg("✅ 檔案存取成功：", outputFile)
-                    except Exception as e:
-                        utils.ptMsg(f"❌ {stock_id} 年度 {cur_year} 抓取失敗，錯誤訊息：{e}")
-                        # 不要 raise，繼續抓下一年
-                cur_year += 1
+        jobs = _yearly_jobs(stockList, sDt, eDt, f"{outputDir}/{{year}}/TWDPadj-{{stock_id}}.csv")
+        _run_yearly_jobs(jobs, "TaiwanStockPriceAdj")
 
     except Exception as e:
         utils.ptMsg(f"發生重大錯誤：{e}")
@@ -200,42 +200,18 @@ def getWeightIdxDailyPriceAdj(sDt: datetime, eDt: datetime) -> bool:
 
 # 取得台股的所有交易日期
 def getTwStockTradingDates() -> pd.DataFrame:
-    fileDir = "../data/FinMind/TW/StockInfo/twStockTradingDate.csv"
-    url = "https://api.finmindtrade.com/api/v4/data"
-    parameter = {"dataset": "TaiwanStockTradingDate"}
-
-    # ===== 檔案存在，先讀舊資料 =====
-    if os.path.exists(fileDir):
-        df_local = pd.read_csv(fileDir)
-        try:
-            last_local_date = pd.to_datetime(df_local["date"].max()).date()
-        except Exception:
-            last_local_date = None
-    else:
-        df_local = None
-        last_local_date = None
-
-    # ===== 檢查是否需要更新 =====
-    resp = requests.get(url, params=parameter)
-    data = pd.DataFrame(resp.json()["data"])
-    last_online_date = pd.to_datetime(data["date"].max()).date()
-
-    need_update = (
-        last_local_date is None or
-        last_local_date < last_online_date
-    )
-
-    if need_update:
-        # 更新資料並覆蓋
-        os.makedirs(os.path.dirname(fileDir), exist_ok=True)
-        data.to_csv(fileDir, index=False, encoding="utf-8-sig")
-        print(f"✅ 已更新交易日曆至 {last_online_date}")
-        return data
-    else:
-        print(f"📁 使用本地快取：已是最新至 {last_local_date}")
-        return df_local
+    """
+    台股交易日（欄位 date）
+    由 common.trading_calendar 統一管理：每個 process 只載入一次，依上次檢查時間決定是否上網更新
+    """
+    return trading_calendar.get_calendar().to_frame()
 
 # 取得台股日資料
+PRICE_COLS = [
+    "date", "stock_id", "Trading_Volume", "Trading_money",
+    "open", "max", "min", "close", "spread", "Trading_turnover",
+]
+
 def get_tw_stock_daily_price(
     stock_id: Union[str, list[str]],
     start_date: datetime,
@@ -258,114 +234,95 @@ def get_tw_stock_daily_price(
     def dstr(t: pd.Timestamp) -> str:
         return t.strftime("%Y-%m-%d")
 
-    all_dfs: list[pd.DataFrame] = []
-
-    # === 1) 逐檔處理 ===
-    for sid in stock_ids:
-
-        # --- 查 span ---
-        span_row = db.query_to_df(
-            """
-            SELECT start_date, end_date
-            FROM date_span
-            WHERE target_table = ? AND idx_key = ?
-            """,
-            (target_table, sid),
-        )
-
-        mem_s = pd.Timestamp(span_row.loc[0, "start_date"]).normalize() if not span_row.empty else None
-        mem_e = pd.Timestamp(span_row.loc[0, "end_date"]).normalize() if not span_row.empty else None
-
-        fetch_ranges: list[tuple[pd.Timestamp, pd.Timestamp]] = []
-
-        if mem_s is None:
-            fetch_ranges = [(req_s, req_e)]
-            new_s, new_e = req_s, req_e
+    cal = trading_calendar.get_calendar()
+
+    # === 1) 規劃：逐檔查覆蓋缺口（只回傳還沒抓過的區段） ===
+    def plan_jobs() -> list[tuple]:
+        jobs = []  # (sid, 缺口起, 缺口迄, 實際查詢起, 實際查詢迄)
+        for sid in stock_ids:
+            for fs, fe in coverage.missing_ranges(target_table, sid, req_s, req_e):
+                # 缺口內沒有交易日（週末 / 連假）就不打 API，直接標記
+                trimmed = cal.trim(fs, fe)
+                if trimmed is None:
+                    coverage.mark_no_trading(cal, target_table, sid, fs, fe)
+                    continue
+                ts, te = trimmed
+
+                # 之前查過確定沒資料（停牌 / 尚未上市）就不再打 API
+                if negative_cache.is_negative(target_table, sid, ts, te):
+                    continue
+                jobs.append((sid, fs, fe, ts, te))
+        return jobs
+
+    jobs = plan_jobs()
+
+    # 股票多、天數少時，改用 TWSE 全市場日報（一天一個 request 涵蓋所有上市股票）
+    # 抓完重新規劃：剩下的只有上櫃股票或抓失敗的日子，再逐檔補
+    gaps: dict[str, list] = {}
+    for sid, _, _, ts, te in jobs:
+        gaps.setdefault(sid, []).append((ts, te))
+    days = twse.plan_tw_stock_daily(gaps, otc_ids=_otc_ids())
+    if days:
+        twse.ingest_tw_stock_daily(days)
+        jobs = plan_jobs()
+
+    # === 2) 抓取 → 解析 → 寫入 管線：每段寫入成功才標記覆蓋，失敗的段落下次會再補 ===
+    # 速率限制 / 被擋減速都在 http_client 內處理
+    def fetch(job):
+        sid, _, _, ts, te = job
+        return _fm_fetch("TaiwanStockPrice", data_id=sid, start_date=dstr(ts), end_date=dstr(te))
+
+    def parse(job, df_api):
+        if df_api is None or df_api.empty:
+            return pd.DataFrame(columns=PRICE_COLS)
+        df_api = df_api.copy()
+        df_api["date"] = pd.to_datetime(df_api["date"]).dt.strftime("%Y-%m-%d")
+        df_api["stock_id"] = df_api["stock_id"].astype(str)
+        return df_api[PRICE_COLS]
+
+    def write(job, df_api):
+        sid, fs, fe, ts, te = job
+        last_date = None
+        if df_api.empty:
+            negative_cache.record(target_table, sid, ts, te, negative_cache.NO_DATA)
         else:
-            new_s = min(mem_s, req_s)
-            new_e = max(mem_e, req_e)
-
-            if req_s >= mem_s and req_e <= mem_e:
-                fetch_ranges = []
-            elif req_s > mem_e:
-                fetch_ranges = [(mem_e + pd.Timedelta(days=1), req_e)]
-            elif req_e < mem_s:
-                fetch_ranges = [(req_s, mem_s - pd.Timedelta(days=1))]
-            else:
-                if req_s < mem_s:
-                    fetch_ranges.append((req_s, mem_s - pd.Timedelta(days=1)))
-                if req_e > mem_e:
-                    fetch_ranges.append((mem_e + pd.Timedelta(days=1), req_e))
-
-        # --- 補資料 ---
-        upsert_sql = f"""
-        INSERT INTO {target_table}
-        (date, stock_id, Trading_Volume, Trading_money, open, max, min, close, spread, Trading_turnover)
-        VALUES (?,?,?,?,?,?,?,?,?,?)
-        ON CONFLICT(date, stock_id) DO UPDATE SET
-          Trading_Volume   = excluded.Trading_Volume,
-          Trading_money    = excluded.Trading_money,
-          open             = excluded.open,
-          max              = excluded.max,
-          min              = excluded.min,
-          close            = excluded.close,
-          spread           = excluded.spread,
-          Trading_turnover = excluded.Trading_turnover
-        """
-
-        for fs, fe in fetch_ranges:
-            if fs <= fe:
-                df_api = api.taiwan_stock_daily(
-                    stock_id=sid,
-                    start_date=dstr(fs),
-                    end_date=dstr(fe),
-                )
-                if df_api is not None and not df_api.empty:
-                    df_api = df_api.copy()
-                    df_api["date"] = pd.to_datetime(df_api["date"]).dt.strftime("%Y-%m-%d")
-                    df_api["stock_id"] = df_api["stock_id"].astype(str)
-
-                    params = list(df_api[
-                        ["date", "stock_id", "Trading_Volume", "Trading_money",
-                         "open", "max", "min", "close", "spread", "Trading_turnover"]
-                    ].itertuples(index=False, name=None))
-
-                    db.execute_sql(upsert_sql, params)
-
-        # --- 更新 span ---
-        db.execute_sql(
-            """
-            INSERT INTO date_span (target_table, idx_key, start_date, end_date, updated_at)
-            VALUES (?, ?, ?, ?, strftime('%s','now'))
-            ON CONFLICT(target_table, idx_key) DO UPDATE SET
-              start_date = excluded.start_date,
-              end_date   = excluded.end_date,
-              updated_at = strftime('%s','now')
-            """,
-            (target_table, sid, dstr(new_s), dstr(new_e)),
-        )
-
-        # --- DB 回傳該檔 ---
-        df_sid = db.query_to_df(
-            f"""
-            SELECT date, stock_id, Trading_Volume, Trading_money,
-                   open, max, min, close, spread, Trading_turnover
-            FROM {target_table}
-            WHERE stock_id = ?
-              AND date >= ?
-              AND date <= ?
-            ORDER BY date
-            """,
-            (sid, dstr(req_s), dstr(req_e)),
+            if db.bulk_upsert(target_table, df_api, key_cols=["date", "stock_id"]) is None:
+                return
+            last_date = df_api["date"].max()
+
+        covered_e = coverage.settled_end(fe, last_date)
+        if covered_e is not None:
+            coverage.mark_covered(target_table, sid, fs, covered_e)
+
+    def on_error(stage, job, e):
+        sid, _, _, ts, te = job
+        utils.ptMsg(f"❌ {sid} {dstr(ts)}~{dstr(te)} {stage} 失敗：{e}")
+
+    if jobs:
+        result = pipeline.run_pipeline(
+            jobs, fetch, parse, write,
+            fetch_workers=FETCH_WORKERS,
+            on_error=on_error,
+            name="fm_daily",
         )
+        pipeline.print_stats("finMind.get_tw_stock_daily_price", result)
 
-        all_dfs.append(df_sid)
-
-    # === 2) 合併回傳 ===
-    if not all_dfs:
+    # === 3) DB 回傳：所有股票一次查詢，再依 stock_ids 順序排列 ===
+    if not stock_ids:
         return pd.DataFrame()
 
-    return pd.concat(all_dfs, ignore_index=True)
+    df = db.query_to_df(
+        f"""
+        SELECT {", ".join(PRICE_COLS)}
+        FROM {target_table}
+        WHERE stock_id IN ({", ".join("?" * len(stock_ids))})
+          AND date >= ?
+          AND date <= ?
+        """,
+        (*stock_ids, dstr(req_s), dstr(req_e)),
+    )
+    order = pd.Categorical(df["stock_id"], categories=list(dict.fromkeys(stock_ids)), ordered=True)
+    return df.assign(_ord=order).sort_values(["_ord", "date"]).drop(columns="_ord").reset_index(drop=True)
 
 def get_tw_institutional_total(
     start_date: datetime,
@@ -374,7 +331,7 @@ def get_tw_institutional_total(
     """
     取得台灣市場整體三大法人買賣超（TaiwanStockTotalInstitutionalInvestors）
     並快取到 fm_taiwan_stock_institutional_total
-    span 表使用：target_table='fm_taiwan_stock_institutional_total', stock_id='ALL'
+    覆蓋區間：date_coverage，target_table='fm_taiwan_stock_institutional_total', idx_key='ALL'
     """
     print("--- run finMind.get_tw_institutional_total ---")
     target_table = "fm_taiwan_stock_institutional_total"
@@ -404,98 +361,48 @@ def get_tw_institutional_total(
     def dstr(t: pd.Timestamp) -> str:
         return t.strftime("%Y-%m-%d")
 
-    # === 1) 查 span ===
-    span_row = db.query_to_df(
-        """
-        SELECT start_date, end_date
-        FROM date_span
-        WHERE target_table = ? AND idx_key = ?
-        """,
-        (target_table, span_key),
-    )
-
-    mem_s = (
-        pd.Timestamp(span_row.loc[0, "start_date"]).normalize()
-        if not span_row.empty
-        else None
-    )
-    mem_e = (
-        pd.Timestamp(span_row.loc[0, "end_date"]).normalize()
-        if not span_row.empty
-        else None
-    )
-
-    fetch_ranges: list[tuple[pd.Timestamp, pd.Timestamp]] = []
-
-    if mem_s is None:
-        # 沒有任何快取 -> 全段補
-        fetch_ranges = [(req_s, req_e)]
-        new_s, new_e = req_s, req_e
-    else:
-        # 有舊 span，算新 span
-        new_s = min(mem_s, req_s)
-        new_e = max(mem_e, req_e)
-
-        if req_s >= mem_s and req_e <= mem_e:
-            # 完全被舊資料涵蓋
-            fetch_ranges = []
-        elif req_s > mem_e:
-            # 完全在舊資料右邊
-            fetch_ranges = [(mem_e + pd.Timedelta(days=1), req_e)]
-        elif req_e < mem_s:
-            # 完全在舊資料左邊
-            fetch_ranges = [(req_s, mem_s - pd.Timedelta(days=1))]
-        else:
-            # 有重疊：左右各缺一段
-            if req_s < mem_s:
-                fetch_ranges.append((req_s, mem_s - pd.Timedelta(days=1)))
-            if req_e > mem_e:
-                fetch_ranges.append((mem_e + pd.Timedelta(days=1), req_e))
-
-    # === 2) 向 FinMind 補資料並寫入快取 ===
-    upsert_sql = f"""
-    INSERT INTO {target_table}
-      (date, name, buy, sell)
-    VALUES (?,?,?,?)
-    ON CONFLICT(date, name) DO UPDATE SET
-      buy        = excluded.buy,
-      sell       = excluded.sell,
-      updated_at = datetime('now', 'localtime');
-    """
+    # === 1) 查覆蓋缺口 ===
+    fetch_ranges = coverage.missing_ranges(target_table, span_key, req_s, req_e)
 
+    # === 2) 向 FinMind 補資料並寫入快取，成功的段落才標記覆蓋 ===
+    cal = trading_calendar.get_calendar()
     for fs, fe in fetch_ranges:
-        if fs > fe:
+        # 缺口內沒有交易日（週末 / 連假）就不打 API，直接標記
+        trimmed = cal.trim(fs, fe)
+        if trimmed is None:
+            coverage.mark_no_trading(cal, target_table, span_key, fs, fe)
             continue
+        ts, te = trimmed
 
-        df_api = api.taiwan_stock_institutional_investors_total(
-            start_date=dstr(fs),
-            end_date=dstr(fe),
-        )
+        try:
+            df_api = _fm_fetch(
+                "TaiwanStockTotalInstitutionalInvestors",
+                start_date=dstr(ts),
+                end_date=dstr(te),
+            )
+        except Exception as e:
+            utils.ptMsg(f"❌ 三大法人 {dstr(ts)}~{dstr(te)} 抓取失敗：{e}")
+            continue
 
+        last_date = None
         if df_api is not None and not df_api.empty:
             df_api = df_api.copy()
             df_api["date"] = pd.to_datetime(df_api["date"]).dt.strftime("%Y-%m-%d")
-            params = list(
-                df_api[["date", "name", "buy", "sell"]].itertuples(
-                    index=False, name=None
-                )
+            res = db.bulk_upsert(
+                target_table,
+                df_api[["date", "name", "buy", "sell"]],
+                key_cols=["date", "name"],
+                extra_updates={"updated_at": "datetime('now', 'localtime')"},
             )
-            db.execute_sql(upsert_sql, params)
+            if res is None:
+                continue
+            last_date = df_api["date"].max()
 
-    # === 3) 更新 span ===
-    db.execute_sql(
-        """
-        INSERT INTO date_span (target_table, idx_key, start_date, end_date, updated_at)
-        VALUES (?, ?, ?, ?, strftime('%s','now'))
-        ON CONFLICT(target_table, idx_key) DO UPDATE SET
-          start_date = excluded.start_date,
-          end_date   = excluded.end_date,
-          updated_at = strftime('%s','now')
-        """,
-        (target_table, span_key, dstr(new_s), dstr(new_e)),
-    )
+        covered_e = coverage.settled_end(fe, last_date)
+        if covered_e is not None:
+            coverage.mark_covered(target_table, span_key, fs, covered_e)
 
-    # === 4) 從快取表讀出需求區間 ===
+    # === 3) 從快取表讀出需求區間 ===
     df = db.query_to_df(
         f"""
         SELECT date, name, buy, sell
@@ -517,9 +424,9 @@ def get_tw_margin_total(
     """
     FinMind - TaiwanStockTotalMarginPurchaseShortSale
     快取表：fm_taiwan_stock_margin_total
-    span 表：date_span
+    覆蓋區間：date_coverage
       - target_table = 'fm_taiwan_stock_margin_total'
-      - idx_key = NULL
+      - idx_key = 'date'
     """
     print("--- run finMind.get_tw_margin_total_finmind ---")
 
@@ -534,106 +441,49 @@ def get_tw_margin_total(
     def dstr(t: pd.Timestamp) -> str:
         return t.strftime("%Y-%m-%d")
 
-    # === 1) 查 span ===
-    span_row = db.query_to_df(
-        """
-        SELECT start_date, end_date
-        FROM date_span
-        WHERE target_table = ?
-          AND idx_key = ?
-        """,
-        (target_table, span_key),
-    )
-
-    mem_s = pd.Timestamp(span_row.loc[0, "start_date"]).normalize() if not span_row.empty else None
-    mem_e = pd.Timestamp(span_row.loc[0, "end_date"]).normalize() if not span_row.empty else None
-
-    fetch_ranges: list[tuple[pd.Timestamp, pd.Timestamp]] = []
-
-    if mem_s is None:
-        fetch_ranges = [(req_s, req_e)]
-        new_s, new_e = req_s, req_e
-    else:
-        new_s = min(mem_s, req_s)
-        new_e = max(mem_e, req_e)
-
-        if req_s >= mem_s and req_e <= mem_e:
-            fetch_ranges = []
-        elif req_s > mem_e:
-            fetch_ranges = [(mem_e + pd.Timedelta(days=1), req_e)]
-        elif req_e < mem_s:
-            fetch_ranges = [(req_s, mem_s - pd.Timedelta(days=1))]
-        else:
-            if req_s < mem_s:
-                fetch_ranges.append((req_s, mem_s - pd.Timedelta(days=1)))
-            if req_e > mem_e:
-                fetch_ranges.append((mem_e + pd.Timedelta(days=1), req_e))
-
-    # === 2) 補資料（一次一段，避免 ban） ===
-    upsert_sql = f"""
-    INSERT INTO {target_table}
-      (date, name, buy, sell, TodayBalance, YesBalance, Return)
-    VALUES (?,?,?,?,?,?,?)
-    ON CONFLICT(date, name) DO UPDATE SET
-      buy = excluded.buy,
-      sell = excluded.sell,
-      TodayBalance = excluded.TodayBalance,
-      YesBalance = excluded.YesBalance,
-      Return = excluded.Return,
-      updated_at = datetime('now', 'localtime');
-    """
+    # === 1) 查覆蓋缺口 ===
+    fetch_ranges = coverage.missing_ranges(target_table, span_key, req_s, req_e)
 
+    # === 2) 補資料（一次一段，避免 ban），成功的段落才標記覆蓋 ===
+    cal = trading_calendar.get_calendar()
     for fs, fe in fetch_ranges:
-        if fs > fe:
+        # 缺口內沒有交易日（週末 / 連假）就不打 API，直接標記
+        trimmed = cal.trim(fs, fe)
+        if trimmed is None:
+            coverage.mark_no_trading(cal, target_table, span_key, fs, fe)
             continue
+        ts, te = trimmed
 
-        df_api = api.taiwan_stock_margin_purchase_short_sale_total(
-            start_date=dstr(fs),
-            end_date=dstr(fe),
-        )
-
-        if df_api is None or df_api.empty:
+        try:
+            df_api = _fm_fetch(
+                "TaiwanStockTotalMarginPurchaseShortSale",
+                start_date=dstr(ts),
+                end_date=dstr(te),
+            )
+        except Exception as e:
+            utils.ptMsg(f"❌ 融資融券 {dstr(ts)}~{dstr(te)} 抓取失敗：{e}")
             continue
 
-        df_api = df_api.copy()
-        df_api["date"] = pd.to_datetime(df_api["date"]).dt.strftime("%Y-%m-%d")
-
-        params = list(
-            df_api[
-                ["date", "name", "buy", "sell", "TodayBalance", "YesBalance", "Return"]
-            ].itertuples(index=False, name=None)
-        )
-
-        db.execute_sql(upsert_sql, params)
-
-    # === 3) 重新計算實際 span（用 DB 真實資料） ===
-    span_cov = db.query_to_df(
-        f"""
-        SELECT MIN(date) AS min_d, MAX(date) AS max_d
-        FROM {target_table}
-        """
-    )
+        last_date = None
+        if df_api is not None and not df_api.empty:
+            df_api = df_api.copy()
+            df_api["date"] = pd.to_datetime(df_api["date"]).dt.strftime("%Y-%m-%d")
 
-    if not span_cov.empty and span_cov.loc[0, "max_d"] is not None:
-        real_s = pd.Timestamp(span_cov.loc[0, "min_d"]).normalize()
-        real_e = pd.Timestamp(span_cov.loc[0, "max_d"]).normalize()
-        real_e = min(real_e, req_e)
-    else:
-        real_s, real_e = req_s, req_e
+            res = db.bulk_upsert(
+                target_table,
+                df_api[["date", "name", "buy", "sell", "TodayBalance", "YesBalance", "Return"]],
+                key_cols=["date", "name"],
+                extra_updates={"updated_at": "datetime('now', 'localtime')"},
+            )
+            if res is None:
+                continue
+            last_date = df_api["date"].max()
 
-    db.execute_sql(
-        """
-        INSERT INTO date_span (target_table, idx_key, start_date, end_date, updated_at)
-        VALUES (?, ?, ?, ?, strftime('%s','now'))
-        ON CONFLICT(target_table, idx_key) DO UPDATE SET
-          start_date = excluded.start_date,
-          end_date   = excluded.end_date,
-          updated_at = strftime('%s','now')
-        """,
-        (target_table, span_key, dstr(real_s), dstr(real_e)),
-    )
+        covered_e = coverage.settled_end(fe, last_date)
+        if covered_e is not None:
+            coverage.mark_covered(target_table, span_key, fs, covered_e)
 
-    # === 4) 從 DB 回傳 ===
+    # === 3) 從 DB 回傳 ===
     df = db.query_to_df(
         f"""
         SELECT
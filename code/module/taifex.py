@@ -0,0 +1,304 @@
+import io
+import os
+import pandas as pd
+from datetime import datetime
+from typing import Iterator
+from common import db, coverage, http_client, pipeline
+from module import twse
+
+# =========================================================
+# TAIFEX（期交所）每日行情 / 三大法人未平倉
+#   - 來源都是「下載 CSV」的 POST 端點（cp950 編碼），一次可查一段日期
+#     → 依覆蓋缺口一個月一個 request（coverage.month_jobs）
+#   - CSV 以 chunksize 分段解析、分段 bulk_upsert，不會整份展開在記憶體
+#   - import_csv()：匯入期交所網站下載的多年份歷史 CSV，同樣分段讀檔
+#   - date_coverage：target_table = 各資料表，idx_key = 商品代號（例如 TX / TXO）
+# =========================================================
+
+taifexUrl = "https://www.taifex.com.tw/cht/3"
+CSV_ENCODING = "cp950"
+CHUNK_ROWS = 50_000
+
+# 每種資料：下載端點、資料表、CSV 欄位 → DB 欄位、主鍵、數值欄
+FUT_FIELDS = {
+    "交易日期": "date", "契約": "contract", "到期月份(週別)": "expiry", "交易時段": "session",
+    "開盤價": "open", "最高價": "high", "最低價": "low", "收盤價": "close", "漲跌價": "change",
+    "成交量": "volume", "結算價": "settlement", "未沖銷契約數": "open_interest",
+    "最後最佳買價": "best_bid", "最後最佳賣價": "best_ask",
+}
+OPT_FIELDS = {
+    "交易日期": "date", "契約": "contract", "到期月份(週別)": "expiry", "履約價": "strike",
+    "買賣權": "call_put", "交易時段": "session",
+    "開盤價": "open", "最高價": "high", "最低價": "low", "收盤價": "close",
+    "成交量": "volume", "結算價": "settlement", "未沖銷契約數": "open_interest",
+    "最後最佳買價": "best_bid", "最後最佳賣價": "best_ask",
+}
+INSTI_FIELDS = {
+    "日期": "date", "商品名稱": "contract", "身份別": "identity",
+    "多方交易口數": "long_volume", "空方交易口數": "short_volume", "多空交易口數淨額": "net_volume",
+    "多方未平倉口數": "long_oi", "空方未平倉口數": "short_oi", "多空未平倉口數淨額": "net_oi",
+    "多空未平倉契約金額淨額(千元)": "net_oi_amount_k",
+}
+
+DATASETS = {
+    "futures": {
+        "endpoint": "futDataDown",
+        "table": "taifex_futures_daily",
+        "fields": FUT_FIELDS,
+        "keys": ["date", "contract", "expiry", "session"],
+        "id_param": "commodity_id",
+        "form": {"down_type": "1"},
+    },
+    "options": {
+        "endpoint": "optDataDown",
+        "table": "taifex_options_daily",
+        "fields": OPT_FIELDS,
+        "keys": ["date", "contract", "expiry", "strike", "call_put", "session"],
+        "id_param": "commodity_id",
+        "form": {"down_type": "1"},
+    },
+    "fut_institutional": {
+        "endpoint": "futContractsDateDown",
+        "table": "taifex_fut_institutional",
+        "fields": INSTI_FIELDS,
+        "keys": ["date", "contract", "identity"],
+        "id_param": "commodityId",
+        "tag_commodity": True,
+        "form": {},
+    },
+    "opt_institutional": {
+        "endpoint": "callsAndPutsDateDown",
+        "table": "taifex_opt_institutional",
+        "fields": {**INSTI_FIELDS, "買賣權別": "call_put"},
+        "keys": ["date", "contract", "call_put", "identity"],
+        "id_param": "commodityId",
+        "tag_commodity": True,
+        "form": {},
+    },
+}
+
+
+# =========================
+# CSV 分段解析
+# =========================
+def _iter_frames(source, kind: str) -> Iterator[pd.DataFrame]:
+    """
+    source：CSV bytes 或檔案路徑；每次 yield 最多 CHUNK_ROWS 列、已正規化的 DataFrame
+    - 只讀需要的欄位，全部先以字串讀入再整欄轉型
+    - 日期 → YYYY-MM-DD；'-' / 空白 → NULL；主鍵欄位為空的列捨棄
+    """
+    spec = DATASETS[kind]
+    fields = spec["fields"]
+    keys = spec["keys"]
+    text_cols = set(keys) - {"strike"}
+
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+
+    reader = pd.read_csv(
+        source,
+        encoding=CSV_ENCODING,
+        encoding_errors="replace",
+        dtype=str,
+        index_col=False,
+        usecols=lambda c: str(c).strip() in fields,
+        chunksize=CHUNK_ROWS,
+    )
+    for chunk in reader:
+        chunk.columns = [fields[str(c).strip()] for c in chunk.columns]
+        df = pd.DataFrame(index=chunk.index)
+        for col in chunk.columns:
+            s = chunk[col].astype(str).str.strip()
+            if col == "date":
+                df[col] = pd.to_datetime(s, format="%Y/%m/%d", errors="coerce").dt.strftime("%Y-%m-%d")
+            elif col in text_cols:
+                df[col] = s.where(~chunk[col].isna(), None)
+            else:
+                df[col] = pd.to_numeric(s.str.replace(",", "", regex=False), errors="coerce")
+        df = df.dropna(subset=keys)
+        if not df.empty:
+            yield df
+
+
+def _upsert_frames(kind: str, frames, commodity: str | None = None) -> dict[str, tuple[str, str]] | None:
+    """
+    逐段寫入；回傳 {商品代號: (最早日期, 最晚日期)}（給覆蓋標記用）
+    法人資料（tag_commodity）的 contract 是中文商品名稱，另存查詢用的 commodity_id
+    任一段寫入失敗回傳 None
+    """
+    spec = DATASETS[kind]
+    spans: dict[str, tuple[str, str]] = {}
+    for df in frames:
+        if spec.get("tag_commodity"):
+            df = df.assign(commodity_id=commodity)
+        if db.bulk_upsert(spec["table"], df, key_cols=spec["keys"]) is None:
+            return None
+        for contract, g in df.groupby("contract")["date"]:
+            lo, hi = g.min(), g.max()
+            old = spans.get(contract)
+            spans[contract] = (min(lo, old[0]), max(hi, old[1])) if old else (lo, hi)
+    return spans
+
+
+# =========================
+# 下載（依覆蓋缺口，一個月一個 request）
+# =========================
+def _download(kind: str, commodity: str, s: pd.Timestamp, e: pd.Timestamp) -> bytes:
+    spec = DATASETS[kind]
+    form = {
+        **spec["form"],
+        spec["id_param"]: commodity,
+        "queryStartDate": s.strftime("%Y/%m/%d"),
+        "queryEndDate": e.strftime("%Y/%m/%d"),
+    }
+    content = http_client.post(f"{taifexUrl}/{spec['endpoint']}", data=form, timeout=60).content
+    # 查詢條件不合法 / 維護時回 HTML 而不是 CSV
+    if content[:64].lstrip().startswith(b"<"):
+        raise ValueError(f"TAIFEX {spec['endpoint']} 回傳 HTML（{commodity} {s.date()}~{e.date()}）")
+    return content
+
+
+def ingest(kind: str, commodity: str, start_date: datetime, end_date: datetime) -> dict | None:
+    """
+    補齊 [start_date, end_date] 內 kind 資料的覆蓋缺口（kind 見 DATASETS）
+    commodity：期貨 / 選擇權商品代號（TX、MTX、TXO…）；法人資料用 TXF、MXF、TXO…
+    """
+    spec = DATASETS[kind]
+    table = spec["table"]
+    req_s = pd.Timestamp(start_date).normalize()
+    req_e = pd.Timestamp(end_date).normalize()
+    if req_s > req_e:
+        raise ValueError("start_date 不可大於 end_date")
+
+    jobs = coverage.month_jobs(table, commodity, req_s, req_e)
+    if not jobs:
+        return None
+
+    def fetch(job):
+        _, clip_s, clip_e = job
+        return _download(kind, commodity, clip_s, clip_e)
+
+    # parse 回傳 generator：write 逐段取出、逐段寫入，一個月的 CSV 不會整份展開成 DataFrame
+    def parse(job, content):
+        return _iter_frames(content, kind)
+
+    def write(job, frames):
+        _, clip_s, clip_e = job
+        spans = _upsert_frames(kind, frames, commodity)
+        if spans is None:
+            return
+        last_date = max((hi for _, hi in spans.values()), default=None)
+        covered_e = coverage.settled_end(clip_e, last_date)
+        if covered_e is not None:
+            coverage.mark_covered(table, commodity, clip_s, covered_e)
+
+    result = pipeline.run_pipeline(jobs, fetch, parse, write, fetch_workers=2, name=f"taifex_{kind}")
+    pipeline.print_stats(f"taifex.ingest({kind}, {commodity})", result)
+    return result
+
+
+def import_csv(path: str, kind: str, commodity: str | None = None) -> dict[str, tuple[str, str]] | None:
+    """
+    匯入期交所下載的歷史 CSV（可為多年份大檔），分段讀檔、分段寫入
+    檔案內每個商品出現的 [最早日, 最晚日] 視為完整資料，標記覆蓋
+    commodity：覆蓋標記用的商品代號；法人資料的 contract 是中文商品名稱，要另外指定（TXF…），
+      同時存成 commodity_id 給 get_futures_institutional 查詢
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    spans = _upsert_frames(kind, _iter_frames(path, kind), commodity)
+    if spans:
+        if commodity is not None:
+            marks = [(commodity, min(s for s, _ in spans.values()), max(e for _, e in spans.values()))]
+        else:
+            marks = [(c, s, e) for c, (s, e) in spans.items()]
+        coverage.mark_covered_many(DATASETS[kind]["table"], marks)
+        print(f"✅ 匯入 {path}：{len(spans)} 個商品")
+    return spans
+
+
+# =========================
+# 查詢
+# =========================
+def _read(kind: str, commodity: str, start_date: datetime, end_date: datetime) -> pd.DataFrame:
+    spec = DATASETS[kind]
+    cols = list(dict.fromkeys(spec["fields"].values()))
+    return db.query_to_df(
+        f"""
+        SELECT {', '.join(cols)} FROM {spec['table']}
+        WHERE contract = ? AND date >= ? AND date <= ?
+        ORDER BY {', '.join(spec['keys'])}
+        """,
+        (commodity, pd.Timestamp(start_date).strftime("%Y-%m-%d"), pd.Timestamp(end_date).strftime("%Y-%m-%d")),
+    )
+
+
+def get_futures_daily(commodity: str, start_date: datetime, end_date: datetime) -> pd.DataFrame:
+    ingest("futures", commodity, start_date, end_date)
+    return _read("futures", commodity, start_date, end_date)
+
+
+def get_options_daily(commodity: str, start_date: datetime, end_date: datetime) -> pd.DataFrame:
+    ingest("options", commodity, start_date, end_date)
+    return _read("options", commodity, start_date, end_date)
+
+
+def get_futures_institutional(commodity: str, start_date: datetime, end_date: datetime) -> pd.DataFrame:
+    """commodity 為期交所的商品代號（TXF / MXF…）；資料表內 contract 為 CSV 的「商品名稱」，以 commodity_id 篩選"""
+    ingest("fut_institutional", commodity, start_date, end_date)
+    return db.query_to_df(
+        """
+        SELECT date, contract, identity, long_volume, short_volume, net_volume,
+               long_oi, short_oi, net_oi, net_oi_amount_k
+        FROM taifex_fut_institutional
+        WHERE commodity_id = ? AND date >= ? AND date <= ?
+        ORDER BY date, contract, identity
+        """,
+        (commodity, pd.Timestamp(start_date).strftime("%Y-%m-%d"), pd.Timestamp(end_date).strftime("%Y-%m-%d")),
+    )
+
+
+def get_tx_basis(start_date: datetime, end_date: datetime) -> pd.DataFrame:
+    """
+    台指期近月（一般時段、月契約）與加權指數的價差，可直接併到 stock_report_daily 的 TAIEX 列
+    加權指數收盤取自 twse_indicesReport_mi_5mins_hist（先用 twse.get_twse_indicesReport_mi_5mins_hist 補齊區間）
+    欄位：date, expiry, fut_close, settlement, open_interest, total_oi, taiex_close, basis
+    """
+    ingest("futures", "TX", start_date, end_date)
+    twse.get_twse_indicesReport_mi_5mins_hist(start_date, end_date)
+    return db.query_to_df(
+        """
+        WITH tx AS (
+            SELECT date, expiry, close, settlement, open_interest
+            FROM taifex_futures_daily
+            WHERE contract = 'TX' AND session = '一般'
+              AND date >= ? AND date <= ?
+              AND length(expiry) = 6          -- 只取月契約（排除週契約 / 價差）
+        ),
+        near AS (
+            SELECT date, MIN(expiry) AS expiry, SUM(open_interest) AS total_oi
+            FROM tx GROUP BY date
+        )
+        SELECT
+          n.date,
+          n.expiry,
+          t.close AS fut_close,
+          t.settlement,
+          t.open_interest,
+          n.total_oi,
+          m.close_index AS taiex_close,
+          t.close - m.close_index AS basis
+        FROM near n
+        JOIN tx t ON t.date = n.date AND t.expiry = n.expiry
+        LEFT JOIN twse_indicesReport_mi_5mins_hist m ON m.date_ad = n.date
+        ORDER BY n.date
+        """,
+        (pd.Timestamp(start_date).strftime("%Y-%m-%d"), pd.Timestamp(end_date).strftime("%Y-%m-%d")),
+    )
+
+
+# python -m module.taifex
+if __name__ == "__main__":
+    e = datetime.today()
+    s = e - pd.Timedelta(days=40)
+    print(get_tx_basis(s, e).tail())
@@ -0,0 +1,309 @@
+import re
+import pandas as pd
+from datetime import datetime
+from typing import List
+from common import db, coverage, negative_cache, http_client, scheduler, pipeline, parsing
+
+# =========================================================
+# TPEx（櫃買中心）盤後資料，端點見 module/twse&tpex.md
+#   - 新版 www/zh-tw API 一律 POST form-data，日期參數為西元 YYYY/MM/DD，
+#     回傳 {"stat": "ok", "tables": [{"fields", "data"}]}，資料列的日期為民國 '114/10/01'
+#   - 跟 TWSE 一樣走 date_coverage：只抓缺口，成功寫入才標記
+#   - tradingIndex 一次回傳整個月 → 一個月一個 request
+#   - insti/summary、margin/balance 只能查單日 → 一個交易日一個 request
+# =========================================================
+
+tpexUrl = "https://www.tpex.org.tw/www/zh-tw"
+ASYNC_CONCURRENCY = 3  # 月查詢同時在途的請求數（速率由 scheduler 的 TPEx 限制控制）
+
+INDEX_TABLE = "tpex_trading_index"
+INDEX_SPAN_KEY = "TPEx"
+INDEX_COLS = ["date", "volume_k", "amount_k", "trade_count", "close_index", "change"]
+
+INSTI_TABLE = "tpex_insti_summary"
+INSTI_SPAN_KEY = "ALL"
+INSTI_COLS = ["date", "name", "buy", "sell", "net"]
+
+MARGIN_TABLE = "tpex_margin_balance"
+MARGIN_SPAN_KEY = "ALL"
+# 欄位名稱（去掉括號單位後）→ DB 欄位；名稱與 twse_margin_stock_daily 相同
+MARGIN_FIELD_MAP = {
+    "代號": "stock_id",
+    "前資餘額": "MarginPurchaseYesterdayBalance",
+    "資買": "MarginPurchaseBuy",
+    "資賣": "MarginPurchaseSell",
+    "現償": "MarginPurchaseCashRepayment",
+    "資餘額": "MarginPurchaseTodayBalance",
+    "前券餘額": "ShortSaleYesterdayBalance",
+    "券賣": "ShortSaleSell",
+    "券買": "ShortSaleBuy",
+    "券償": "ShortSaleCashRepayment",
+    "券餘額": "ShortSaleTodayBalance",
+}
+MARGIN_COLS = ["date"] + list(MARGIN_FIELD_MAP.values())
+
+
+# =========================
+# 共用小工具
+# =========================
+def _dstr(t: pd.Timestamp) -> str:
+    return t.strftime("%Y-%m-%d")
+
+
+def _post(endpoint: str, date: pd.Timestamp, **extra) -> dict:
+    form = {"date": date.strftime("%Y/%m/%d"), "id": "", "response": "json", **extra}
+    return http_client.post(f"{tpexUrl}/{endpoint}", data=form).json()
+
+
+def _first_table(body: dict) -> dict | None:
+    """stat 不是 ok 或沒有資料列時回傳 None"""
+    if str(body.get("stat", "")).lower() != "ok":
+        return None
+    for table in body.get("tables") or []:
+        if table.get("data"):
+            return table
+    return None
+
+
+def _roc_to_iso(s: pd.Series) -> pd.Series:
+    """民國日期 '114/10/01' → '2025-10-01'（整欄一次轉換，格式不對的變 NaN）"""
+    return parsing.roc_to_iso(s)[0]
+
+
+def _num(s: pd.Series) -> pd.Series:
+    return parsing.to_number(s)[0]
+
+
+def _read(table: str, cols: List[str], req_s: pd.Timestamp, req_e: pd.Timestamp, order: str) -> pd.DataFrame:
+    return db.query_to_df(
+        f"SELECT {', '.join(cols)} FROM {table} WHERE date >= ? AND date <= ? ORDER BY {order}",
+        (_dstr(req_s), _dstr(req_e)),
+    )
+
+
+def _range(start_date: datetime, end_date: datetime) -> tuple[pd.Timestamp, pd.Timestamp]:
+    req_s = pd.Timestamp(start_date).normalize()
+    req_e = pd.Timestamp(end_date).normalize()
+    if req_s > req_e:
+        raise ValueError("start_date 不可大於 end_date")
+    return req_s, req_e
+
+
+def _run_day_jobs(target_table: str, span_key: str, req_s, req_e, fetch, parse, key_cols, name: str):
+    """
+    單日查詢 API 的共用流程：覆蓋缺口展開成交易日 → 管線抓取 / 解析 / 寫入 → 標記覆蓋
+    fetch(day) 回傳 JSON body；parse(day, table) 回傳要寫入的 DataFrame
+    """
+    jobs = coverage.day_jobs(target_table, span_key, req_s, req_e)
+    live_days = set(negative_cache.filter_days(target_table, span_key, [d for d, _, _ in jobs]))
+    jobs = [j for j in jobs if j[0] in live_days]
+    if not jobs:
+        return
+
+    def do_parse(job, body):
+        day = job[0]
+        table = _first_table(body)
+        if table is None:
+            # 交易日卻查無資料（颱風假等）：記負向快取，區段照樣標記
+            negative_cache.record(target_table, span_key, day, day, negative_cache.HOLIDAY)
+            return pd.DataFrame()
+        return parse(day, table)
+
+    def write(job, df):
+        day, span_s, span_e = job
+        last_date = None
+        if not df.empty:
+            if db.bulk_upsert(target_table, df, key_cols=key_cols) is None:
+                return
+            last_date = day
+        covered_e = coverage.settled_end(span_e, last_date)
+        if covered_e is not None:
+            coverage.mark_covered(target_table, span_key, span_s, covered_e)
+
+    result = pipeline.run_pipeline(
+        jobs, lambda job: fetch(job[0]), do_parse, write, fetch_workers=2, name=name
+    )
+    pipeline.print_stats(f"tpex.{name}", result)
+
+
+# =========================
+# 1) tradingIndex：櫃買指數日成交量值 / 收盤指數（一次一個月）
+#    table: tpex_trading_index，覆蓋 idx_key = 'TPEx'
+# =========================
+def _parse_trading_index(table: dict) -> pd.DataFrame:
+    # 日期, 成交股數(仟股), 金額(仟元), 筆數, 櫃買指數, 漲/跌
+    raw = pd.DataFrame([r[:6] for r in table["data"]])
+    df = pd.DataFrame({
+        "date": _roc_to_iso(raw[0]),
+        "volume_k": _num(raw[1]).astype("Int64"),
+        "amount_k": _num(raw[2]).astype("Int64"),
+        "trade_count": _num(raw[3]).astype("Int64"),
+        "close_index": _num(raw[4]),
+        "change": _num(raw[5]),
+    })
+    return df[df["date"].notna()]
+
+
+async def afetch_trading_index_months(month_starts: List[pd.Timestamp]) -> dict[pd.Timestamp, dict]:
+    """同時送出多個月份的查詢；回傳 {月初: JSON body}，請求失敗的月份不在結果內"""
+    bodies = {}
+    results = await scheduler.agather_ordered(
+        lambda m: _post("afterTrading/tradingIndex", m), month_starts, ASYNC_CONCURRENCY
+    )
+    for m_start, body, err in results:
+        if err is not None:
+            print(f"[TPEx tradingIndex] request error ({m_start.strftime('%Y/%m')}): {err}")
+            continue
+        bodies[m_start] = body
+    return bodies
+
+
+def get_tpex_trading_index(start_date: datetime, end_date: datetime) -> pd.DataFrame:
+    """櫃買指數收盤 + 成交量值（欄位：INDEX_COLS）"""
+    print("--- run tpex.get_tpex_trading_index ---")
+    req_s, req_e = _range(start_date, end_date)
+
+    # ---- 1) 補資料：依覆蓋缺口的月份呼叫 API，每個月成功寫入才標記該月在缺口內的那段 ----
+    month_jobs = coverage.month_jobs(INDEX_TABLE, INDEX_SPAN_KEY, req_s, req_e)
+    bodies = scheduler.run_async(afetch_trading_index_months(sorted({m for m, _, _ in month_jobs})))
+
+    for m_start, clip_s, clip_e in month_jobs:
+        body = bodies.get(m_start)
+        if body is None:
+            continue
+        table = _first_table(body)
+        df = _parse_trading_index(table) if table is not None else pd.DataFrame(columns=INDEX_COLS)
+
+        last_date = None
+        if not df.empty:
+            if db.bulk_upsert(INDEX_TABLE, df, key_cols=["date"]) is None:
+                continue
+            last_date = df["date"].max()
+
+        covered_e = coverage.settled_end(clip_e, last_date)
+        if covered_e is not None:
+            coverage.mark_covered(INDEX_TABLE, INDEX_SPAN_KEY, clip_s, covered_e)
+
+    # ---- 2) 一律從 DB 回傳 ----
+    return _read(INDEX_TABLE, INDEX_COLS, req_s, req_e, "date")
+
+
+# =========================
+# 2) insti/summary：三大法人買賣金額（單日）
+#    table: tpex_insti_summary，覆蓋 idx_key = 'ALL'
+# =========================
+def _parse_insti_summary(day: pd.Timestamp, table: dict) -> pd.DataFrame:
+    # 單位名稱, 買進金額(元), 賣出金額(元), 買賣超(元)
+    raw = pd.DataFrame([r[:4] for r in table["data"]])
+    df = pd.DataFrame({
+        "date": _dstr(day),
+        "name": raw[0].astype(str).str.strip(),
+        "buy": _num(raw[1]).astype("Int64"),
+        "sell": _num(raw[2]).astype("Int64"),
+        "net": _num(raw[3]).astype("Int64"),
+    })
+    return df[df["name"] != ""]
+
+
+def get_tpex_institutional_summary(start_date: datetime, end_date: datetime) -> pd.DataFrame:
+    """櫃買市場三大法人買賣金額（欄位：INSTI_COLS，一天多列，name 為單位名稱）"""
+    print("--- run tpex.get_tpex_institutional_summary ---")
+    req_s, req_e = _range(start_date, end_date)
+
+    _run_day_jobs(
+        INSTI_TABLE, INSTI_SPAN_KEY, req_s, req_e,
+        fetch=lambda day: _post("insti/summary", day, type="Daily", prod="1"),
+        parse=_parse_insti_summary,
+        key_cols=["date", "name"],
+        name="insti_summary",
+    )
+    return _read(INSTI_TABLE, INSTI_COLS, req_s, req_e, "date, name")
+
+
+# =========================
+# 3) margin/balance：個股融資融券餘額（單日，一次拿全部上櫃股票）
+#    table: tpex_margin_balance，覆蓋 idx_key = 'ALL'
+# =========================
+def _field_key(field: str) -> str:
+    """'資餘額(張)' → '資餘額'"""
+    return re.sub(r"\s+", "", re.split(r"[（(]", str(field))[0])
+
+
+def _parse_margin_balance(day: pd.Timestamp, table: dict) -> pd.DataFrame:
+    keys = [_field_key(f) for f in table["fields"]]
+    pos = {MARGIN_FIELD_MAP[k]: i for i, k in enumerate(keys) if k in MARGIN_FIELD_MAP}
+    missing = set(MARGIN_FIELD_MAP.values()) - set(pos)
+    if missing:
+        raise ValueError(f"TPEx margin/balance 欄位不符：缺 {sorted(missing)}")
+
+    raw = pd.DataFrame(table["data"])
+    df = pd.DataFrame({"date": _dstr(day), "stock_id": raw[pos["stock_id"]].astype(str).str.strip()})
+    for col in MARGIN_COLS[2:]:
+        df[col] = _num(raw[pos[col]]).astype("Int64")
+    return df[df["stock_id"] != ""]
+
+
+def ingest_tpex_margin_balance(start_date: datetime, end_date: datetime):
+    """補齊 [start_date, end_date] 的上櫃個股融資融券（一個交易日一個 request）"""
+    req_s, req_e = _range(start_date, end_date)
+    _run_day_jobs(
+        MARGIN_TABLE, MARGIN_SPAN_KEY, req_s, req_e,
+        fetch=lambda day: _post("margin/balance", day),
+        parse=_parse_margin_balance,
+        key_cols=["date", "stock_id"],
+        name="margin_balance",
+    )
+
+
+def get_tpex_margin_balance(
+    stock_id: str | List[str] | None,
+    start_date: datetime,
+    end_date: datetime,
+) -> pd.DataFrame:
+    """上櫃個股融資融券（先補齊缺口再從 DB 讀）；stock_id=None 回傳全部股票"""
+    print("--- run tpex.get_tpex_margin_balance ---")
+    req_s, req_e = _range(start_date, end_date)
+    ingest_tpex_margin_balance(req_s, req_e)
+
+    if stock_id is None:
+        return _read(MARGIN_TABLE, MARGIN_COLS, req_s, req_e, "stock_id, date")
+    ids = [stock_id] if isinstance(stock_id, str) else list(stock_id)
+    return db.query_to_df(
+        f"""
+        SELECT {', '.join(MARGIN_COLS)} FROM {MARGIN_TABLE}
+        WHERE date >= ? AND date <= ? AND stock_id IN ({', '.join('?' * len(ids))})
+        ORDER BY stock_id, date
+        """,
+        (_dstr(req_s), _dstr(req_e), *ids),
+    )
+
+
+def get_tpex_margin_total(start_date: datetime, end_date: datetime) -> pd.DataFrame:
+    """櫃買市場融資 / 融券餘額合計（張），由個股表加總"""
+    print("--- run tpex.get_tpex_margin_total ---")
+    req_s, req_e = _range(start_date, end_date)
+    ingest_tpex_margin_balance(req_s, req_e)
+    return db.query_to_df(
+        f"""
+        SELECT
+          date,
+          SUM(MarginPurchaseTodayBalance) AS MarginPurchaseTodayBalance,
+          SUM(MarginPurchaseYesterdayBalance) AS MarginPurchaseYesterdayBalance,
+          SUM(ShortSaleTodayBalance) AS ShortSaleTodayBalance,
+          SUM(ShortSaleYesterdayBalance) AS ShortSaleYesterdayBalance
+        FROM {MARGIN_TABLE}
+        WHERE date >= ? AND date <= ?
+        GROUP BY date
+        ORDER BY date
+        """,
+        (_dstr(req_s), _dstr(req_e)),
+    )
+
+
+# python -m module.tpex
+if __name__ == "__main__":
+    e = datetime.today()
+    s = e - pd.Timedelta(days=40)
+    print(get_tpex_trading_index(s, e).tail())
+    print(get_tpex_institutional_summary(s, e).tail())
+    print(get_tpex_margin_total(s, e).tail())
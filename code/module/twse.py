@@ -1,24 +1,28 @@
 import sys, os
+import re
 sys.path.append(os.path.dirname(__file__))
 
 import pandas as pd
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 
-from common.db import query_to_df, execute_sql, get_connection, query_single_value
+from common.db import query_to_df, get_connection, query_single_value
 import twse_api
 from common import tools
 import data_provider;
 
 from datetime import datetime
 from typing import List
-import requests
-from common import db, utils
-import finMind
+from common import db, coverage, trading_calendar, negative_cache, http_client, scheduler, pipeline, parsing
 
 # sys.path.append(os.path.dirname(__file__))
 # sys.path.append(os.path.dirname(os.path.dirname(__file__))) 
 
+# twse_marginTrading_miMargn 欄位（依 API 回傳順序，前面補上日期）
+MARGIN_COLS = ["日期", "項目", "買進", "賣出", "現金_券_償還", "前日餘額", "今日餘額"]
+MARGIN_PARSE = {c: (i, "raw" if i < 2 else "int") for i, c in enumerate(MARGIN_COLS)}
+MARGIN_CHUNK_DAYS = 20  # 修補時每批最多幾個交易日
+
 # 注意股公告
 def get_notice(sDt: datetime, eDt: datetime):
     return data_provider.get_notice("twse", sDt, eDt)
@@ -67,27 +71,9 @@ def get_margin_trading(sDt: datetime, eDt: datetime):
         print(data)
 
         ### 存到db裡
-        values = []
-        for r in data:
-            try:
-                values.append((
-                    r[0].strip(),
-                    r[1].strip(),
-                    int(r[2].replace(',', '')),
-                    int(r[3].replace(',', '')),
-                    int(r[4].replace(',', '')),
-                    int(r[5].replace(',', '')),
-                    int(r[6].replace(',', ''))
-                ))
-            except:
-                continue
-
-        sql = f"""
-        INSERT OR REPLACE INTO {table}
-        (日期, 項目, 買進, 賣出, 現金_券_償還, 前日餘額, 今日餘額)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        """
-        if not execute_sql(sql, values):
+        values, bad = parsing.parse_table(data, MARGIN_PARSE, required=MARGIN_COLS)
+        parsing.report_errors(f"融資餘額 {sDt.date()} ~ {eDt.date()}", data, bad)
+        if db.bulk_upsert(table, values[~bad], key_cols=["日期", "項目"]) is None:
             print("存庫失敗！")
         df = pd.DataFrame(raw_data.get("data", []), columns=raw_data.get("fields", []))
         return df
@@ -127,12 +113,11 @@ def repair_margin_trading_gaps(
     """
     修補 twse_marginTrading_miMargn 中間缺漏的交易日資料
     - 若未指定 start/end，則以 DB 中 min/max 日期為範圍
-    - 僅針對缺口呼叫 API
+    - 僅針對缺口呼叫 API，成功寫入的區段記到 date_coverage
     """
     table = "twse_marginTrading_miMargn"
-    span_table = "date_span"
     target_table = table
-    idx_key = None  # 依你要求，融資不需要 idx_key
+    idx_key = None  # 依你要求，融資不需要 idx_key（date_coverage 內存成 ''）
 
     # === 1) 決定修補範圍 ===
     if start_date is None or end_date is None:
@@ -151,13 +136,7 @@ def repair_margin_trading_gaps(
 
     print(f"🔍 修補範圍: {s.date()} ~ {e.date()}")
 
-    # === 2) 取得交易日曆 ===
-    df_trade = finMind.getTwStockTradingDates()
-    trade_days = set(
-        pd.to_datetime(df_trade["date"]).dt.strftime("%Y%m%d")
-    )
-
-    # === 3) 取 DB 已有日期 ===
+    # === 2) 取 DB 已有日期 ===
     df_exist = db.query_to_df(
         f"""
         SELECT DISTINCT 日期
@@ -168,93 +147,65 @@ def repair_margin_trading_gaps(
     )
     exist_days = set(df_exist["日期"]) if not df_exist.empty else set()
 
-    # === 4) 找缺口交易日 ===
-    need_days = sorted([
-        d for d in trade_days
-        if s.strftime("%Y%m%d") <= d <= e.strftime("%Y%m%d")
-        and d not in exist_days
-    ])
+    # === 3) 依交易日曆找缺口交易日 ===
+    cal = trading_calendar.get_calendar()
+    need_days = [
+        d for d in cal.trading_days(s, e).strftime("%Y%m%d")
+        if d not in exist_days
+    ]
+    # 之前查過確定沒資料（或短期內被擋）的日子先排除
+    need_days = negative_cache.filter_days(
+        twse_api.MARGIN_NEG_SOURCE, twse_api.MARGIN_NEG_KEY, need_days
+    )
 
     if not need_days:
         print("✅ 無缺漏交易日")
         return
 
-    # === 5) 將缺日合併為連續區段（最少 API call） ===
-    def to_ranges(days: list[str]):
-        ranges = []
-        start = prev = datetime.strptime(days[0], "%Y%m%d")
-        for d in days[1:]:
-            cur = datetime.strptime(d, "%Y%m%d")
-            if (cur - prev).days > 1:
-                ranges.append((start, prev))
-                start = cur
-            prev = cur
-        ranges.append((start, prev))
-        return ranges
-
-    fetch_ranges = to_ranges(need_days)
+    # === 4) 將缺日依交易日序號合併為連續區段（只隔週末 / 假日的算同一段，最少 API call） ===
+    fetch_ranges = cal.group_runs(need_days)
 
     print(f"🚑 發現 {len(fetch_ranges)} 段缺口，開始補資料")
 
-    # === 6) 補資料 ===
+    # === 5) 長區段切成最多 MARGIN_CHUNK_DAYS 個交易日一批，讓抓取 / 寫入可以交錯進行 ===
+    jobs = []
     for fs, fe in fetch_ranges:
+        days = cal.trading_days(fs, fe)
+        for i in range(0, len(days), MARGIN_CHUNK_DAYS):
+            chunk = days[i:i + MARGIN_CHUNK_DAYS]
+            jobs.append((chunk[0], chunk[-1]))
+
+    # === 6) 抓取 → 解析 → 寫入 管線 ===
+    def fetch(job):
+        fs, fe = job
         print(f"📡 補 {fs.date()} ~ {fe.date()}")
-        raw = twse_api.fetch_margin_trading_range(fs, fe)
+        return twse_api.fetch_margin_trading_range(fs, fe)
+
+    def parse(job, raw):
         if raw is None or not raw.get("data"):
-            print("⚠ API 無回傳資料")
-            continue
+            print(f"⚠ API 無回傳資料：{job[0].date()} ~ {job[1].date()}")
+            return None
 
-        values = []
-        for r in raw["data"]:
-            try:
-                values.append((
-                    r[0].strip(),  # 日期 YYYYMMDD
-                    r[1].strip(),  # 項目
-                    int(r[2].replace(",", "")),
-                    int(r[3].replace(",", "")),
-                    int(r[4].replace(",", "")),
-                    int(r[5].replace(",", "")),
-                    int(r[6].replace(",", "")),
-                ))
-            except Exception:
-                continue
+        # 日期 YYYYMMDD、項目、5 個數字欄，整欄一次轉換
+        values, bad = parsing.parse_table(raw["data"], MARGIN_PARSE, required=MARGIN_COLS)
+        parsing.report_errors(f"融資餘額 {job[0].date()} ~ {job[1].date()}", raw["data"], bad)
+        values = values[~bad]
+        return values if not values.empty else None
 
-        db.execute_sql(f"""
-        INSERT OR REPLACE INTO {table}
-          (日期, 項目, 買進, 賣出, 現金_券_償還, 前日餘額, 今日餘額)
-        VALUES (?,?,?,?,?,?,?)
-        """, values)
-
-    # === 7) 更新 date_span ===
-    span = db.query_to_df("""
-        SELECT start_date, end_date
-        FROM date_span
-        WHERE target_table = ? AND idx_key = ?
-    """, (target_table, idx_key))
-
-    new_s = s.strftime("%Y%m%d")
-    new_e = e.strftime("%Y%m%d")
-
-    if span.empty:
-        db.execute_sql("""
-        INSERT INTO date_span (target_table, idx_key, start_date, end_date)
-        VALUES (?, ?, ?, ?)
-        """, (target_table, idx_key, new_s, new_e))
-    else:
-        cur_s = span.loc[0, "start_date"]
-        cur_e = span.loc[0, "end_date"]
-        db.execute_sql("""
-        UPDATE date_span
-        SET start_date = ?, end_date = ?, updated_at = strftime('%s','now')
-        WHERE target_table = ? AND idx_key = ?
-        """, (
-            min(cur_s, new_s),
-            max(cur_e, new_e),
-            target_table,
-            idx_key
-        ))
-
-    print("✅ 缺漏修補完成，date_span 已更新")
+    def write(job, df):
+        fs, fe = job
+        if db.bulk_upsert(table, df, key_cols=["日期", "項目"]) is None:
+            return
+
+        # 只標記這次真的寫入成功的區段
+        covered_e = coverage.settled_end(fe, pd.Timestamp(df["日期"].max()))
+        if covered_e is not None:
+            coverage.mark_covered(target_table, idx_key, fs, covered_e)
+
+    result = pipeline.run_pipeline(jobs, fetch, parse, write, fetch_workers=2, name="margin_repair")
+    pipeline.print_stats("repair_margin_trading_gaps", result)
+
+    print("✅ 缺漏修補完成")
 
 
 # =========================
@@ -263,47 +214,48 @@ def repair_margin_trading_gaps(
 _TWSE_HEADERS = {
     "User-Agent": "Mozilla/5.0"
 }
+ASYNC_CONCURRENCY = 4  # 非同步抓取時同時在途的請求數
 
 
-def _to_int(s: str) -> int:
-    if s is None:
-        return 0
-    s = str(s).strip().replace(",", "")
-    if s in ("", "-", "--"):
-        return 0
-    try:
-        return int(float(s))
-    except ValueError:
-        return 0
+# =========================
+# 月查詢 API 的非同步抓取
+# =========================
+async def afetch_month_bodies(url: str, month_starts: List[pd.Timestamp], tag: str) -> dict[pd.Timestamp, dict]:
+    """
+    同時送出多個月份的查詢（在途數量與速率由 scheduler 共用的 TWSE 限制控制）
+    回傳 {月初: JSON body}；請求失敗的月份不在結果內
+    """
+    def fetch(m_start: pd.Timestamp) -> dict:
+        params = {"response": "json", "date": m_start.strftime("%Y%m01")}
+        return http_client.get_json(url, params=params, headers=_TWSE_HEADERS)
+
+    bodies = {}
+    for m_start, body, err in await scheduler.agather_ordered(fetch, month_starts, ASYNC_CONCURRENCY):
+        if err is not None:
+            print(f"[TWSE {tag}] request error ({m_start.strftime('%Y%m01')}): {err}")
+            continue
+        bodies[m_start] = body
+    return bodies
 
 
-def _to_float(s: str) -> float:
-    if s is None:
-        return 0.0
-    s = str(s).strip().replace(",", "")
-    if s in ("", "-", "--"):
-        return 0.0
-    try:
-        return float(s)
-    except ValueError:
-        return 0.0
+def _fetch_month_bodies(url: str, month_starts: List[pd.Timestamp], tag: str) -> dict[pd.Timestamp, dict]:
+    return scheduler.run_async(afetch_month_bodies(url, month_starts, tag))
 
 
-def _iter_month_starts(start: pd.Timestamp, end: pd.Timestamp) -> List[pd.Timestamp]:
+def _month_rows(body: dict, tag: str, m_start: pd.Timestamp) -> list | None:
     """
-    給定 [start, end]，回傳所有「每月一號」的 Timestamp（含頭尾月）。
+    月查詢回應 → 資料列
+    - stat == OK：data 列
+    - TWSE 的查無資料訊息（「很抱歉，沒有符合條件的資料!」等）：[]，該月可以標記覆蓋
+    - 其他訊息（暫時性錯誤等）：None，不標記，下次再補
     """
-    cur = start.replace(day=1)
-    cur = pd.Timestamp(cur.year, cur.month, 1)
-
-    res: List[pd.Timestamp] = []
-    while cur <= end:
-        res.append(cur)
-        if cur.month == 12:
-            cur = pd.Timestamp(cur.year + 1, 1, 1)
-        else:
-            cur = pd.Timestamp(cur.year, cur.month + 1, 1)
-    return res
+    stat = str(body.get("stat", ""))
+    if stat == "OK":
+        return body.get("data", [])
+    if "無" in stat or "抱歉" in stat:
+        return []
+    print(f"[TWSE {tag}] 非預期的 stat ({m_start.strftime('%Y%m01')}): {stat}")
+    return None
 
 
 # =========================
@@ -329,15 +281,15 @@ def get_twse_exchangeReport_fmtqik(
       - created_at     INTEGER (DEFAULT strftime('%s','now'))
       - UNIQUE(date_ad)
 
-    span 記憶表：stock_span
+    覆蓋區間：date_coverage
       - target_table = 'twse_exchangeReport_fmtqik'
-      - stock_id     = 'MARKET'
+      - idx_key      = 'MARKET'
       - start_date / end_date 為 date_ad
     """
     print(f"--- run twse.get_twse_exchangeReport_fmtqik ---")
 
     target_table = "twse_exchangeReport_fmtqik"
-    span_sid = "MARKET"  # 當作 stock_id 用在 date_span
+    span_sid = "MARKET"  # date_coverage 的 idx_key
 
     req_s = pd.Timestamp(start_date).normalize()
     req_e = pd.Timestamp(end_date).normalize()
@@ -347,135 +299,66 @@ def get_twse_exchangeReport_fmtqik(
     def dstr(t: pd.Timestamp) -> str:
         return t.strftime("%Y-%m-%d")
 
-    # ---- 1) 查 span ----
-    span_row = db.query_to_df(
-        """
-        SELECT start_date, end_date
-        FROM date_span
-        WHERE target_table = ? AND idx_key = ?
-        """,
-        (target_table, span_sid),
+    # ---- 1) 補資料：依覆蓋缺口的月份呼叫 API，每個月成功寫入才標記該月在缺口內的那段 ----
+    insert_cols = [
+        "date", "date_ad", "date_ts",
+        "market_volume", "market_money", "trade_count",
+        "taiex_close", "taiex_spread",
+    ]
+
+    # 先列出要打的月份；缺口內沒有交易日的月份（例如只剩週末 / 春節）不打 API，直接標記
+    month_jobs = coverage.month_jobs(target_table, span_sid, req_s, req_e)
+
+    # 所有月份一起非同步抓（同一個月只打一次），再依月份順序寫入
+    bodies = _fetch_month_bodies(
+        "https://www.twse.com.tw/exchangeReport/FMTQIK",
+        sorted({m for m, _, _ in month_jobs}),
+        "FMTQIK",
     )
 
-    mem_s = pd.Timestamp(span_row.loc[0, "start_date"]).normalize() if not span_row.empty else None
-    mem_e = pd.Timestamp(span_row.loc[0, "end_date"]).normalize() if not span_row.empty else None
-
-    fetch_ranges: list[tuple[pd.Timestamp, pd.Timestamp]] = []
-
-    if mem_s is None:
-        fetch_ranges = [(req_s, req_e)]
-        new_s, new_e = req_s, req_e
-    else:
-        new_s = min(mem_s, req_s)
-        new_e = max(mem_e, req_e)
-
-        if req_s >= mem_s and req_e <= mem_e:
-            fetch_ranges = []
-        elif req_s > mem_e:
-            fetch_ranges = [(mem_e + pd.Timedelta(days=1), req_e)]
-        elif req_e < mem_s:
-            fetch_ranges = [(req_s, mem_s - pd.Timedelta(days=1))]
-        else:
-            if req_s < mem_s:
-                fetch_ranges.append((req_s, mem_s - pd.Timedelta(days=1)))
-            if req_e > mem_e:
-                fetch_ranges.append((mem_e + pd.Timedelta(days=1), req_e))
-
-    # ---- 2) 補資料：依「缺的日期區間」→ 拆成月份呼叫 API ----
-    insert_sql = """
-    INSERT OR IGNORE INTO twse_exchangeReport_fmtqik
-      (date, date_ad, date_ts,
-       market_volume, market_money, trade_count,
-       taiex_close, taiex_spread)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """
-
-    for fs, fe in fetch_ranges:
-        if fs > fe:
+    for m_start, clip_s, clip_e in month_jobs:
+        body = bodies.get(m_start)
+        if body is None:
+            # 請求失敗：不標記，下次再補
             continue
 
-        # 該缺口涵蓋的所有月份
-        for m_start in _iter_month_starts(fs, fe):
-            ymd = m_start.strftime("%Y%m01")
-            url = "https://www.twse.com.tw/exchangeReport/FMTQIK"
-            params = {"response": "json", "date": ymd}
-
-            try:
-                res = requests.get(url, params=params, headers=_TWSE_HEADERS, timeout=10)
-                res.raise_for_status()
-                body = res.json()
-            except Exception as e:
-                print(f"[TWSE FMTQIK] request error ({ymd}): {e}")
-                continue
-
-            if body.get("stat") != "OK":
-                # 沒資料就跳過該月
-                continue
+        # 查無資料視為該月沒有資料；其他 stat 不標記，下次再補
+        data_rows = _month_rows(body, "FMTQIK", m_start)
+        if data_rows is None:
+            continue
 
-            data_rows = body.get("data", [])
-            if not data_rows:
+        # row[0]: 民國日期 '114/12/24'；不在目前缺口的日期，仍然可以收進來，因為我們是把 span 擴大
+        insert_df, bad = parsing.parse_table(data_rows, {
+            "date": (0, "raw"),
+            "date_ad": (0, "roc_date"),
+            "date_ts": (0, "roc_ts"),
+            "market_volume": (1, "int"),   # 成交股數
+            "market_money": (2, "int"),    # 成交金額
+            "trade_count": (3, "int"),     # 交易筆數
+            "taiex_close": (4, "float"),   # 收盤指數
+            "taiex_spread": (5, "float"),  # 漲跌點數
+        }, required=["date_ad"])
+        parsing.report_errors(f"FMTQIK {m_start.strftime('%Y-%m')}", data_rows, bad)
+        insert_df = insert_df[insert_df["date_ad"].notna()]
+
+        last_date = None
+        if not insert_df.empty:
+            # 已存在的日期不覆寫（等同 INSERT OR IGNORE）
+            ok = db.bulk_upsert(
+                target_table,
+                insert_df[insert_cols],
+                key_cols=["date_ad"],
+                update_cols=[],
+            )
+            if ok is None:
                 continue
+            last_date = insert_df["date_ad"].max()
 
-            insert_params = []
-            for row in data_rows:
-                # row[0]: 民國日期 '114/12/24'
-                roc_date = str(row[0]).strip()
-                ts = utils.roc_to_unix(roc_date)
-                if ts is None:
-                    continue
-                dt_ad = datetime.fromtimestamp(ts).strftime("%Y-%m-%d")
-
-                # 不在目前缺口的日期，仍然可以收進來，因為我們是把 span 擴大
-                market_volume = _to_int(row[1])   # 成交股數
-                market_money = _to_int(row[2])    # 成交金額
-                trade_count = _to_int(row[3])     # 交易筆數
-                taiex_close = _to_float(row[4])   # 收盤指數
-                taiex_spread = _to_float(row[5])  # 漲跌點數
-
-                insert_params.append((
-                    roc_date,
-                    dt_ad,
-                    ts,
-                    market_volume,
-                    market_money,
-                    trade_count,
-                    taiex_close,
-                    taiex_spread,
-                ))
-
-            if insert_params:
-                db.execute_sql(insert_sql, insert_params)
-
-    # ---- 3) 依「實際有的資料」重新決定 span ----
-    span_cov = db.query_to_df(
-        f"""
-        SELECT MIN(date_ad) AS min_d, MAX(date_ad) AS max_d
-        FROM {target_table}
-        """
-    )
-
-    if not span_cov.empty and span_cov.loc[0, "max_d"] is not None:
-        real_s = pd.Timestamp(span_cov.loc[0, "min_d"]).normalize()
-        real_e = pd.Timestamp(span_cov.loc[0, "max_d"]).normalize()
-        # 避免把 span 設到超過這次要求的 end_date（API 可能還沒開出未來的日子）
-        real_e = min(real_e, req_e)
-    else:
-        # 沒資料就乾脆設成這次要求範圍
-        real_s, real_e = req_s, req_e
-
-    db.execute_sql(
-        """
-        INSERT INTO date_span (target_table, idx_key, start_date, end_date, updated_at)
-        VALUES (?, ?, ?, ?, strftime('%s','now'))
-        ON CONFLICT(target_table, idx_key) DO UPDATE SET
-          start_date = excluded.start_date,
-          end_date   = excluded.end_date,
-          updated_at = strftime('%s','now')
-        """,
-        (target_table, span_sid, dstr(real_s), dstr(real_e)),
-    )
+        covered_e = coverage.settled_end(clip_e, last_date)
+        if covered_e is not None:
+            coverage.mark_covered(target_table, span_sid, clip_s, covered_e)
 
-    # ---- 4) 一律從 DB 回傳 ----
+    # ---- 2) 一律從 DB 回傳 ----
     df = db.query_to_df(
         """
         SELECT
@@ -519,9 +402,9 @@ def get_twse_indicesReport_mi_5mins_hist(
       - created_at  INTEGER DEFAULT strftime('%s','now')
       - UNIQUE(date_ad)
 
-    span 記憶表：stock_span
+    覆蓋區間：date_coverage
       - target_table = 'twse_indicesReport_mi_5mins_hist'
-      - stock_id     = 'TAIEX'
+      - idx_key      = 'TAIEX'
     """
     print(f"--- run twse.get_twse_indicesReport_mi_5mins_hist ---")
 
@@ -536,129 +419,64 @@ def get_twse_indicesReport_mi_5mins_hist(
     def dstr(t: pd.Timestamp) -> str:
         return t.strftime("%Y-%m-%d")
 
-    # ---- 1) 查 span ----
-    span_row = db.query_to_df(
-        """
-        SELECT start_date, end_date
-        FROM date_span
-        WHERE target_table = ? AND idx_key = ?
-        """,
-        (target_table, span_sid),
-    )
-
-    mem_s = pd.Timestamp(span_row.loc[0, "start_date"]).normalize() if not span_row.empty else None
-    mem_e = pd.Timestamp(span_row.loc[0, "end_date"]).normalize() if not span_row.empty else None
+    # ---- 1) 補資料：依覆蓋缺口的月份呼叫 API，每個月成功寫入才標記該月在缺口內的那段 ----
+    insert_cols = [
+        "date", "date_ad", "date_ts",
+        "open_index", "high_index", "low_index", "close_index",
+    ]
 
-    fetch_ranges: list[tuple[pd.Timestamp, pd.Timestamp]] = []
+    # 先列出要打的月份；缺口內沒有交易日的月份（例如只剩週末 / 春節）不打 API，直接標記
+    month_jobs = coverage.month_jobs(target_table, span_sid, req_s, req_e)
 
-    if mem_s is None:
-        fetch_ranges = [(req_s, req_e)]
-        new_s, new_e = req_s, req_e
-    else:
-        new_s = min(mem_s, req_s)
-        new_e = max(mem_e, req_e)
-
-        if req_s >= mem_s and req_e <= mem_e:
-            fetch_ranges = []
-        elif req_s > mem_e:
-            fetch_ranges = [(mem_e + pd.Timedelta(days=1), req_e)]
-        elif req_e < mem_s:
-            fetch_ranges = [(req_s, mem_s - pd.Timedelta(days=1))]
-        else:
-            if req_s < mem_s:
-                fetch_ranges.append((req_s, mem_s - pd.Timedelta(days=1)))
-            if req_e > mem_e:
-                fetch_ranges.append((mem_e + pd.Timedelta(days=1), req_e))
-
-    # ---- 2) 補資料：依缺口的月份呼叫 API ----
-    insert_sql = """
-    INSERT OR IGNORE INTO twse_indicesReport_mi_5mins_hist
-      (date, date_ad, date_ts,
-       open_index, high_index, low_index, close_index)
-    VALUES (?, ?, ?, ?, ?, ?, ?)
-    """
+    # 所有月份一起非同步抓（同一個月只打一次），再依月份順序寫入
+    bodies = _fetch_month_bodies(
+        "https://www.twse.com.tw/indicesReport/MI_5MINS_HIST",
+        sorted({m for m, _, _ in month_jobs}),
+        "MI_5MINS_HIST",
+    )
 
-    for fs, fe in fetch_ranges:
-        if fs > fe:
+    for m_start, clip_s, clip_e in month_jobs:
+        body = bodies.get(m_start)
+        if body is None:
+            # 請求失敗：不標記，下次再補
             continue
 
-        for m_start in _iter_month_starts(fs, fe):
-            ymd = m_start.strftime("%Y%m01")
-            url = "https://www.twse.com.tw/indicesReport/MI_5MINS_HIST"
-            params = {"response": "json", "date": ymd}
-
-            try:
-                res = requests.get(url, params=params, headers=_TWSE_HEADERS, timeout=10)
-                res.raise_for_status()
-                body = res.json()
-            except Exception as e:
-                print(f"[TWSE MI_5MINS_HIST] request error ({ymd}): {e}")
-                continue
-
-            if body.get("stat") != "OK":
-                continue
+        # 查無資料視為該月沒有資料；其他 stat 不標記，下次再補
+        data_rows = _month_rows(body, "MI_5MINS_HIST", m_start)
+        if data_rows is None:
+            continue
 
-            data_rows = body.get("data", [])
-            if not data_rows:
+        # record[0]: 民國日期 '108/01/02'
+        insert_df, bad = parsing.parse_table(data_rows, {
+            "date": (0, "raw"),
+            "date_ad": (0, "roc_date"),
+            "date_ts": (0, "roc_ts"),
+            "open_index": (1, "float"),
+            "high_index": (2, "float"),
+            "low_index": (3, "float"),
+            "close_index": (4, "float"),
+        }, required=["date_ad"])
+        parsing.report_errors(f"MI_5MINS_HIST {m_start.strftime('%Y-%m')}", data_rows, bad)
+        insert_df = insert_df[insert_df["date_ad"].notna()]
+
+        last_date = None
+        if not insert_df.empty:
+            # 已存在的日期不覆寫（等同 INSERT OR IGNORE）
+            ok = db.bulk_upsert(
+                target_table,
+                insert_df[insert_cols],
+                key_cols=["date_ad"],
+                update_cols=[],
+            )
+            if ok is None:
                 continue
+            last_date = insert_df["date_ad"].max()
 
-            insert_params = []
-            for record in data_rows:
-                # record[0]: 民國日期 '108/01/02'
-                roc_date = str(record[0]).strip()
-                ts = utils.roc_to_unix(roc_date)
-                if ts is None:
-                    continue
-                dt_ad = datetime.fromtimestamp(ts).strftime("%Y-%m-%d")
-
-                open_price = _to_float(record[1])
-                high_price = _to_float(record[2])
-                low_price = _to_float(record[3])
-                close_price = _to_float(record[4])
-
-                insert_params.append((
-                    roc_date,
-                    dt_ad,
-                    ts,
-                    open_price,
-                    high_price,
-                    low_price,
-                    close_price,
-                ))
-
-            if insert_params:
-                db.execute_sql(insert_sql, insert_params)
-
-    # ---- 3) 依「實際有的資料」重新決定 span ----
-    span_cov = db.query_to_df(
-        f"""
-        SELECT MIN(date_ad) AS min_d, MAX(date_ad) AS max_d
-        FROM {target_table}
-        """
-    )
-
-    if not span_cov.empty and span_cov.loc[0, "max_d"] is not None:
-        real_s = pd.Timestamp(span_cov.loc[0, "min_d"]).normalize()
-        real_e = pd.Timestamp(span_cov.loc[0, "max_d"]).normalize()
-        # 避免把 span 設到超過這次要求的 end_date（API 可能還沒開出未來的日子）
-        real_e = min(real_e, req_e)
-    else:
-        # 沒資料就乾脆設成這次要求範圍
-        real_s, real_e = req_s, req_e
-
-    db.execute_sql(
-        """
-        INSERT INTO date_span (target_table, idx_key, start_date, end_date, updated_at)
-        VALUES (?, ?, ?, ?, strftime('%s','now'))
-        ON CONFLICT(target_table, idx_key) DO UPDATE SET
-          start_date = excluded.start_date,
-          end_date   = excluded.end_date,
-          updated_at = strftime('%s','now')
-        """,
-        (target_table, span_sid, dstr(real_s), dstr(real_e)),
-    )
+        covered_e = coverage.settled_end(clip_e, last_date)
+        if covered_e is not None:
+            coverage.mark_covered(target_table, span_sid, clip_s, covered_e)
 
-    # ---- 4) 一律從 DB 回傳 ----
+    # ---- 2) 一律從 DB 回傳 ----
     df = db.query_to_df(
         """
         SELECT
@@ -679,6 +497,224 @@ def get_twse_indicesReport_mi_5mins_hist(
     return df
 
 
+# =========================
+# 3) MI_INDEX 每日收盤行情：一個 request 拿一天所有上市股票
+#    table: fm_taiwan_stock_daily（欄位對齊 FinMind TaiwanStockPrice）
+#    date_coverage 與 finMind 逐檔抓取共用：idx_key = stock_id
+# =========================
+DAILY_PRICE_TABLE = "fm_taiwan_stock_daily"
+DAILY_PRICE_COLS = [  # 同 finMind.PRICE_COLS
+    "date", "stock_id", "Trading_Volume", "Trading_money",
+    "open", "max", "min", "close", "spread", "Trading_turnover",
+]
+TWSE_HOST = "www.twse.com.tw"
+
+
+def _parse_stock_day_all(day: pd.Timestamp, table: dict) -> tuple[List[str], pd.DataFrame]:
+    """
+    回傳 (當天表上所有股票代號, 有成交的日資料)
+    沒成交的股票價格是 "--"，不寫資料但一樣算已覆蓋
+    """
+    df = pd.DataFrame(table["data"], columns=table["fields"])
+
+    def num(col: str) -> pd.Series:
+        return parsing.to_number(df[col])[0]
+
+    # 漲跌(+/-) 欄是 HTML 片段，例如 <p style= color:green>-</p>
+    sign = df["漲跌(+/-)"].astype(str).str.contains("-", regex=False).map({True: -1.0, False: 1.0})
+    out = pd.DataFrame({
+        "date": day.strftime("%Y-%m-%d"),
+        "stock_id": df["證券代號"].astype(str).str.strip(),
+        "Trading_Volume": num("成交股數"),
+        "Trading_money": num("成交金額"),
+        "open": num("開盤價"),
+        "max": num("最高價"),
+        "min": num("最低價"),
+        "close": num("收盤價"),
+        "spread": (num("漲跌價差").fillna(0) * sign).round(2),
+        "Trading_turnover": num("成交筆數"),
+    })[DAILY_PRICE_COLS]
+    return out["stock_id"].tolist(), out[out["close"].notna()]
+
+
+def ingest_tw_stock_daily(days) -> dict | None:
+    """
+    逐交易日抓 MI_INDEX，寫入 fm_taiwan_stock_daily，並在同一個交易內標記當天所有股票的覆蓋
+    已知休市 / 查無資料的日子（負向快取）略過；回傳管線統計
+    """
+    days = negative_cache.filter_days(
+        twse_api.STOCK_DAY_ALL_NEG_SOURCE, twse_api.STOCK_DAY_ALL_NEG_KEY,
+        [pd.Timestamp(d).normalize() for d in days],
+    )
+    if not days:
+        return None
+
+    def fetch(day):
+        return twse_api.fetch_stock_day_all(day)
+
+    def parse(day, table):
+        if table is None:
+            return None
+        return _parse_stock_day_all(day, table)
+
+    def write(day, parsed):
+        stock_ids, df = parsed
+        if not df.empty and db.bulk_upsert(DAILY_PRICE_TABLE, df, key_cols=["date", "stock_id"]) is None:
+            return
+        covered_e = coverage.settled_end(day, day)
+        if covered_e is not None:
+            coverage.mark_covered_many(DAILY_PRICE_TABLE, ((sid, day, covered_e) for sid in stock_ids))
+
+    # TWSE 限速由 http_client / scheduler 控制，多開幾個 worker 只是讓等待重疊
+    result = pipeline.run_pipeline(days, fetch, parse, write, fetch_workers=2, name="twse_daily_all")
+    pipeline.print_stats("twse.ingest_tw_stock_daily", result)
+    return result
+
+
+# MI_INDEX 只有上市證券：代號 4～6 碼數字（ETF / 特別股可能帶一個英文字尾）；TAIEX 等指數、上櫃股票都不在表上
+MI_INDEX_ID_RE = re.compile(r"^\d{4,6}[A-Z]?$")
+# 某個交易日至少要有這麼多檔上市股票缺資料，才值得用一個全市場 request 取代逐檔抓
+MI_INDEX_MIN_STOCKS = 20
+
+
+def plan_tw_stock_daily(
+    gaps: dict[str, List[tuple[pd.Timestamp, pd.Timestamp]]],
+    otc_ids: set[str] | None = None,
+) -> List[pd.Timestamp]:
+    """
+    gaps：{stock_id: [(起, 迄), ...]}，逐檔抓取時每一段是一個 FinMind request（已去掉頭尾非交易日）
+    otc_ids：已知的上櫃 / 興櫃代號（代號格式跟上市一樣，只能靠清單排除）
+    估算兩種抓法各要多久，回傳應改用 MI_INDEX 逐日抓的交易日；空 list 表示逐檔抓比較快
+      - 只計 MI_INDEX 拿得到的股票；指數、上櫃股票不論如何都要逐檔抓
+      - 只考慮缺資料的上市股票 >= MI_INDEX_MIN_STOCKS 檔的交易日
+      - 逐檔：段數 / FinMind 速率；逐日：交易日數 / TWSE 速率
+    """
+    otc_ids = otc_ids or set()
+    listed = {
+        sid: ranges for sid, ranges in gaps.items()
+        if MI_INDEX_ID_RE.match(str(sid)) and sid not in otc_ids
+    }
+    n_stock_requests = sum(len(v) for v in listed.values())
+    if n_stock_requests == 0:
+        return []
+
+    cal = trading_calendar.get_calendar()
+    per_day: dict[pd.Timestamp, int] = {}
+    for ranges in listed.values():
+        for s, e in ranges:
+            for d in cal.trading_days(s, e):
+                per_day[d] = per_day.get(d, 0) + 1
+    days = sorted(d for d, n in per_day.items() if n >= MI_INDEX_MIN_STOCKS)
+    if not days:
+        return []
+    days = sorted(
+        pd.Timestamp(d) for d in negative_cache.filter_days(
+            twse_api.STOCK_DAY_ALL_NEG_SOURCE, twse_api.STOCK_DAY_ALL_NEG_KEY, days
+        )
+    )
+    if not days:
+        return []
+
+    per_stock_sec = n_stock_requests / scheduler.limiter(scheduler.FINMIND_HOST).base_rate
+    per_date_sec = len(days) / scheduler.limiter(TWSE_HOST).base_rate
+    if per_date_sec >= per_stock_sec:
+        return []
+    print(
+        f"🗓️ 改用 MI_INDEX 逐日抓取：{len(days)} 天（估 {per_date_sec:.0f}s）"
+        f"，逐檔需 {n_stock_requests} 次（估 {per_stock_sec:.0f}s）"
+    )
+    return days
+
+
+# =========================
+# 4) MI_MARGN 個股融資融券：一個 request 拿一天所有股票
+#    table: twse_margin_stock_daily（PK: date, stock_id）
+#    date_coverage：依日期記一組區間（idx_key = 'ALL'），不是每檔股票各記一組
+# =========================
+MARGIN_STOCK_TABLE = "twse_margin_stock_daily"
+MARGIN_STOCK_SPAN_KEY = "ALL"
+MARGIN_STOCK_COLS = [
+    "date", "stock_id",
+    "MarginPurchaseBuy", "MarginPurchaseSell", "MarginPurchaseCashRepayment",
+    "MarginPurchaseYesterdayBalance", "MarginPurchaseTodayBalance", "MarginPurchaseLimit",
+    "ShortSaleBuy", "ShortSaleSell", "ShortSaleCashRepayment",
+    "ShortSaleYesterdayBalance", "ShortSaleTodayBalance", "ShortSaleLimit",
+    "OffsetLoanAndShort", "Note",
+]
+
+
+def _parse_margin_stock_all(day: pd.Timestamp, table: dict) -> pd.DataFrame:
+    """欄位名稱融資 / 融券重複，依位置對應；數字欄一次整欄轉換"""
+    rows = [r[:2] + r[2:15] + [r[15] if len(r) > 15 else ""] for r in table["data"]]
+    raw = pd.DataFrame(rows, columns=["stock_id", "name"] + MARGIN_STOCK_COLS[2:])
+
+    out = pd.DataFrame({"date": day.strftime("%Y-%m-%d"), "stock_id": raw["stock_id"].astype(str).str.strip()})
+    for col in MARGIN_STOCK_COLS[2:-1]:
+        out[col] = parsing.to_number(raw[col], integer=True)[0]
+    out["Note"] = raw["Note"].astype(str).str.strip()
+    return out[out["stock_id"] != ""]
+
+
+def ingest_margin_stock_daily(start_date: datetime, end_date: datetime) -> dict | None:
+    """
+    補齊 [start_date, end_date] 的個股融資融券：只抓覆蓋缺口內的交易日，一天一個 request
+    每個交易日的工作連同它前面的非交易日一起標記覆蓋（週末 / 連假不會留下缺口）
+    """
+    req_s = pd.Timestamp(start_date).normalize()
+    req_e = pd.Timestamp(end_date).normalize()
+    if req_s > req_e:
+        raise ValueError("start_date 不可大於 end_date")
+
+    # === 1) 規劃：(交易日, 標記覆蓋起, 標記覆蓋迄) ===
+    jobs = coverage.day_jobs(MARGIN_STOCK_TABLE, MARGIN_STOCK_SPAN_KEY, req_s, req_e)
+
+    # 之前查過確定沒資料的日子略過
+    live_days = set(negative_cache.filter_days(
+        twse_api.MARGIN_NEG_SOURCE, twse_api.MARGIN_STOCK_NEG_KEY, [d for d, _, _ in jobs]
+    ))
+    jobs = [j for j in jobs if j[0] in live_days]
+    if not jobs:
+        return None
+
+    # === 2) 抓取 → 解析 → 寫入 ===
+    def fetch(job):
+        return twse_api.fetch_margin_stock_all(job[0])
+
+    def parse(job, table):
+        if table is None:
+            return None
+        return _parse_margin_stock_all(job[0], table)
+
+    def write(job, df):
+        day, span_s, span_e = job
+        if not df.empty and db.bulk_upsert(MARGIN_STOCK_TABLE, df, key_cols=["date", "stock_id"]) is None:
+            return
+        covered_e = coverage.settled_end(span_e, day)
+        if covered_e is not None:
+            coverage.mark_covered(MARGIN_STOCK_TABLE, MARGIN_STOCK_SPAN_KEY, span_s, covered_e)
+
+    result = pipeline.run_pipeline(jobs, fetch, parse, write, fetch_workers=2, name="twse_margin_stock")
+    pipeline.print_stats("twse.ingest_margin_stock_daily", result)
+    return result
+
+
+def get_margin_stock_daily(
+    stock_id: str | List[str] | None,
+    start_date: datetime,
+    end_date: datetime,
+) -> pd.DataFrame:
+    """個股融資融券（先補齊缺口再從 DB 讀）；stock_id=None 回傳全部股票"""
+    ingest_margin_stock_daily(start_date, end_date)
+
+    sql = f"SELECT {', '.join(MARGIN_STOCK_COLS)} FROM {MARGIN_STOCK_TABLE} WHERE date BETWEEN ? AND ?"
+    params: list = [pd.Timestamp(start_date).strftime("%Y-%m-%d"), pd.Timestamp(end_date).strftime("%Y-%m-%d")]
+    if stock_id is not None:
+        ids = [stock_id] if isinstance(stock_id, str) else list(stock_id)
+        sql += f" AND stock_id IN ({', '.join('?' * len(ids))})"
+        params += ids
+    return db.query_to_df(sql + " ORDER BY stock_id, date", tuple(params))
+
+
 # python -m module.twse
 if __name__ == "__main__":
     repair_margin_trading_gaps()
@@ -1,16 +1,20 @@
 import sys, os
 sys.path.append(os.path.dirname(__file__))
 
-import requests
-import pandas as pd
-from datetime import datetime, timedelta
+from datetime import datetime
 from dateutil.relativedelta import relativedelta
-from common import tools
+from common import trading_calendar, negative_cache, http_client, scheduler
 
 twseUrl = "https://www.twse.com.tw/rwd/zh"
 data_center = "../data/TwStockExchange"
 common_params = "response=json"
 
+# MI_MARGN（selectType=MS）查無資料時記在 negative_cache 的 source / idx_key
+MARGIN_NEG_SOURCE = "twse_MI_MARGN"
+MARGIN_NEG_KEY = "MS"
+
+FETCH_WORKERS = 3  # 區間版平行抓取的 worker 數
+
 # # ======== 1. 個股成交日資訊 (含快取、合併、清理機制) ========
 # # 日期,成交股數,成交金額,開盤價,最高價,最低價,收盤價,漲跌價差,成交筆數
 # def get_stock_day(stock_no: str, date: datetime | None = None) -> pd.DataFrame:
@@ -178,37 +182,38 @@ def fetch_margin_trading(date: datetime | None = None):
     apiParams = f"date={date_str}&selectType=MS&{common_params}"
     apiUrl = f"{twseUrl}/{apiEndpoint}?{apiParams}"
 
+    def skip(reason: str, msg: str):
+        print(f"[跳過] {msg}: {date_str}")
+        negative_cache.record(MARGIN_NEG_SOURCE, MARGIN_NEG_KEY, date, date, reason)
+        return None
+
     try:
-        res = requests.get(apiUrl, timeout=10)
+        res = http_client.get(apiUrl)
         text = res.text.strip()
 
-        # 1) 空白 → 假日 or TWSE 掛掉
+        # 1) 空白 → TWSE 掛掉（假日已由交易日曆排除）
         if text == "":
-            print(f"[跳過] TWSE 回傳空白（假日?）: {date_str}")
-            return None
+            return skip(negative_cache.EMPTY, "TWSE 回傳空白")
 
-        # 2) HTML → 被擋 or 維護
-        if text.startswith("<") or text.startswith("<!--"):
-            print(f"[跳過] TWSE 回傳 HTML（維護或被BAN）: {date_str}")
-            return None
-
-        # 3) 嘗試解析 JSON
+        # 2) 嘗試解析 JSON
         data = res.json()
 
+    except http_client.ThrottledError:
+        # 3) HTML → 被擋 or 維護（http_client 已退避重試過）
+        return skip(negative_cache.HTML, "TWSE 回傳 HTML（維護或被BAN）")
     except Exception as e:
+        # 網路錯誤不記負向快取，下次照樣重試
         print(f"[錯誤] JSON 解析失敗 {date_str}: {e}")
         return None
 
-    # 4) TWSE 自己給的錯誤訊息
+    # 4) TWSE 自己給的錯誤訊息（臨時休市等，過去日期視為永久）
     if "stat" in data and ("無" in data["stat"] or "抱歉" in data["stat"]):
-        print(f"[跳過] 無融資資料: {date_str}")
-        return None
+        return skip(negative_cache.HOLIDAY, "無融資資料")
 
     # 5) tables 結構不完整
     tables = data.get("tables")
     if not tables or "fields" not in tables[0] or "data" not in tables[0]:
-        print(f"[跳過] TWSE 回傳格式錯誤: {date_str}")
-        return None
+        return skip(negative_cache.FORMAT, "TWSE 回傳格式錯誤")
 
     return tables[0]
 
@@ -217,33 +222,101 @@ def fetch_margin_trading(date: datetime | None = None):
 def fetch_margin_trading_range(sDt: datetime, eDt: datetime):
     if sDt > eDt:
         return None
-    
-    data = []    
-    current = sDt
 
-    while current <= eDt:
-        currentData = fetch_margin_trading(current)
+    # 只打交易日（週末 / 國定假日不送 request），已知查無資料的日子也略過
+    days = trading_calendar.get_calendar().trading_days(sDt, eDt)
+    days = negative_cache.filter_days(MARGIN_NEG_SOURCE, MARGIN_NEG_KEY, list(days))
 
-        # 假日 or 無資料 or HTML → 跳過這一天
-        if currentData is None:
-            current += timedelta(days=1)
-            continue
-        
-        rows = currentData.get("data", [])
-        date_str = current.strftime("%Y%m%d")
+    # 平行抓取（TWSE 限速由 http_client / scheduler 控制），結果依日期順序合併
+    data = []
+    with scheduler.FetchScheduler(max_workers=FETCH_WORKERS) as sch:
+        for day, currentData, err in sch.imap(fetch_margin_trading, days):
+            # 無資料 or HTML or 例外 → 跳過這一天
+            if err is not None or currentData is None:
+                continue
 
-        for aRow in rows:
-            aRow.insert(0, date_str)
+            rows = currentData.get("data", [])
+            date_str = day.strftime("%Y%m%d")
+
+            for aRow in rows:
+                aRow.insert(0, date_str)
+
+            data.extend(rows)
 
-        data.extend(rows)
-        current += timedelta(days=1)
-        
     return {
         "fields": ['日期', '項目', '買進', '賣出', '現金_券_償還', '前日餘額', '今日餘額'],
         "data": data
     }
 
 
+# ======== 4.3 融資融券餘額 區間版（asyncio） ========
+# 日期,項目,買進,賣出,現金_券_償還,前日餘額,今日餘額
+async def afetch_margin_trading_range(sDt: datetime, eDt: datetime, concurrency: int = FETCH_WORKERS):
+    """
+    fetch_margin_trading_range 的 asyncio 版本：同時最多 concurrency 個請求在途，
+    速率由 http_client 共用的 TWSE token bucket 控制；回傳格式相同，data 依日期排序
+    """
+    if sDt > eDt:
+        return None
+
+    days = trading_calendar.get_calendar().trading_days(sDt, eDt)
+    days = negative_cache.filter_days(MARGIN_NEG_SOURCE, MARGIN_NEG_KEY, list(days))
+
+    data = []
+    for day, currentData, err in await scheduler.agather_ordered(fetch_margin_trading, days, concurrency):
+        if err is not None or currentData is None:
+            continue
+        date_str = day.strftime("%Y%m%d")
+        data.extend([date_str] + aRow for aRow in currentData.get("data", []))
+
+    return {
+        "fields": ['日期', '項目', '買進', '賣出', '現金_券_償還', '前日餘額', '今日餘額'],
+        "data": data
+    }
+
+
+# ======== 3.3 三大法人買賣金額統計（BFI82U） ========
+# 單位名稱,買進金額,賣出金額,買賣差額
+def fetch_institutional_investors(date: datetime):
+    date_str = date.strftime("%Y%m%d")
+    apiEndpoint = "fund/BFI82U"
+    apiParams = f"type=day&dayDate={date_str}&weekDate={date_str}&monthDate={date_str}&{common_params}"
+    apiUrl = f"{twseUrl}/{apiEndpoint}?{apiParams}"
+
+    data = http_client.get_json(apiUrl)
+
+    # 如果 API 回傳不是 OK 或沒有資料，視為當日無資料
+    if data.get("stat") != "OK" or "data" not in data:
+        print(f"⚠️ {date_str} 沒有資料，已跳過")
+        return None
+    return data
+
+# ======== 3.4 三大法人 區間版（asyncio） ========
+# 日期,單位名稱,買進金額,賣出金額,買賣差額
+async def afetch_institutional_investors_range(sDt: datetime, eDt: datetime, concurrency: int = FETCH_WORKERS):
+    """逐交易日查 BFI82U，同時最多 concurrency 個請求在途；回傳 {"fields", "data"}，data 依日期排序"""
+    if sDt > eDt:
+        return None
+
+    days = trading_calendar.get_calendar().trading_days(sDt, eDt)
+
+    fields, data = None, []
+    for day, dayData, err in await scheduler.agather_ordered(fetch_institutional_investors, days, concurrency):
+        if err is not None:
+            print(f"[錯誤] BFI82U {day.strftime('%Y%m%d')}: {err}")
+            continue
+        if dayData is None:
+            continue
+        fields = fields or ["日期"] + dayData.get("fields", [])
+        date_str = day.strftime("%Y%m%d")
+        data.extend([date_str] + aRow for aRow in dayData["data"])
+
+    return {"fields": fields or ["日期"], "data": data}
+
+def fetch_institutional_investors_range(sDt: datetime, eDt: datetime):
+    return scheduler.run_async(afetch_institutional_investors_range(sDt, eDt))
+
+
 # ======== 5. 注意股公告 ========
 # 編號,證券代號,證券名稱,累計次數,注意交易資訊,日期,收盤價,本益比
 def fetch_notice(sDt: datetime | None = None, eDt: datetime | None = None):
@@ -264,12 +337,74 @@ def fetch_notice(sDt: datetime | None = None, eDt: datetime | None = None):
     apiParams += f"&startDate={start_str}&endDate={end_str}"
     apiUrl = f"{twseUrl}/{apiEndpoint}?{apiParams}"
 
-    res = requests.get(apiUrl)
-    raw_data = res.json()
-    df = pd.DataFrame(raw_data.get("data", []), columns=raw_data.get("fields", []))
-    tools._save_to_csv(df, apiEndpoint, f"{start_str}_{end_str}")
-    del df
-    return raw_data
+    # 原始回應由 http_client 存進 raw_cache，不再另外輸出 CSV
+    return http_client.get_json(apiUrl)
+
+
+# ======== 6. 每日收盤行情（全部上市股票，不含權證、牛熊證） ========
+# 一個 request 拿到一個交易日所有上市股票的開高低收量
+STOCK_DAY_ALL_NEG_SOURCE = "twse_MI_INDEX"
+STOCK_DAY_ALL_NEG_KEY = "ALLBUT0999"
+STOCK_DAY_ALL_FIELDS = [
+    "證券代號", "成交股數", "成交筆數", "成交金額",
+    "開盤價", "最高價", "最低價", "收盤價", "漲跌(+/-)", "漲跌價差",
+]
+
+def fetch_stock_day_all(date: datetime):
+    """回傳「每日收盤行情」表 {"fields", "data"}；休市 / 尚未開出時回傳 None 並記入負向快取"""
+    date_str = date.strftime("%Y%m%d")
+    apiEndpoint = "afterTrading/MI_INDEX"
+    apiParams = f"date={date_str}&type={STOCK_DAY_ALL_NEG_KEY}&{common_params}"
+    apiUrl = f"{twseUrl}/{apiEndpoint}?{apiParams}"
+
+    data = http_client.get_json(apiUrl)
+    if data.get("stat") != "OK":
+        print(f"[跳過] 每日收盤行情無資料: {date_str}")
+        negative_cache.record(
+            STOCK_DAY_ALL_NEG_SOURCE, STOCK_DAY_ALL_NEG_KEY, date, date, negative_cache.HOLIDAY
+        )
+        return None
+
+    # tables 內有大盤指數、漲跌統計等多張表，找有個股欄位的那張
+    for table in data.get("tables", []):
+        fields = table.get("fields", [])
+        if all(f in fields for f in STOCK_DAY_ALL_FIELDS):
+            return table
+
+    negative_cache.record(
+        STOCK_DAY_ALL_NEG_SOURCE, STOCK_DAY_ALL_NEG_KEY, date, date, negative_cache.FORMAT
+    )
+    return None
+
+
+# ======== 7. 個股融資融券（全部股票） ========
+# 代號,名稱,融資(買進,賣出,現金償還,前日餘額,今日餘額,次一營業日限額),
+#          融券(買進,賣出,現券償還,前日餘額,今日餘額,次一營業日限額),資券互抵,註記
+MARGIN_STOCK_NEG_KEY = "ALL"
+MARGIN_STOCK_N_FIELDS = 16
+
+def fetch_margin_stock_all(date: datetime):
+    """回傳「融資融券彙總」表 {"fields", "data"}（一天所有股票）；休市 / 尚未開出時回傳 None"""
+    date_str = date.strftime("%Y%m%d")
+    apiEndpoint = "marginTrading/MI_MARGN"
+    apiParams = f"date={date_str}&selectType={MARGIN_STOCK_NEG_KEY}&{common_params}"
+    apiUrl = f"{twseUrl}/{apiEndpoint}?{apiParams}"
+
+    data = http_client.get_json(apiUrl)
+    if data.get("stat") != "OK":
+        print(f"[跳過] 個股融資融券無資料: {date_str}")
+        negative_cache.record(MARGIN_NEG_SOURCE, MARGIN_STOCK_NEG_KEY, date, date, negative_cache.HOLIDAY)
+        return None
+
+    # tables[0] 是市場合計（同 selectType=MS），個股表的第一欄是「代號」
+    for table in data.get("tables", []):
+        fields = table.get("fields", [])
+        if len(fields) >= MARGIN_STOCK_N_FIELDS and fields[0] == "代號":
+            return table
+
+    negative_cache.record(MARGIN_NEG_SOURCE, MARGIN_STOCK_NEG_KEY, date, date, negative_cache.FORMAT)
+    return None
+
 
 # ======== 範例測試 ========
 if __name__ == "__main__":